@@ -1,62 +1,56 @@
 import os
+from multiprocessing import Pool, cpu_count
+import numpy as np
+import position_arrays
+import position_store
 
-def classify_satellites():
-    """Read satellite position file and classify by last column"""
+# Output file name of each constellation tag
+CONSTELLATION_FILES = {1: "starlink_gs.txt", 2: "kuiper_gs.txt", 3: "telesat_gs.txt"}
+
+def format_positions(longitude, latitude, altitude, tag, sat_id):
+    """
+    Positions of one constellation as "lon lat alt tag sat_id" lines, formatted in one operation.
+    The global satellite ID comes last so readers of the first four fields are unaffected.
+    """
+    values = np.column_stack([longitude, latitude, altitude, sat_id]).astype(np.float64).ravel().tolist()
+    return (f"%.2f %.2f %.2f {tag} %d\n" * len(longitude)) % tuple(values)
+
+def classify_satellites(store_path=position_store.POSITION_STORE_FILE, time_step=3500):
+    """Read satellite positions of one time step (1-based) from the position store and classify by shell tag"""
     
     # Input file path
-    input_file = "SatellitePositions/time_step_3500.txt"
+    input_file = store_path
     
     # Ensure output directory exists
     output_dir = "classified_gs"
     os.makedirs(output_dir, exist_ok=True)
     
     # Output file paths
-    output_files = {
-        1: os.path.join(output_dir, "starlink_gs.txt"),
-        2: os.path.join(output_dir, "kuiper_gs.txt"),
-        3: os.path.join(output_dir, "telesat_gs.txt")
-    }
-    
-    # Initialize output files (clear content)
-    for file_path in output_files.values():
-        with open(file_path, 'w') as f:
-            pass  # Create empty file
+    output_files = {tag: os.path.join(output_dir, name) for tag, name in CONSTELLATION_FILES.items()}
     
     # Statistics counters
     counts = {1: 0, 2: 0, 3: 0}
     
-    # Read input file and classify
+    # Open the position store (memory-mapped, nothing is parsed)
     try:
-        with open(input_file, 'r') as f:
-            for line_num, line in enumerate(f, 1):
-                line = line.strip()
-                if not line:
-                    continue
-                
-                parts = line.split()
-                if len(parts) < 4:
-                    print(f"Warning: Line {line_num} format incorrect: {line}")
-                    continue
-                
-                try:
-                    # Parse last column (tag)
-                    tag = int(parts[-1])
-                    
-                    if tag in output_files:
-                        # Write entire line to corresponding file
-                        with open(output_files[tag], 'a') as f:
-                            f.write(line + '\n')
-                        counts[tag] += 1
-                    else:
-                        print(f"Warning: Line {line_num} unknown tag: {tag}")
-                        
-                except ValueError:
-                    print(f"Warning: Line {line_num} tag cannot be parsed as integer: {parts[-1]}")
-                    
+        satellites = position_arrays.SatellitePositions.from_store(input_file)
     except FileNotFoundError:
         print(f"Error: Input file not found {input_file}")
         return
     
+    longitude, latitude, altitude = satellites.time_step_positions(time_step - 1)
+    tags = satellites.shell
+    unknown_tags = np.setdiff1d(tags, list(output_files))
+    if len(unknown_tags) > 0:
+        print(f"Warning: unknown tags: {unknown_tags.tolist()}")
+    
+    # Write each constellation in one go, in the "lon lat alt tag sat_id" text format
+    for tag, file_path in output_files.items():
+        mask = tags == tag
+        with open(file_path, 'w') as f:
+            f.write(format_positions(longitude[mask], latitude[mask], altitude[mask], tag, satellites.sat_id[mask]))
+        counts[tag] = int(mask.sum())
+    
     # Print statistics
     print("Classification completed! Statistics:")
     print(f"Starlink (tag 1): {counts[1]} satellites")
@@ -71,5 +65,57 @@ def classify_satellites():
             constellation_names = {1: "Starlink", 2: "Kuiper", 3: "Telesat"}
             print(f"{constellation_names[tag]}: {file_path}")
 
+def classify_time_step_chunk(args):
+    """Split the time steps [begin, end) (0-based) of the store into one file per (constellation tag, time step)"""
+    store_path, begin, end, output_dir = args
+    satellites = position_arrays.SatellitePositions.from_store(store_path)
+    # Column indexes of each constellation, computed once for the whole chunk
+    columns = {tag: satellites.shell_columns(tag) for tag in CONSTELLATION_FILES}
+    # Read the chunk as one contiguous block of rows
+    longitude = np.asarray(satellites.longitude[begin:end])
+    latitude = np.asarray(satellites.latitude[begin:end])
+    altitude = np.asarray(satellites.altitude[begin:end])
+    for row in range(end - begin):
+        time_step_dir = os.path.join(output_dir, "time_step_" + str(begin + row + 1))
+        os.makedirs(time_step_dir, exist_ok=True)
+        for tag, name in CONSTELLATION_FILES.items():
+            column = columns[tag]
+            with open(os.path.join(time_step_dir, name), 'w', buffering=1 << 20) as f:
+                f.write(format_positions(longitude[row, column], latitude[row, column], altitude[row, column], tag,
+                                         satellites.sat_id[column]))
+    return end - begin
+
+def classify_time_steps(store_path=position_store.POSITION_STORE_FILE, first_time_step=1, last_time_step=None,
+                        output_dir="classified_gs", processes=None, chunk_size=64):
+    """
+    Classify a range of time steps (1-based, inclusive; all of them by default) in one pass over the store.
+    Every (constellation tag, time step) pair is written once to <output_dir>/time_step_<t>/<constellation>_gs.txt.
+    :param processes: Number of worker processes, defaults to the number of CPU cores
+    :param chunk_size: Number of consecutive time steps handled by one task
+    :return: Number of time steps written
+    """
+    try:
+        store = position_store.open_position_store(store_path)
+    except FileNotFoundError:
+        print(f"Error: Input file not found {store_path}")
+        return 0
+    if last_time_step is None:
+        last_time_step = store.num_time_steps
+    if not 1 <= first_time_step <= last_time_step <= store.num_time_steps:
+        raise ValueError(f"time steps {first_time_step}..{last_time_step} outside 1..{store.num_time_steps}")
+    
+    tasks = [(store_path, begin, min(begin + chunk_size, last_time_step), output_dir)
+             for begin in range(first_time_step - 1, last_time_step, chunk_size)]
+    processes = min(processes or cpu_count(), len(tasks))
+    if processes == 1:
+        written = sum(map(classify_time_step_chunk, tasks))
+    else:
+        with Pool(processes) as pool:
+            written = sum(pool.imap_unordered(classify_time_step_chunk, tasks))
+    print(f"Classified {written} time steps into {output_dir}")
+    return written
+
 if __name__ == "__main__":
     classify_satellites()
+    # 一次性拆分全部时间步
+    # classify_time_steps()
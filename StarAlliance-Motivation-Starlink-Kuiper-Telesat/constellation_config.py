@@ -0,0 +1,190 @@
+
+import functools
+import hashlib
+import json
+import os
+import xml.etree.ElementTree as ET
+import numpy as np
+import propagation
+
+
+SECONDS_PER_DAY = 86400
+
+
+def parse_bool(text):
+    return str(text).strip().lower() in ("1", "true", "yes")
+
+
+class ShellSpec:
+    """One validated shell; base_id and mean motion are derived once when the constellation is parsed"""
+
+    __slots__ = ("altitude", "orbit_cycle", "inclination", "number_of_orbit", "number_of_satellite_per_orbit",
+                 "phase_shift", "base_id", "mean_motion", "remaining_orbits")
+
+    def __init__(self, altitude, orbit_cycle, inclination, number_of_orbit, number_of_satellite_per_orbit,
+                 phase_shift=True, base_id=0, remaining_orbits=None):
+        if altitude <= 0:
+            raise ValueError(f"altitude must be positive, got {altitude}")
+        if orbit_cycle <= 0:
+            raise ValueError(f"orbit_cycle must be positive, got {orbit_cycle}")
+        if not 0 <= inclination <= 180:
+            raise ValueError(f"inclination must be within [0, 180] degrees, got {inclination}")
+        if number_of_orbit <= 0 or number_of_satellite_per_orbit <= 0:
+            raise ValueError(f"shell needs at least one orbit and one satellite per orbit, "
+                             f"got {number_of_orbit} x {number_of_satellite_per_orbit}")
+        if remaining_orbits is not None:
+            remaining_orbits = tuple(sorted(int(orbit) for orbit in remaining_orbits))
+            if remaining_orbits and not 0 <= remaining_orbits[0] <= remaining_orbits[-1] < number_of_orbit:
+                raise ValueError(f"remaining orbits must be within [0, {number_of_orbit})")
+        set_field = object.__setattr__
+        set_field(self, "altitude", int(altitude))
+        set_field(self, "orbit_cycle", int(orbit_cycle))
+        set_field(self, "inclination", float(inclination))
+        set_field(self, "number_of_orbit", int(number_of_orbit))
+        set_field(self, "number_of_satellite_per_orbit", int(number_of_satellite_per_orbit))
+        set_field(self, "phase_shift", bool(phase_shift))
+        set_field(self, "base_id", int(base_id))
+        # Mean motion: number of satellite orbits per day
+        set_field(self, "mean_motion", 1.0 * SECONDS_PER_DAY / orbit_cycle)
+        set_field(self, "remaining_orbits", remaining_orbits)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ShellSpec is immutable, use with_orbits() to derive a new one")
+
+    def __repr__(self):
+        return (f"ShellSpec(altitude={self.altitude}, orbit_cycle={self.orbit_cycle}, "
+                f"inclination={self.inclination}, number_of_orbit={self.number_of_orbit}, "
+                f"number_of_satellite_per_orbit={self.number_of_satellite_per_orbit}, "
+                f"phase_shift={self.phase_shift}, base_id={self.base_id}, remaining_orbits={self.remaining_orbits})")
+
+    @property
+    def number_of_satellites(self):
+        """Number of satellites in the full shell (the ID range reserved for it)"""
+        return self.number_of_orbit * self.number_of_satellite_per_orbit
+
+    def with_orbits(self, remaining_orbits):
+        return ShellSpec(self.altitude, self.orbit_cycle, self.inclination, self.number_of_orbit,
+                         self.number_of_satellite_per_orbit, self.phase_shift, self.base_id, remaining_orbits)
+
+    def as_list(self):
+        """
+        Positional shell list used by the propagation and visualization functions
+        :return: [mean_motion, altitude, number_of_orbit, number_of_satellite_per_orbit, inclination, base_id]
+                 plus the kept orbits when the shell was pruned
+        """
+        shell = [self.mean_motion, self.altitude, self.number_of_orbit, self.number_of_satellite_per_orbit,
+                 self.inclination, self.base_id]
+        if self.remaining_orbits is not None:
+            shell.append(list(self.remaining_orbits))
+        return shell
+
+    def sat_ids(self):
+        return propagation.shell_sat_ids(self.as_list())
+
+    def key(self):
+        return [self.altitude, self.orbit_cycle, self.inclination, self.number_of_orbit,
+                self.number_of_satellite_per_orbit, self.phase_shift, self.base_id,
+                None if self.remaining_orbits is None else list(self.remaining_orbits)]
+
+
+class ConstellationSpec:
+    """Parsed constellation: an ordered tuple of ShellSpec with consecutive satellite ID ranges"""
+
+    __slots__ = ("name", "shells")
+
+    def __init__(self, name, shells):
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "shells", tuple(shells))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ConstellationSpec is immutable")
+
+    def __repr__(self):
+        return f"ConstellationSpec(name={self.name!r}, shells={list(self.shells)!r})"
+
+    def __len__(self):
+        return len(self.shells)
+
+    def __iter__(self):
+        return iter(self.shells)
+
+    @property
+    def number_of_satellites(self):
+        return sum(len(shell.sat_ids()) for shell in self.shells)
+
+    def stable_hash(self):
+        """SHA-256 of the shell parameters, identical across runs and machines (the name is not part of it)"""
+        content = json.dumps([shell.key() for shell in self.shells], sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def constellation_information(self):
+        return [shell.as_list() for shell in self.shells]
+
+    def phase_shifts(self):
+        return [shell.phase_shift for shell in self.shells]
+
+    def with_orbits(self, remaining_orbits):
+        """Same constellation keeping only the given orbits of each shell (one list per shell)"""
+        return ConstellationSpec(self.name, [shell.with_orbits(orbits)
+                                             for shell, orbits in zip(self.shells, remaining_orbits)])
+
+    def sat_ids(self):
+        return np.concatenate([shell.sat_ids() for shell in self.shells])
+
+    def propagate(self, start_time, time_step, num_time_steps):
+        """propagation.propagate_constellation with each shell's own phase_shift"""
+        return propagation.propagate_constellation(self.constellation_information(), start_time, time_step,
+                                                   num_time_steps, self.phase_shifts())
+
+
+def parse_constellation(root, name=None):
+    """
+    Build a ConstellationSpec from the <constellation> element of a StarPerf constellation XML
+    :param root: xml.etree.ElementTree element
+    :param name: Constellation name
+    :return: ConstellationSpec
+    """
+    def field(shell_element, tag, convert, default=None):
+        text = shell_element.findtext(tag)
+        if text is None:
+            if default is None:
+                raise ValueError(f"{shell_element.tag} is missing <{tag}>")
+            return default
+        return convert(text.strip())
+
+    number_of_shells = int(root.findtext("number_of_shells"))
+    shells = []
+    base_id = 0
+    for count in range(1, number_of_shells + 1):
+        shell_element = root.find("shell" + str(count))
+        if shell_element is None:
+            raise ValueError(f"number_of_shells is {number_of_shells} but <shell{count}> is missing")
+        shell = ShellSpec(field(shell_element, "altitude", int),
+                          field(shell_element, "orbit_cycle", int),
+                          field(shell_element, "inclination", float),
+                          field(shell_element, "number_of_orbit", int),
+                          field(shell_element, "number_of_satellite_per_orbit", int),
+                          field(shell_element, "phase_shift", parse_bool, True),
+                          base_id)
+        shells.append(shell)
+        # The next shell starts right after this one
+        base_id += shell.number_of_satellites
+    return ConstellationSpec(name, shells)
+
+
+@functools.lru_cache(maxsize=256)
+def _load_constellation(path, modification_time, name):
+    return parse_constellation(ET.parse(path).getroot(), name)
+
+
+def load_constellation(xml_file_path, name=None):
+    """
+    Parse and validate a constellation XML file once; reloading an unchanged file returns the cached spec
+    :param xml_file_path: Path of the XML file
+    :param name: Constellation name, defaults to the file name without extension
+    :return: ConstellationSpec
+    """
+    path = os.path.abspath(xml_file_path)
+    if name is None:
+        name = os.path.splitext(os.path.basename(path))[0]
+    return _load_constellation(path, os.stat(path).st_mtime_ns, name)
@@ -1,24 +1,39 @@
 
-import xml.etree.ElementTree as ET
 import math
+import os
+import sys
 import ephem
+import datetime
+import numpy as np
 
+# The samples import this file as part of a package (visualization.constellation_visualization); its sibling
+# modules import each other by bare name, so they are resolved from this directory in either case
+if os.path.dirname(os.path.abspath(__file__)) not in sys.path:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import constellation_config
+import czml_export
+import isl_graph
+import orbit_pruning
+import propagation
+import propagation_cache
 
 
 
 
 
-def add_coverage_circle(satellite, coverage_radius, color="BLUE"):
+
+def add_coverage_circle_at(longitude, latitude, coverage_radius, color="BLUE"):
     """
-    Add coverage range circle
-    :param satellite: Satellite object
+    Add coverage range circle centred on a sub-satellite point
+    :param longitude: Sub-satellite longitude in degrees
+    :param latitude: Sub-satellite latitude in degrees
     :param coverage_radius: Coverage range radius
     :param color: Circle color
     :return: JavaScript code string
     """
     return "var coverageCircle = viewer.entities.add({name : '', position: Cesium.Cartesian3.fromDegrees(" \
-           + str(math.degrees(satellite.sublong)) + ", " \
-           + str(math.degrees(satellite.sublat)) + ", 0), " \
+           + str(longitude) + ", " \
+           + str(latitude) + ", 0), " \
            + "ellipse : {semiMajorAxis : " + str(coverage_radius) + ", semiMinorAxis : " + str(coverage_radius) + ", " \
            + "material : Cesium.Color." + color + ".withAlpha(0.2),}});\n"
 
@@ -38,11 +53,11 @@ def get_satellites_list(
         phase_shift = True,  # Phase shift between adjacent orbits
         eccentricity = 0.0000001,  # Orbital eccentricity
         arg_perigee = 0.0,   # Argument of perigee
-        epoch = "1949-10-01 00:00:00" # Reference epoch
+        epoch = "1949-10-01 00:00:00", # Reference epoch
+        base_id = 0  # Global ID of the first satellite of the shell
         ):
     satellites = [None] * (number_of_orbit * number_of_satellite_per_orbit)
     count = 0
-    sat_id = 1
     for orbit in range(0, number_of_orbit):
         raan = orbit * 360 / number_of_orbit
         orbit_wise_shift = 0
@@ -67,9 +82,9 @@ def get_satellites_list(
                 "altitude": altitude,
                 "orbit": orbit,
                 "orbit_satellite_id": n_sat,
-                "sat_id":sat_id
+                # Global ID, the same as propagation.shell_sat_ids and the sat_id column of the position store
+                "sat_id": base_id + orbit * number_of_satellite_per_orbit + n_sat
             }
-            sat_id += 1
             count += 1
 
     return satellites
@@ -77,215 +92,134 @@ def get_satellites_list(
 
 
 
-# Get neighboring satellites
-def get_neighbor_satellite(
-        sat1_orb,sat1_rel_id,sat2_orb,sat2_rel_id,satellite,
-        number_of_orbit, number_of_satellite_per_orbit):
-    neighbor_abs_orb = (sat1_orb + sat2_orb) % number_of_orbit
-    neighbor_abs_pos = (sat1_rel_id + sat2_rel_id) % number_of_satellite_per_orbit
-    sel_sat_id = -1
-    for i in range(0, len(satellite)):
-        if (satellite[i]["orbit"] == neighbor_abs_orb and
-                satellite[i]["orbit_satellite_id"] == neighbor_abs_pos):
-            sel_sat_id = i
-            break
-    return sel_sat_id
-
-
-
-
-
-# Get Inter-Satellite Links (ISL) between satellites
-def get_ISL(satellite, number_of_orbit, number_of_satellite_per_orbit):
-    links = {}
-    count = 0
-    for i in range(0, len(satellite)):
-        sel_sat_id = get_neighbor_satellite(satellite[i]["orbit"],
-                                            satellite[i]["orbit_satellite_id"],
-                                            0, 1, satellite,
-                                            number_of_orbit, number_of_satellite_per_orbit)
-        links[count] = {
-            "sat1": i,
-            "sat2": sel_sat_id,
-            "dist": -1.0
-        }
-        count += 1
-    return links
-
-
-def xml_to_dict(element):
-    if len(element) == 0:
-        return element.text
-    result = {}
-    for child in element:
-        child_data = xml_to_dict(child)
-        if child.tag in result:
-            if type(result[child.tag]) is list:
-                result[child.tag].append(child_data)
-            else:
-                result[child.tag] = [result[child.tag], child_data]
-        else:
-            result[child.tag] = child_data
-    return result
-
-def read_xml_file(file_path):
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-    return {root.tag: xml_to_dict(root)}
-
+# Instant shown by the static (single snapshot) pages
+SNAPSHOT_TIME = datetime.datetime(1949, 10, 1, 0, 0, 0)
 
 
+def snapshot_positions(constellation_spec, snapshot_time=SNAPSHOT_TIME):
+    """
+    Positions of every satellite at one instant, read from (or added to) the propagation cache
+    :param constellation_spec: constellation_config.ConstellationSpec
+    :return: (longitude, latitude, altitude, shell): (N,) arrays in position store column order,
+             altitude in km and shell the 1-based shell of each column
+    """
+    store = propagation_cache.cached_propagate_constellation(constellation_spec, snapshot_time,
+                                                             datetime.timedelta(seconds=1), 1)
+    return (np.asarray(store.longitude[0]), np.asarray(store.latitude[0]), np.asarray(store.altitude[0]),
+            np.asarray(store.shell))
 
 
-def visualization_constellation_without_ISL(constellation_information, shell_colors, coverage_radius=600000):
+def visualization_constellation_without_ISL(constellation_spec, shell_colors, coverage_radius=600000):
     content_string = ""
-    for shell_index, shell in enumerate(constellation_information):
-        mean_motion_rev_per_day = shell[0]
-        altitude = shell[1]
-        number_of_orbit = shell[2]
-        number_of_satellite_per_orbit = shell[3]
-        inclination = shell[4]
-        base_id = shell[5]
-
+    longitude, latitude, altitude, shell = snapshot_positions(constellation_spec)
+    for shell_index in range(len(constellation_spec)):
         # Get current shell color
         satellite_color = shell_colors[shell_index % len(shell_colors)]
 
-        satellites = get_satellites_list(mean_motion_rev_per_day, altitude, number_of_orbit,
-                                         number_of_satellite_per_orbit, inclination)
-
-        for j in range(len(satellites)):
-            satellites[j]["satellite"].compute("1949-10-01 00:00:00")
+        columns = shell == shell_index + 1
+        for sat_longitude, sat_latitude, sat_altitude in zip(longitude[columns].tolist(), latitude[columns].tolist(),
+                                                             altitude[columns].tolist()):
             content_string += "var redSphere = viewer.entities.add({name : '', position: Cesium.Cartesian3.fromDegrees(" \
-                              + str(math.degrees(satellites[j]["satellite"].sublong)) + ", " \
-                              + str(math.degrees(satellites[j]["satellite"].sublat)) + ", " + str(
-                satellites[j]["altitude"] * 1000) + "), " \
+                              + str(sat_longitude) + ", " + str(sat_latitude) + ", " + str(sat_altitude * 1000) + "), " \
                               + "ellipsoid : {radii : new Cesium.Cartesian3(30000.0, 30000.0, 30000.0), " \
                               + "material : Cesium.Color." + satellite_color + ".withAlpha(1),}});\n"
             # Call coverage function
-            content_string += add_coverage_circle(satellites[j]["satellite"], coverage_radius, satellite_color)
+            content_string += add_coverage_circle_at(sat_longitude, sat_latitude, coverage_radius, satellite_color)
     return content_string
 
 
 
-def visualization_constellation_with_ISL(constellation_information):
+def visualization_constellation_with_ISL(constellation_spec):
     content_string = ""
-    count = 0
-    for shell in constellation_information:
-        mean_motion_rev_per_day = shell[0]
-        altitude = shell[1]
-        number_of_orbit = shell[2]
-        number_of_satellite_per_orbit = shell[3]
-        inclination = shell[4]
-        base_id = shell[5]
-
-        satellites = get_satellites_list(mean_motion_rev_per_day, altitude, number_of_orbit
-                                         , number_of_satellite_per_orbit, inclination)
-
-
-
-        sat_id=1
-        flag=1
-        for j in range(len(satellites)):
-            satellites[j]["satellite"].compute("1949-10-01 00:00:00")
-            if flag==1:
-                content_string += (
-                    "var redSphere = viewer.entities.add({name : '', position: Cesium.Cartesian3.fromDegrees(" \
-                    + str(math.degrees(satellites[j]["satellite"].sublong)) + ", " \
-                    + str(math.degrees(satellites[j]["satellite"].sublat)) + ", "
-                    + str(satellites[j]["altitude"] * 1000) + "), " \
-                    + "ellipsoid : {radii : new Cesium.Cartesian3(30000.0, 30000.0, 30000.0), " \
-                    + "material : Cesium.Color.BLACK.withAlpha(1),}});\n")
-                flag += 1
-            elif flag==2:
-                content_string += (
-                        "var redSphere = viewer.entities.add({name : '', position: Cesium.Cartesian3.fromDegrees(" \
-                        + str(math.degrees(satellites[j]["satellite"].sublong)) + ", " \
-                        + str(math.degrees(satellites[j]["satellite"].sublat)) + ", "
-                        + str(satellites[j]["altitude"] * 1000) + "), " \
-                        + "ellipsoid : {radii : new Cesium.Cartesian3(30000.0, 30000.0, 30000.0), " \
-                        + "material : Cesium.Color.BLACK.withAlpha(0),}});\n")
-                flag += 1
-            elif flag == 3:
-                content_string += (
-                        "var redSphere = viewer.entities.add({name : '', position: Cesium.Cartesian3.fromDegrees(" \
-                        + str(math.degrees(satellites[j]["satellite"].sublong)) + ", " \
-                        + str(math.degrees(satellites[j]["satellite"].sublat)) + ", "
-                        + str(satellites[j]["altitude"] * 1000) + "), " \
-                        + "ellipsoid : {radii : new Cesium.Cartesian3(30000.0, 30000.0, 30000.0), " \
-                        + "material : Cesium.Color.BLACK.withAlpha(0),}});\n")
-                flag = 1
-
-
-
-            sat_id += 1
-
-        orbit_links = get_ISL(satellites, number_of_orbit, number_of_satellite_per_orbit)
-        # Starlink color = ['AQUA', 'BLUE', 'MEDIUMAQUAMARINE', 'RED','YELLOW']
-        # Kuiper color = ['MEDIUMVIOLETRED','ORANGE','YELLOW','LIGHTCORAL']
-        # Telesat color = ['GREEN', 'DEEPSKYBLUE', 'LAWNGREEN', 'MEDIUMSEAGREEN']
-        color = ['MEDIUMVIOLETRED','ORANGERED','RED','PALEVIOLETRED']
-
-        for key in orbit_links:
-            sat1 = orbit_links[key]["sat1"]
-            sat2 = orbit_links[key]["sat2"]
+    longitude, latitude, altitude, shell = snapshot_positions(constellation_spec)
+    # +Grid ISLs: every satellite links to the next satellite of its orbit and to the same slot of the next orbit
+    isl_sat1, isl_sat2, _ = isl_graph.constellation_ISL_edges(constellation_spec.constellation_information())
+    # Starlink color = ['AQUA', 'BLUE', 'MEDIUMAQUAMARINE', 'RED','YELLOW']
+    # Kuiper color = ['MEDIUMVIOLETRED','ORANGE','YELLOW','LIGHTCORAL']
+    # Telesat color = ['GREEN', 'DEEPSKYBLUE', 'LAWNGREEN', 'MEDIUMSEAGREEN']
+    color = ['MEDIUMVIOLETRED','ORANGERED','RED','PALEVIOLETRED']
+
+    for count in range(len(constellation_spec)):
+        columns = np.flatnonzero(shell == count + 1)
+        # Only every third satellite is drawn, the others are kept transparent
+        for position, column in enumerate(columns.tolist()):
+            alpha = 1 if position % 3 == 0 else 0
+            content_string += (
+                "var redSphere = viewer.entities.add({name : '', position: Cesium.Cartesian3.fromDegrees(" \
+                + str(float(longitude[column])) + ", " + str(float(latitude[column])) + ", "
+                + str(float(altitude[column]) * 1000) + "), " \
+                + "ellipsoid : {radii : new Cesium.Cartesian3(30000.0, 30000.0, 30000.0), " \
+                + "material : Cesium.Color.BLACK.withAlpha(" + str(alpha) + "),}});\n")
+
+        in_shell = shell[isl_sat1] == count + 1
+        for sat1, sat2 in zip(isl_sat1[in_shell].tolist(), isl_sat2[in_shell].tolist()):
             content_string += (
                     "viewer.entities.add({name : '', polyline: { positions: Cesium.Cartesian3.fromDegreesArrayHeights([" \
-                    + str(math.degrees(satellites[sat1]["satellite"].sublong)) + "," \
-                    + str(math.degrees(satellites[sat1]["satellite"].sublat)) + "," \
-                    + str(satellites[sat1]["altitude"] * 1000) + "," \
-                    + str(math.degrees(satellites[sat2]["satellite"].sublong)) + "," \
-                    + str(math.degrees(satellites[sat2]["satellite"].sublat)) + "," \
-                    + str(satellites[sat2]["altitude"] * 1000) + "]), " \
+                    + str(float(longitude[sat1])) + "," + str(float(latitude[sat1])) + "," \
+                    + str(float(altitude[sat1]) * 1000) + "," \
+                    + str(float(longitude[sat2])) + "," + str(float(latitude[sat2])) + "," \
+                    + str(float(altitude[sat2]) * 1000) + "]), " \
                     + "width: 2, arcType: Cesium.ArcType.NONE, " \
                     + "material: new Cesium.PolylineOutlineMaterialProperty({ " \
                     + "color: Cesium.Color." + color[count]
                     + ".withAlpha(0.4), outlineWidth: 0, outlineColor: Cesium.Color.BLACK})}});")
-        count += 1
     return content_string
 
 
-# ISL parameter is a boolean variable to control ISL visualization
-def constellation_visualization(constellation_name , xml_file_path ,output_file_path,
-                                head_html_file , tail_html_file ,ISL = False, satellite_color = "BLACK", coverage_radius = 600000):
-
-
-    # Read constellation configuration information
-    constellation_configuration_information = read_xml_file(xml_file_path)
-    # Number of satellite shells
-    number_of_shells = int(constellation_configuration_information['constellation']['number_of_shells'])
-
-    constellation_information = []
-    for count in range(1, number_of_shells + 1, 1):
-        altitude = int(constellation_configuration_information['constellation']['shell' + str(count)]['altitude'])
-        orbit_cycle = int(constellation_configuration_information['constellation']['shell' + str(count)]['orbit_cycle'])
-        inclination = float(
-            constellation_configuration_information['constellation']['shell' + str(count)]['inclination'])
-        number_of_orbit = int(
-            constellation_configuration_information['constellation']['shell' + str(count)]['number_of_orbit'])
-        number_of_satellite_per_orbit = int(
-            constellation_configuration_information['constellation']['shell' + str(count)]
-            ['number_of_satellite_per_orbit'])
-
-        # Mean motion: number of satellite orbits per day, calculated as day total seconds (24*60*60=86400) divided by orbital period in seconds
-        mean_motion_rev_per_day = 1.0 * 86400 / orbit_cycle
-
-        constellation_information.append(
-            [mean_motion_rev_per_day, altitude, number_of_orbit, number_of_satellite_per_orbit,
-             inclination])
-
-    # Add base_id information to each shell - the ID of the first satellite in each shell
-    for index in range(len(constellation_information)):
-        if index == 0:
-            constellation_information[index].append(0)
-        else:
-            constellation_information[index].append(constellation_information[index - 1][5] +
-                                                    constellation_information[index - 1][2] *
-                                                    constellation_information[index - 1][3])
+def visualization_constellation_czml(constellation_spec, czml_file_path, start_time, time_step, num_time_steps,
+                                     shell_colors, ISL=False, coverage_radius=None, sample_every=8):
+    """
+    Time-dynamic visualization: propagate every shell over the time grid and stream it to one CZML file
+    :param constellation_spec: constellation_config.ConstellationSpec
+    :param czml_file_path: Output .czml file
+    :param start_time: datetime of the first time step
+    :param time_step: datetime.timedelta between time steps
+    :param num_time_steps: Number of time steps
+    :param shell_colors: Cesium color names, one per shell
+    :param ISL: Add the +Grid ISLs of every shell
+    :param coverage_radius: Optional coverage radius in m per shell
+    :param sample_every: Only every sample_every-th time step is propagated and written; Cesium interpolates
+    """
+    # Propagate directly on the sampled grid, reusing a cached propagation of the same shells and grid
+    sample_step = time_step * sample_every
+    num_samples = (num_time_steps - 1) // sample_every + 1
+    store = propagation_cache.cached_propagate_constellation(constellation_spec, start_time, sample_step, num_samples)
+    isl_sat1 = None
+    isl_sat2 = None
+    if ISL:
+        isl_sat1, isl_sat2, _ = isl_graph.constellation_ISL_edges(constellation_spec.constellation_information())
 
+    czml_export.write_czml(czml_file_path, "constellation", start_time, sample_step, store.longitude, store.latitude,
+                           store.altitude, store.sat_id, store.shell, shell_colors, isl_sat1, isl_sat2,
+                           coverage_radius=coverage_radius, sample_every=1)
 
-    if ISL:
+
+# ISL parameter is a boolean variable to control ISL visualization
+# time_dynamic writes one CZML document animating a whole day instead of a static snapshot
+def constellation_visualization(constellation_name , xml_file_path ,output_file_path,
+                                head_html_file , tail_html_file ,ISL = False, satellite_color = "BLACK", coverage_radius = 600000,
+                                time_dynamic = False):
+
+
+    # Read and validate constellation configuration information; mean motion and base_id are derived per shell.
+    # Every page, static or time-dynamic, reads its positions from the propagation cache
+    constellation_spec = constellation_config.load_constellation(xml_file_path, constellation_name)
+
+
+    if time_dynamic:
+        # One CZML document for a whole day at 15 s resolution, loaded by a single HTML page
+        suffix = "_with_ISL" if ISL else "_without_ISL"
+        czml_file_name = constellation_name + suffix + ".czml"
+        num_shells = len(constellation_spec)
+        visualization_constellation_czml(constellation_spec, output_file_path + czml_file_name,
+                                         datetime.datetime(1949, 10, 1, 0, 0, 0), datetime.timedelta(seconds=15),
+                                         24 * 60 * 60 // 15, ["RED", "BLUE", "GREEN", "YELLOW"], ISL,
+                                         None if ISL else [coverage_radius] * num_shells)
+        czml_export.write_czml_html(output_file_path + constellation_name + suffix + "_czml.html", czml_file_name,
+                                    head_html_file, tail_html_file)
+    elif ISL:
         # Visualize satellites and ISL in constellation
-        visualization_content = visualization_constellation_with_ISL(constellation_information)
+        visualization_content = visualization_constellation_with_ISL(constellation_spec)
         writer_html = open(output_file_path + constellation_name + "_with_ISL.html", 'w')
         with open(head_html_file, 'r') as fi:
             writer_html.write(fi.read())
@@ -296,7 +230,7 @@ def constellation_visualization(constellation_name , xml_file_path ,output_file_
     else:
         # Only visualize satellites in constellation, no ISL visualization
         shell_colors = ["RED", "BLUE", "GREEN", "YELLOW"]
-        visualization_content = visualization_constellation_without_ISL(constellation_information, shell_colors,
+        visualization_content = visualization_constellation_without_ISL(constellation_spec, shell_colors,
                                                                         coverage_radius)
         writer_html = open(output_file_path + constellation_name + "_without_ISL.html", 'w')
         with open(head_html_file, 'r') as fi:
@@ -307,13 +241,24 @@ def constellation_visualization(constellation_name , xml_file_path ,output_file_
         writer_html.close()
 
 
-def filter_orbits_to_ensure_coverage(constellation_information, coverage_radius, keep_ratios):
+def filter_orbits_to_ensure_coverage(constellation_information, coverage_radius, keep_ratios, target_coverage=None,
+                                     start_time=datetime.datetime(1949, 10, 1, 0, 0, 0),
+                                     time_step=datetime.timedelta(minutes=15), num_time_steps=96, phase_shift=True):
     """
-    Remove consecutive orbits according to the retention ratio of each shell to ensure all shells can fully cover the Earth's surface
+    Remove orbits of each shell while keeping as much of its ground coverage as possible.
+    Every plane is propagated once over the time grid into a coverage bitset (time step x ground cell),
+    candidate plane subsets are then evaluated with bitwise operations only.
     :param constellation_information: Constellation information
-    :param coverage_radius: Coverage radius of each satellite
-    :param keep_ratios: List of retention ratios for each shell (length must match number of shells)
-    :return: Modified constellation information
+    :param coverage_radius: Coverage radius of each satellite in m, one value or one per shell
+    :param keep_ratios: List of retention ratios for each shell (length must match number of shells); the
+                        int(number_of_orbit * keep_ratio) planes adding the most coverage are kept
+    :param target_coverage: If given, ignore keep_ratios and drop planes as long as each shell keeps at least this
+                            fraction of its full coverage
+    :param start_time: First time step of the coverage evaluation
+    :param time_step: Time between evaluated time steps
+    :param num_time_steps: Number of evaluated time steps
+    :param phase_shift: One value for all shells or one per shell
+    :return: Modified constellation information, each shell gets a 7th entry listing the orbits kept
     """
     filtered_constellation_information = []
 
@@ -325,41 +270,42 @@ def filter_orbits_to_ensure_coverage(constellation_information, coverage_radius,
         inclination = shell[4]
         base_id = shell[5]
 
-        # Get retention ratio for current shell
-        keep_ratio = keep_ratios[shell_index]
+        # Get coverage radius of current shell
+        if isinstance(coverage_radius, (list, tuple)):
+            shell_coverage_radius = coverage_radius[shell_index]
+        else:
+            shell_coverage_radius = coverage_radius
 
-        # Calculate number of orbits to keep
-        keep_orbit_count = int(number_of_orbit * keep_ratio)
+        plane_bits, num_bits = orbit_pruning.plane_coverage_bits(
+            mean_motion_rev_per_day, altitude, number_of_orbit, number_of_satellite_per_orbit, inclination,
+            shell_coverage_radius / 1000, start_time, time_step, num_time_steps,
+            phase_shift=propagation.shell_phase_shift(phase_shift, shell_index))
 
-        # Keep the first keep_orbit_count consecutive orbits
-        remaining_orbits = list(range(keep_orbit_count))
+        if target_coverage is None:
+            # Calculate number of orbits to keep and pick the ones covering the most
+            keep_orbit_count = int(number_of_orbit * keep_ratios[shell_index])
+            remaining_orbits = orbit_pruning.select_orbits(plane_bits, keep_orbit_count)
+        else:
+            full_coverage = orbit_pruning.subset_coverage(plane_bits, num_bits, range(number_of_orbit))
+            remaining_orbits = orbit_pruning.prune_orbits(plane_bits, num_bits, target_coverage * full_coverage)
 
         # Update shell information
         filtered_constellation_information.append([
-            mean_motion_rev_per_day, altitude, len(remaining_orbits), number_of_satellite_per_orbit, inclination, base_id
+            mean_motion_rev_per_day, altitude, number_of_orbit, number_of_satellite_per_orbit, inclination, base_id,
+            remaining_orbits
         ])
 
     return filtered_constellation_information
 
 
 
-def should_keep_orbit(satellites, orbit, coverage_radius, number_of_orbit, number_of_satellite_per_orbit):
-    """
-    Check whether this orbit should be kept
-    :param satellites: Satellite list
-    :param orbit: Current orbit number
-    :param coverage_radius: Coverage radius
-    :param number_of_orbit: Total number of orbits
-    :param number_of_satellite_per_orbit: Number of satellites per orbit
-    :return: Whether to keep this orbit
-    """
-    # Simple logic: conditions for keeping orbit (can calculate more complex logic based on coverage)
-    return orbit % 2 == 0  # Example: keep even orbits
+# Get global IDs (base_id + orbit * number_of_satellite_per_orbit + slot) of the satellites of a shell,
+# restricted to the orbits kept by filter_orbits_to_ensure_coverage when present
+def get_shell_sat_ids(shell):
+    return propagation.shell_sat_ids(shell)
 
 
 
-import math
-
 def print_satellite_positions(filtered_constellation_information):
     """
     Print longitude, latitude and altitude information of satellites retained in each shell
@@ -372,9 +318,10 @@ def print_satellite_positions(filtered_constellation_information):
         number_of_satellite_per_orbit = shell[3]
         inclination = shell[4]
         base_id = shell[5]
+        remaining_orbits = shell[6] if len(shell) > 6 else range(number_of_orbit)
 
         print(f"Shell {shell_index + 1}:")
-        for orbit_index in range(number_of_orbit):
+        for orbit_index in remaining_orbits:
             for satellite_index in range(number_of_satellite_per_orbit):
                 # Calculate satellite longitude and latitude
                 longitude = (360.0 / number_of_satellite_per_orbit) * satellite_index
@@ -388,9 +335,8 @@ def print_satellite_positions(filtered_constellation_information):
 
 
 
-import datetime
-import os
-import math
+import position_arrays
+import position_store
 
 if __name__ == '__main__':
     constellation_name = "Starlink_Kuiper_Telesat"
@@ -398,51 +344,43 @@ if __name__ == '__main__':
     output_file_path = "./CesiumAPP/"
     head_html_file = "./html_head_tail/head.html"
     tail_html_file = "./html_head_tail/tail.html"
-    txt_output_path = "./SatellitePositions/"  # Directory to save satellite position information
-
-    # Create directory to save satellite position information
-    if not os.path.exists(txt_output_path):
-        os.makedirs(txt_output_path)
-
-    # Read constellation configuration information
-    constellation_configuration_information = read_xml_file(xml_file_path)
-    number_of_shells = int(constellation_configuration_information['constellation']['number_of_shells'])
-
-    # Add base_id when constructing constellation information
-    constellation_information = []
-    base_id = 0  # Initialize base_id
-    for count in range(1, number_of_shells + 1):
-        altitude = int(constellation_configuration_information['constellation']['shell' + str(count)]['altitude'])
-        orbit_cycle = int(constellation_configuration_information['constellation']['shell' + str(count)]['orbit_cycle'])
-        inclination = float(
-            constellation_configuration_information['constellation']['shell' + str(count)]['inclination'])
-        number_of_orbit = int(
-            constellation_configuration_information['constellation']['shell' + str(count)]['number_of_orbit'])
-        number_of_satellite_per_orbit = int(
-            constellation_configuration_information['constellation']['shell' + str(count)][
-                'number_of_satellite_per_orbit'])
-
-        mean_motion_rev_per_day = 1.0 * 86400 / orbit_cycle
-
-        # 添加 base_id 信息
-        constellation_information.append([
-            mean_motion_rev_per_day, altitude, number_of_orbit, number_of_satellite_per_orbit, inclination, base_id
-        ])
+    position_store_path = "./" + position_store.POSITION_STORE_FILE  # File to save satellite position information
 
-        # 更新 base_id 为下一层的起始编号
-        base_id += number_of_orbit * number_of_satellite_per_orbit
+    # Read constellation configuration information (base_id 为每层 shell 的起始编号, 解析时一次性算好)
+    constellation_spec = constellation_config.load_constellation(xml_file_path, constellation_name)
+    constellation_information = constellation_spec.constellation_information()
+    phase_shift = constellation_spec.phase_shifts()
 
     # 过滤轨道以确保覆盖地球表面
     coverage_radius_list = [600000, 600000, 1000000]  # 每个 shell 的覆盖半径
     keep_ratios = [0.25, 0.25, 0.25]  # 每个 shell 的保留比例
     filtered_constellation_information = filter_orbits_to_ensure_coverage(constellation_information, coverage_radius_list,
-                                                                          keep_ratios)
+                                                                          keep_ratios, phase_shift=phase_shift)
+    filtered_constellation_spec = constellation_spec.with_orbits(
+        [shell[6] for shell in filtered_constellation_information])
 
     # 时间片设置
     start_time = datetime.datetime(1949, 10, 1, 0, 0, 0)
     time_step = datetime.timedelta(seconds=15)  # 每个时间片间隔15秒
     num_time_steps = 24 * 60 * 60 // 15  # 总共计算24小时内的时间片
     selected_time_step_index = 1000  # 选取第1000个时间片进行可视化
+    use_ephem = False  # True: 使用 ephem 逐颗卫星计算 (参考实现，速度很慢)
+
+    # 所有 shell 的卫星位置写入同一个二进制文件，每颗卫星一列
+    sat_ids = []
+    shell_tags = []
+    for shell_index, shell in enumerate(filtered_constellation_information):
+        sat_ids.append(get_shell_sat_ids(shell))
+        shell_tags.append(np.full(len(sat_ids[-1]), shell_index + 1))
+    store = position_store.create_position_store(position_store_path, num_time_steps,
+                                                 np.concatenate(sat_ids), np.concatenate(shell_tags),
+                                                 start_time, time_step,
+                                                 propagation_cache.constellation_metadata(filtered_constellation_spec))
+    column_offset = 0
+    if not use_ephem:
+        # 传播结果按 shell 参数和时间网格缓存，参数不变时直接复用
+        cached = propagation_cache.cached_propagate_constellation(filtered_constellation_spec,
+                                                                  start_time, time_step, num_time_steps)
 
     # 可视化每层 shell 并保存 HTML 文件
     shell_colors = ["RED", "GREEN", "YELLOW"]
@@ -454,36 +392,53 @@ if __name__ == '__main__':
         number_of_satellite_per_orbit = shell[3]
         inclination = shell[4]
         base_id = shell[5]
+        remaining_orbits = shell[6]
 
         # Get current shell color
         satellite_color = shell_colors[shell_index % len(shell_colors)]
 
-        satellites = get_satellites_list(mean_motion_rev_per_day, altitude, number_of_orbit,
-                                         number_of_satellite_per_orbit, inclination)
+        if use_ephem:
+            # Reference path: one ephem compute() per satellite and time step
+            satellites = get_satellites_list(mean_motion_rev_per_day, altitude, number_of_orbit,
+                                             number_of_satellite_per_orbit, inclination, phase_shift[shell_index],
+                                             base_id=base_id)
+            satellites = [sat for sat in satellites if sat["orbit"] in remaining_orbits]
+            longitudes = np.empty((num_time_steps, len(satellites)))
+            latitudes = np.empty((num_time_steps, len(satellites)))
+            for time_step_index in range(num_time_steps):
+                current_time = start_time + time_step * time_step_index
+                for j in range(len(satellites)):
+                    satellites[j]["satellite"].compute(current_time.strftime("%Y-%m-%d %H:%M:%S"))
+                    longitudes[time_step_index, j] = math.degrees(satellites[j]["satellite"].sublong)
+                    latitudes[time_step_index, j] = math.degrees(satellites[j]["satellite"].sublat)
+            heights_km = np.full(longitudes.shape, float(altitude))
+        else:
+            # 整个时间网格上所有卫星的位置，取自缓存中本 shell 的列
+            cached_columns = slice(column_offset, column_offset + len(sat_ids[shell_index]))
+            longitudes = np.asarray(cached.longitude[:, cached_columns])
+            latitudes = np.asarray(cached.latitude[:, cached_columns])
+            heights_km = np.asarray(cached.altitude[:, cached_columns])
 
         visualization_content = ""
         print(f"Shell {shell_index + 1} Satellite Positions:")
 
-        # 计算多个时间片的卫星位置
-        for time_step_index in range(num_time_steps):
-            current_time = start_time + time_step * time_step_index
-            txt_file_path = os.path.join(txt_output_path, f"time_step_{time_step_index + 1}.txt")
-            with open(txt_file_path, 'a') as txt_file:
-                for j in range(len(satellites)):
-                    satellites[j]["satellite"].compute(current_time.strftime("%Y-%m-%d %H:%M:%S"))
-                    longitude = math.degrees(satellites[j]["satellite"].sublong)
-                    latitude = math.degrees(satellites[j]["satellite"].sublat)
-                    height_km = satellites[j]["altitude"]
-                    txt_file.write(f"{longitude:.2f} {latitude:.2f} {height_km:.2f} {shell_index + 1}\n")
-
-                    # Generate visualization info only for selected time step
-                    if time_step_index == selected_time_step_index:
-                        visualization_content += "var redSphere = viewer.entities.add({name : '', position: Cesium.Cartesian3.fromDegrees(" \
-                                                  + str(longitude) + ", " + str(latitude) + ", " + str(
-                            height_km * 1000) + "), " \
-                                                  + "ellipsoid : {radii : new Cesium.Cartesian3(30000.0, 30000.0, 30000.0), " \
-                                                  + "material : Cesium.Color." + satellite_color + ".withAlpha(1),}});\n"
-                        visualization_content += add_coverage_circle(satellites[j]["satellite"], coverage_radius_list[shell_index], satellite_color)
+        # 保存多个时间片的卫星位置
+        columns = slice(column_offset, column_offset + longitudes.shape[1])
+        store.longitude[:, columns] = longitudes
+        store.latitude[:, columns] = latitudes
+        store.altitude[:, columns] = heights_km
+        column_offset += longitudes.shape[1]
+
+        # Generate visualization info only for selected time step
+        for longitude, latitude, height_km in zip(longitudes[selected_time_step_index].tolist(),
+                                                  latitudes[selected_time_step_index].tolist(),
+                                                  heights_km[selected_time_step_index].tolist()):
+            visualization_content += "var redSphere = viewer.entities.add({name : '', position: Cesium.Cartesian3.fromDegrees(" \
+                                      + str(longitude) + ", " + str(latitude) + ", " + str(
+                height_km * 1000) + "), " \
+                                      + "ellipsoid : {radii : new Cesium.Cartesian3(30000.0, 30000.0, 30000.0), " \
+                                      + "material : Cesium.Color." + satellite_color + ".withAlpha(1),}});\n"
+            visualization_content += add_coverage_circle_at(longitude, latitude, coverage_radius_list[shell_index], satellite_color)
 
         # 保存每层 shell 的 HTML 文件
         writer_html = open(output_file_path + f"shell_{shell_index + 1}_filtered.html", 'w')
@@ -497,6 +452,20 @@ if __name__ == '__main__':
         # 合并所有 shell 的可视化内容
         all_shells_visualization_content += visualization_content
 
+    store.flush()
+
+    # 整个时间网格的 ISL 拓扑与链路长度：拓扑只存一次，链路长度按时间片差分存储，供路由/时延分析使用
+    isl_graph.write_isl_snapshots("./" + isl_graph.ISL_SNAPSHOT_FILE,
+                                  isl_graph.ISLGraph.from_constellation(filtered_constellation_information),
+                                  position_arrays.SatellitePositions.from_store(store))
+
+    # 整个时间网格的动态可视化：所有 shell 写入一个 CZML 文件
+    czml_export.write_czml(output_file_path + "all_shells_filtered.czml", constellation_name, start_time, time_step,
+                           store.longitude, store.latitude, store.altitude, store.sat_id, store.shell,
+                           shell_colors, coverage_radius=coverage_radius_list)
+    czml_export.write_czml_html(output_file_path + "all_shells_filtered_czml.html", "all_shells_filtered.czml",
+                                head_html_file, tail_html_file)
+
     # 保存所有 shell 合并的 HTML 文件
     writer_html = open(output_file_path + "all_shells_filtered.html", 'w')
     with open(head_html_file, 'r') as fi:
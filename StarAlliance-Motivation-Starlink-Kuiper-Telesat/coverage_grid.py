@@ -0,0 +1,161 @@
+
+import os
+import numpy as np
+import position_store
+
+
+EARTH_RADIUS_KM = 6371.0
+
+# Footprint radius (ground distance) of each constellation tag, as drawn by earth_view
+COVERAGE_RADIUS_KM = {1: 600, 2: 600, 3: 1000}
+CONSTELLATION_NAMES = {1: "starlink", 2: "kuiper", 3: "telesat"}
+
+
+def equal_area_grid(num_lat=180, num_lon=360):
+    """
+    Global grid whose cells all have the same area: bands equally spaced in sin(latitude), equal longitude steps
+    :param num_lat: Number of latitude bands
+    :param num_lon: Number of cells per band
+    :return: (band_latitude, cell_longitude) cell-centre coordinates in degrees
+    """
+    band_edges = np.linspace(-1.0, 1.0, num_lat + 1)
+    band_latitude = np.degrees(np.arcsin((band_edges[:-1] + band_edges[1:]) / 2))
+    cell_longitude = -180.0 + (np.arange(num_lon) + 0.5) * 360.0 / num_lon
+    return band_latitude, cell_longitude
+
+
+def coverage_multiplicity(longitude, latitude, coverage_radius_km, num_lat=180, num_lon=360):
+    """
+    Rasterize satellite footprints onto the equal-area grid.
+    A cell is covered by a satellite when the great-circle distance between the cell centre and the
+    sub-satellite point is within the footprint radius. For each (satellite, band) pair this is a longitude
+    interval, so footprints are accumulated as interval start/end counts and summed along each band.
+    :param longitude: (t, N) sub-satellite longitudes in degrees
+    :param latitude: (t, N) sub-satellite latitudes in degrees
+    :param coverage_radius_km: Footprint radius, scalar or (N,)
+    :return: (t, num_lat, num_lon) int32 number of satellites covering each cell
+    """
+    longitude = np.asarray(longitude, dtype=np.float64)
+    latitude = np.asarray(latitude, dtype=np.float64)
+    num_time_steps, num_satellites = longitude.shape
+    band_latitude, _ = equal_area_grid(num_lat, num_lon)
+    band_sin = np.sin(np.radians(band_latitude))
+    band_cos = np.cos(np.radians(band_latitude))
+    radius = np.broadcast_to(np.asarray(coverage_radius_km, dtype=np.float64) / EARTH_RADIUS_KM,
+                             (num_satellites,))
+    if num_satellites == 0:
+        return np.zeros((num_time_steps, num_lat, num_lon), dtype=np.int32)
+
+    # Candidate bands of each satellite: those overlapping [lat - radius, lat + radius]
+    lat_rad = np.radians(latitude)
+    lowest = np.sin(np.clip(lat_rad - radius, -np.pi / 2, np.pi / 2))
+    highest = np.sin(np.clip(lat_rad + radius, -np.pi / 2, np.pi / 2))
+    first_band = np.clip(np.floor((lowest + 1) / 2 * num_lat), 0, num_lat - 1).astype(np.int64)
+    last_band = np.clip(np.floor((highest + 1) / 2 * num_lat), 0, num_lat - 1).astype(np.int64)
+    num_candidates = int((last_band - first_band).max()) + 1
+    band = first_band[..., None] + np.arange(num_candidates)  # (t, N, K)
+    valid = band <= last_band[..., None]
+    band = np.minimum(band, num_lat - 1)
+
+    # cos(distance) >= cos(radius) <=> cos(dlon) >= (cos(radius) - sin(lat_b) sin(lat_s)) / (cos(lat_b) cos(lat_s))
+    numerator = np.cos(radius)[:, None] - band_sin[band] * np.sin(lat_rad)[..., None]
+    denominator = band_cos[band] * np.cos(lat_rad)[..., None]
+    whole_band = numerator <= -denominator
+    valid &= numerator <= denominator
+    ratio = np.divide(numerator, denominator, out=np.full(numerator.shape, -1.0), where=denominator > 0)
+    half_width = np.degrees(np.arccos(np.clip(ratio, -1.0, 1.0)))
+
+    # Cells whose centre lies in [lon - half_width, lon + half_width], indexes may wrap by one turn
+    cell_width = 360.0 / num_lon
+    centre = longitude[..., None]
+    start = np.ceil((centre - half_width + 180.0) / cell_width - 0.5).astype(np.int64)
+    end = np.floor((centre + half_width + 180.0) / cell_width - 0.5).astype(np.int64)
+    whole_band |= end - start + 1 >= num_lon
+    start = np.where(whole_band, 0, start)
+    end = np.where(whole_band, num_lon - 1, end)
+    valid &= end >= start
+
+    # Move intervals so they start inside the band; those running past its end wrap around to cell 0
+    turns = np.floor_divide(start, num_lon)
+    start = start - turns * num_lon
+    end = end - turns * num_lon
+    wraps = valid & (end >= num_lon)
+
+    # +1 at the first cell and -1 after the last cell of every interval, then a running sum along each band
+    row_length = num_lon + 1
+    row = (np.arange(num_time_steps)[:, None, None] * num_lat + band) * row_length
+    size = num_time_steps * num_lat * row_length
+    increments = np.concatenate([(row + start)[valid], row[wraps]])
+    decrements = np.concatenate([(row + np.minimum(end, num_lon - 1) + 1)[valid], (row + end - num_lon + 1)[wraps]])
+    counts = np.bincount(increments, minlength=size) - np.bincount(decrements, minlength=size)
+    counts = counts.astype(np.int32).reshape(num_time_steps, num_lat, row_length)[..., :-1]
+    return np.cumsum(counts, axis=-1, dtype=np.int32)
+
+
+def coverage_time_series(longitude, latitude, shell, coverage_radius_km=COVERAGE_RADIUS_KM,
+                         num_lat=180, num_lon=360, weights=None, chunk_size=32):
+    """
+    Coverage fraction and multiplicity of each constellation tag and of all of them combined at every time step
+    :param longitude: (T, N) sub-satellite longitudes in degrees (e.g. a position store column)
+    :param latitude: (T, N) sub-satellite latitudes in degrees
+    :param shell: (N,) constellation tag of each satellite
+    :param coverage_radius_km: {tag: footprint radius in km}
+    :param weights: Optional (num_lat, num_lon) cell weights, e.g. population; equal area by default
+    :param chunk_size: Number of time steps rasterized at once
+    :return: {tag or "all": {"fraction": (T,), "mean_multiplicity": (T,), "cell_fraction": (num_lat, num_lon)}}
+             where cell_fraction is the fraction of time each cell is covered
+    """
+    shell = np.asarray(shell)
+    num_time_steps = longitude.shape[0]
+    if weights is None:
+        weights = np.ones((num_lat, num_lon))
+    weights = weights / weights.sum()
+    tags = sorted(set(shell.tolist()))
+
+    results = {}
+    for key in tags + ["all"]:
+        results[key] = {"fraction": np.empty(num_time_steps), "mean_multiplicity": np.empty(num_time_steps),
+                        "cell_fraction": np.zeros((num_lat, num_lon))}
+
+    for begin in range(0, num_time_steps, chunk_size):
+        end = min(begin + chunk_size, num_time_steps)
+        combined = np.zeros((end - begin, num_lat, num_lon), dtype=np.int32)
+        for tag in tags:
+            columns = np.flatnonzero(shell == tag)
+            multiplicity = coverage_multiplicity(longitude[begin:end, columns], latitude[begin:end, columns],
+                                                 coverage_radius_km[tag], num_lat, num_lon)
+            combined += multiplicity
+            _accumulate(results[tag], multiplicity, weights, begin, end)
+        _accumulate(results["all"], combined, weights, begin, end)
+
+    for key in results:
+        results[key]["cell_fraction"] /= num_time_steps
+    return results
+
+
+def _accumulate(result, multiplicity, weights, begin, end):
+    covered = multiplicity > 0
+    result["fraction"][begin:end] = np.tensordot(covered, weights, axes=2)
+    result["mean_multiplicity"][begin:end] = np.tensordot(multiplicity, weights, axes=2)
+    result["cell_fraction"] += covered.sum(axis=0)
+
+
+if __name__ == "__main__":
+    store = position_store.open_position_store()
+    results = coverage_time_series(store.longitude, store.latitude, store.shell)
+
+    output_dir = "coverage"
+    os.makedirs(output_dir, exist_ok=True)
+    keys = sorted(key for key in results if key != "all") + ["all"]
+    names = [CONSTELLATION_NAMES.get(key, str(key)) for key in keys]
+    table = np.column_stack([np.arange(1, store.num_time_steps + 1)]
+                            + [results[key]["fraction"] for key in keys]
+                            + [results[key]["mean_multiplicity"] for key in keys])
+    header = " ".join(["time_step"] + [name + "_fraction" for name in names]
+                      + [name + "_multiplicity" for name in names])
+    np.savetxt(os.path.join(output_dir, "coverage_time_series.txt"), table,
+               fmt=["%d"] + ["%.6f"] * (table.shape[1] - 1), header=header)
+
+    for key, name in zip(keys, names):
+        print(f"{name}: mean coverage {results[key]['fraction'].mean():.4f}, "
+              f"mean multiplicity {results[key]['mean_multiplicity'].mean():.3f}")
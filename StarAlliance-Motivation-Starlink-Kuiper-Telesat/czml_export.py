@@ -0,0 +1,142 @@
+
+import json
+import numpy as np
+import propagation
+
+
+# RGBA values of the Cesium.Color names used by the visualization scripts
+CESIUM_COLORS = {
+    "BLACK": [0, 0, 0, 255],
+    "BLUE": [0, 0, 255, 255],
+    "GREEN": [0, 128, 0, 255],
+    "RED": [255, 0, 0, 255],
+    "YELLOW": [255, 255, 0, 255],
+    "ORANGERED": [255, 69, 0, 255],
+    "MEDIUMVIOLETRED": [199, 21, 133, 255],
+    "PALEVIOLETRED": [219, 112, 147, 255],
+}
+
+
+def cesium_rgba(color, alpha=1.0):
+    if color not in CESIUM_COLORS:
+        raise ValueError(f"Unknown Cesium color {color!r}, expected one of {', '.join(CESIUM_COLORS)}")
+    rgba = list(CESIUM_COLORS[color])
+    rgba[3] = int(round(255 * alpha))
+    return rgba
+
+
+def iso_time(time):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def write_czml(output_path, document_name, start_time, time_step, longitude, latitude, altitude,
+               sat_id, shell, shell_colors, isl_sat1=None, isl_sat2=None, isl_color="RED",
+               coverage_radius=None, sample_every=8):
+    """
+    Stream a time-dynamic CZML document: one packet per satellite with its sampled positions over the
+    whole time grid, written to the file packet by packet. Positions are Earth-fixed Cartesian samples, so
+    the interpolation stays smooth where a satellite crosses the antimeridian
+    :param output_path: Output .czml file
+    :param document_name: Name of the CZML document
+    :param start_time: datetime of time step 0
+    :param time_step: datetime.timedelta between time steps
+    :param longitude: (T, N) longitudes in degrees
+    :param latitude: (T, N) latitudes in degrees
+    :param altitude: (T, N) altitudes in km
+    :param sat_id: (N,) satellite IDs, used as packet IDs
+    :param shell: (N,) 1-based shell of each satellite, selects the color
+    :param shell_colors: Cesium color names (keys of CESIUM_COLORS), one per shell (cycled)
+    :param isl_sat1: Optional column indexes of the first satellite of each ISL
+    :param isl_sat2: Optional column indexes of the second satellite of each ISL
+    :param isl_color: Cesium color name of the ISL polylines
+    :param coverage_radius: Optional coverage radius in m per shell (list), drawn as ground ellipses
+    :param sample_every: Keep one time step out of sample_every; Cesium interpolates in between
+    """
+    num_time_steps, num_satellites = longitude.shape
+    samples = np.arange(0, num_time_steps, sample_every)
+    if samples[-1] != num_time_steps - 1:
+        samples = np.append(samples, num_time_steps - 1)
+    seconds = (samples * time_step.total_seconds()).tolist()
+    end_time = start_time + time_step * (num_time_steps - 1)
+    availability = iso_time(start_time) + "/" + iso_time(end_time)
+    sat_id = np.asarray(sat_id).tolist()
+    shell = np.asarray(shell).tolist()
+    # Unknown color names fail before anything is written
+    for color in list(shell_colors) + [isl_color]:
+        cesium_rgba(color)
+
+    with open(output_path, 'w') as f:
+        f.write("[\n")
+        f.write(json.dumps({
+            "id": "document",
+            "name": document_name,
+            "version": "1.0",
+            "clock": {
+                "interval": availability,
+                "currentTime": iso_time(start_time),
+                "multiplier": 60,
+                "range": "LOOP_STOP",
+                "step": "SYSTEM_CLOCK_MULTIPLIER"
+            }
+        }))
+
+        for column in range(num_satellites):
+            # Earth-fixed x, y, z in m, rounded to 1 m so the samples stay compact in the text file
+            position = np.empty((len(samples), 4))
+            position[:, 0] = seconds
+            position[:, 1:] = np.round(propagation.lon_lat_alt_to_xyz(
+                np.asarray(longitude[samples, column], dtype=np.float64),
+                np.asarray(latitude[samples, column], dtype=np.float64),
+                np.asarray(altitude[samples, column], dtype=np.float64)) * 1000)
+            color = shell_colors[(shell[column] - 1) % len(shell_colors)]
+            packet = {
+                "id": "sat-" + str(sat_id[column]),
+                "availability": availability,
+                "position": {
+                    "epoch": iso_time(start_time),
+                    "interpolationAlgorithm": "LAGRANGE",
+                    "interpolationDegree": 5,
+                    "referenceFrame": "FIXED",
+                    "cartesian": position.ravel().tolist()
+                },
+                "point": {"pixelSize": 5, "color": {"rgba": cesium_rgba(color)}}
+            }
+            if coverage_radius is not None:
+                radius = coverage_radius[shell[column] - 1]
+                packet["ellipse"] = {
+                    "semiMajorAxis": radius,
+                    "semiMinorAxis": radius,
+                    "material": {"solidColor": {"color": {"rgba": cesium_rgba(color, 0.2)}}}
+                }
+            f.write(",\n")
+            f.write(json.dumps(packet, separators=(",", ":")))
+
+        # ISLs reference the satellite positions, so they move with them without extra samples
+        if isl_sat1 is not None:
+            for sat1, sat2 in zip(np.asarray(isl_sat1).tolist(), np.asarray(isl_sat2).tolist()):
+                packet = {
+                    "id": "isl-" + str(sat_id[sat1]) + "-" + str(sat_id[sat2]),
+                    "availability": availability,
+                    "polyline": {
+                        "positions": {"references": ["sat-" + str(sat_id[sat1]) + "#position",
+                                                     "sat-" + str(sat_id[sat2]) + "#position"]},
+                        "width": 2,
+                        "arcType": "NONE",
+                        "material": {"solidColor": {"color": {"rgba": cesium_rgba(isl_color, 0.4)}}}
+                    }
+                }
+                f.write(",\n")
+                f.write(json.dumps(packet, separators=(",", ":")))
+        f.write("\n]\n")
+
+
+def write_czml_html(output_path, czml_file_name, head_html_file, tail_html_file):
+    """
+    Cesium page that loads a CZML document (path relative to the page)
+    """
+    with open(output_path, 'w') as writer_html:
+        with open(head_html_file, 'r') as fi:
+            writer_html.write(fi.read())
+        writer_html.write("viewer.dataSources.add(Cesium.CzmlDataSource.load('" + czml_file_name + "'));\n")
+        with open(tail_html_file, 'r') as fb:
+            writer_html.write(fb.read())
@@ -1,6 +1,12 @@
 import matplotlib.pyplot as plt
 import matplotlib
 import os
+import numpy as np
+from matplotlib.collections import PatchCollection
+from matplotlib.colors import ListedColormap
+from matplotlib.patches import Circle
+import coverage_grid
+import position_store
 
 # Set font for academic papers - consistent with reference script
 matplotlib.rcParams["font.family"] = "serif"
@@ -10,7 +16,6 @@ plt.rcParams["pdf.fonttype"] = 42
 try:
     import cartopy.crs as ccrs
     import cartopy.feature as cfeature
-    from matplotlib.patches import Circle
     import cartopy.io.img_tiles as cimgt
     CARTOPY_AVAILABLE = True
     print("✓ Cartopy is installed and available")
@@ -33,11 +38,20 @@ if not CARTOPY_AVAILABLE and not BASEMAP_AVAILABLE:
     print("Cartopy is recommended as it is more powerful and better maintained.")
 
 CONSTELLATIONS = {
-        'starlink': {'file': './classified_gs/starlink_gs.txt', 'color': "#7fcdbb", 'alpha': 0.5, 'label': 'Starlink'},
-        'kuiper':   {'file': './classified_gs/kuiper_gs.txt',   'color': '#FDD835', 'alpha': 0.5, 'label': 'Kuiper'},
-        'telesat':  {'file': './classified_gs/telesat_gs.txt',  'color': '#225ea8', 'alpha': 0.5, 'label': 'Telesat'}
+        'starlink': {'file': './classified_gs/starlink_gs.txt', 'tag': 1, 'color': "#7fcdbb", 'alpha': 0.5, 'label': 'Starlink'},
+        'kuiper':   {'file': './classified_gs/kuiper_gs.txt',   'tag': 2, 'color': '#FDD835', 'alpha': 0.5, 'label': 'Kuiper'},
+        'telesat':  {'file': './classified_gs/telesat_gs.txt',  'tag': 3, 'color': '#225ea8', 'alpha': 0.5, 'label': 'Telesat'}
     }
 
+# Satellite positions are read straight from the position store when it exists
+POSITION_STORE = './' + position_store.POSITION_STORE_FILE
+TIME_STEP = 3500  # 1-based time step to draw
+
+# 'collection': one PatchCollection per layer (glow, fill, border) instead of three patches per satellite
+# 'density': rasterized coverage layer computed on a grid, smallest PDF files
+RENDER_MODE = 'collection'
+DENSITY_GRID = (720, 1440)  # latitude bands x longitude cells of the density layer
+
 def read_satellite_data(file_path):
     """Read satellite data file"""
     satellites = []
@@ -50,6 +64,20 @@ def read_satellite_data(file_path):
                     satellites.append((lon, lat, alt, tag))
     return satellites
 
+def read_satellite_data_from_store(store_path, time_step, tag):
+    """Read one constellation (shell tag) at one 1-based time step from the position store"""
+    store = position_store.open_position_store(store_path)
+    longitude, latitude, altitude = store.time_step_positions(time_step - 1)
+    mask = np.asarray(store.shell) == tag
+    return list(zip(longitude[mask].tolist(), latitude[mask].tolist(), altitude[mask].tolist(),
+                    [tag] * int(mask.sum())))
+
+def load_constellation_data(constellation_config):
+    """Satellites of one constellation, from the position store if present, otherwise from the classified file"""
+    if os.path.exists(POSITION_STORE):
+        return read_satellite_data_from_store(POSITION_STORE, TIME_STEP, constellation_config['tag'])
+    return read_satellite_data(constellation_config['file'])
+
 def create_earth_base_cartopy():
     """Create base earth map - rectangular projection version"""
     fig = plt.figure(figsize=(14, 13))
@@ -77,7 +105,7 @@ def create_earth_base_cartopy():
 
 def plot_constellation_coverage(ax, constellation_config, constellation_name):
     """Plot single constellation coverage - enhanced version"""
-    satellite_data = read_satellite_data(constellation_config['file'])
+    satellite_data = load_constellation_data(constellation_config)
     if not satellite_data:
         return 0, 700
     
@@ -92,37 +120,56 @@ def plot_constellation_coverage(ax, constellation_config, constellation_name):
     # Convert km to degrees (Earth circumference ~40,075km, 360 degrees)
     coverage_radius_deg = coverage_radius_km * 360 / 40075
     
-    for lon, lat, alt, tag in satellite_data:
-        # Add glow effect coverage circles
-        # Outer glow
-        circle_glow = Circle((lon, lat), coverage_radius_deg * 1.2, 
-                           facecolor=constellation_config['color'], 
-                           edgecolor='none',
-                           alpha=0.1,
-                           transform=ccrs.PlateCarree())
-        ax.add_patch(circle_glow)
-        
-        # Main coverage circle
-        circle = Circle((lon, lat), coverage_radius_deg, 
-                       facecolor=constellation_config['color'], 
-                       edgecolor=constellation_config['color'],
-                       alpha=constellation_config['alpha'],
-                       linewidth=0.3,
-                       transform=ccrs.PlateCarree())
-        ax.add_patch(circle)
-        
-        # Add dashed border for clearer boundaries
-        circle_border = Circle((lon, lat), coverage_radius_deg, 
-                             facecolor='none', 
-                             edgecolor=constellation_config['color'],
-                             linewidth=1.5,
-                             linestyle='--',
-                             alpha=0.8,
-                             transform=ccrs.PlateCarree())
-        ax.add_patch(circle_border)
+    longitudes = [satellite[0] for satellite in satellite_data]
+    latitudes = [satellite[1] for satellite in satellite_data]
+    if RENDER_MODE == 'density':
+        add_coverage_density_layer(ax, longitudes, latitudes, coverage_radius_km, constellation_config,
+                                   transform=ccrs.PlateCarree())
+    else:
+        for collection in coverage_collections(longitudes, latitudes, coverage_radius_deg, constellation_config,
+                                               transform=ccrs.PlateCarree()):
+            ax.add_collection(collection)
     
     return len(satellite_data), coverage_radius_km
 
+def coverage_collections(longitudes, latitudes, coverage_radius_deg, constellation_config, transform=None, glow=True):
+    """Coverage circles of one constellation batched into one collection per layer (glow, fill, dashed border)"""
+    def circles(radius):
+        return [Circle((lon, lat), radius) for lon, lat in zip(longitudes, latitudes)]
+    
+    transform_kwargs = {} if transform is None else {'transform': transform}
+    collections = []
+    if glow:
+        # Outer glow
+        collections.append(PatchCollection(circles(coverage_radius_deg * 1.2),
+                                           facecolor=constellation_config['color'], edgecolor='none',
+                                           alpha=0.1, **transform_kwargs))
+    
+    # Main coverage circles
+    collections.append(PatchCollection(circles(coverage_radius_deg),
+                                       facecolor=constellation_config['color'],
+                                       edgecolor=constellation_config['color'],
+                                       alpha=constellation_config['alpha'], linewidth=0.3, **transform_kwargs))
+    
+    # Dashed borders for clearer boundaries
+    collections.append(PatchCollection(circles(coverage_radius_deg),
+                                       facecolor='none', edgecolor=constellation_config['color'],
+                                       linewidth=1.5 if glow else 1.2, linestyle='--', alpha=0.8,
+                                       **transform_kwargs))
+    return collections
+
+def add_coverage_density_layer(ax, longitudes, latitudes, coverage_radius_km, constellation_config, transform=None):
+    """Rasterized coverage layer: grid cells within coverage_radius_km of any satellite, drawn as one image"""
+    num_lat, num_lon = DENSITY_GRID
+    multiplicity = coverage_grid.coverage_multiplicity(np.array([longitudes]), np.array([latitudes]),
+                                                       coverage_radius_km, num_lat, num_lon)[0]
+    covered = np.ma.masked_equal((multiplicity > 0).astype(np.int8), 0)
+    lat_edges = np.degrees(np.arcsin(np.linspace(-1.0, 1.0, num_lat + 1)))
+    lon_edges = np.linspace(-180.0, 180.0, num_lon + 1)
+    transform_kwargs = {} if transform is None else {'transform': transform}
+    return ax.pcolormesh(lon_edges, lat_edges, covered, cmap=ListedColormap([constellation_config['color']]),
+                         alpha=constellation_config['alpha'], rasterized=True, shading='flat', **transform_kwargs)
+
 def plot_single_constellation_cartopy(constellation_name):
     """Plot single constellation coverage map"""
     constellations = CONSTELLATIONS
@@ -247,33 +294,21 @@ def plot_earth_coverage_basemap():
     total_satellites = 0
     
     for constellation_name, config in constellations.items():
-        satellite_data = read_satellite_data(config['file'])
+        satellite_data = load_constellation_data(config)
         if not satellite_data:
             continue
             
         total_satellites += len(satellite_data)
         print(f"Drawing {len(satellite_data)} {config['label']} satellite coverage areas")
         
-        for lon, lat, alt, tag in satellite_data:
-            x, y = m(lon, lat)
-            
-            circle = Circle((x, y), coverage_radius_deg * 111320,
-                           facecolor=config['color'], 
-                           edgecolor=config['color'],
-                           alpha=config['alpha'],
-                           linewidth=0.2)
-            plt.gca().add_patch(circle)
-            
-            circle_border = Circle((x, y), coverage_radius_deg * 111320,
-                                 facecolor='none',
-                                 edgecolor=config['color'],
-                                 linewidth=1.2,
-                                 linestyle='--',
-                                 alpha=0.8)
-            plt.gca().add_patch(circle_border)
-            
-            plt.plot(x, y, 'o', color=config['color'], markersize=0.8, 
-                    markeredgecolor='black', markeredgewidth=0.1)
+        x, y = m([satellite[0] for satellite in satellite_data], [satellite[1] for satellite in satellite_data])
+        fill, border = coverage_collections(x, y, coverage_radius_deg * 111320, config, glow=False)
+        fill.set_linewidth(0.2)
+        plt.gca().add_collection(fill)
+        plt.gca().add_collection(border)
+        
+        plt.plot(x, y, 'o', color=config['color'], markersize=0.8, 
+                markeredgecolor='black', markeredgewidth=0.1, linestyle='none')
     
     from matplotlib.patches import Patch
     legend_elements = [Patch(facecolor=config['color'], alpha=0.6, label=config['label']) 
@@ -355,8 +390,9 @@ def interactive_plot_selection():
     return True
 
 if __name__ == "__main__":
-    if not os.path.exists('./classified_gs/'):
-        print("classified_gs directory does not exist, please run classification script first: python classify_satellites.py")
+    if not os.path.exists(POSITION_STORE) and not os.path.exists('./classified_gs/'):
+        print("Neither the position store nor the classified_gs directory exists, please run constellation_visualization.py "
+              "or the classification script first: python classify_satellites.py")
         exit(1)
     
     print("=== Advanced Satellite Coverage Map Generation Tool ===")
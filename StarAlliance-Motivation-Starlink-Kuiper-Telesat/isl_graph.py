@@ -0,0 +1,355 @@
+import datetime
+import os
+import numpy as np
+import position_store
+import propagation
+
+# scipy.sparse is only needed for sparse_adjacency; the CSR arrays themselves are plain numpy
+try:
+    import scipy.sparse
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+SPEED_OF_LIGHT_KM_S = 299792.458
+
+# Delta-encoded ISL snapshots of a whole run, in the columnar format of position_store.
+# The +Grid topology (sat1, sat2) is stored once. Link lengths are quantized to LENGTH_UNIT_M meters: the first
+# timestep in full (int32), every later one as its difference to the previous. Links between adjacent planes
+# change by at most about 7 km per 15 s step, so the differences are int16; int32 is only used when some
+# difference does not fit (e.g. much longer time steps, or links across many removed planes).
+# Links switched on or off at a timestep (polar cut-off) are listed per timestep, CSR-style.
+MAGIC = b"SATISL01"
+LENGTH_UNIT_M = 1.0
+ISL_SNAPSHOT_FILE = os.path.join("SatellitePositions", "isl_snapshots.bin")
+
+# Inter-plane links of pruned shells can span removed planes; a link is only available while its line of sight
+# stays this far above the (spherical) Earth
+GRAZING_ALTITUDE_KM = 80.0
+
+
+def grid_edges(satellite_index):
+    """
+    +Grid ISL edges: every satellite links to the next satellite of its orbit (intra-plane)
+    and to the same slot of the next orbit (inter-plane), giving four links per satellite
+    :param satellite_index: (number_of_orbit, number_of_satellite_per_orbit) satellite indexes, -1 where missing
+    :return: (sat1, sat2, inter_plane) arrays with one entry per undirected link
+    """
+    intra_plane_neighbor = np.roll(satellite_index, -1, axis=1)
+    inter_plane_neighbor = np.roll(satellite_index, -1, axis=0)
+    sat1 = np.concatenate([satellite_index.ravel(), satellite_index.ravel()])
+    sat2 = np.concatenate([intra_plane_neighbor.ravel(), inter_plane_neighbor.ravel()])
+    inter_plane = np.repeat([False, True], satellite_index.size)
+
+    # Drop links to missing satellites, self links and duplicates (shells with one or two orbits/slots)
+    keep = (sat1 >= 0) & (sat2 >= 0) & (sat1 != sat2)
+    sat1, sat2, inter_plane = sat1[keep], sat2[keep], inter_plane[keep]
+    _, first = np.unique(np.stack([np.minimum(sat1, sat2), np.maximum(sat1, sat2)], axis=1),
+                         axis=0, return_index=True)
+    first = np.sort(first)
+    return sat1[first], sat2[first], inter_plane[first]
+
+
+def constellation_ISL_edges(constellation_information):
+    """
+    +Grid edges of every shell, as column indexes of the concatenated shells (position store column order).
+    In pruned shells every kept plane links to the nearest kept plane on each side, skipping removed planes;
+    such links can be long, and write_isl_snapshots switches them off while the Earth blocks their line of sight.
+    :return: (sat1, sat2, inter_plane)
+    """
+    sat1, sat2, inter_plane = [], [], []
+    column_offset = 0
+    for shell in constellation_information:
+        orbit, slot = np.divmod(propagation.shell_sat_ids(shell) - shell[5], shell[3])
+        number_of_satellites = len(orbit)
+        # Grid rows are the kept planes in orbit order, so rolling the rows reaches the next kept plane
+        kept_orbits, plane = np.unique(orbit, return_inverse=True)
+        satellite_index = np.full((len(kept_orbits), shell[3]), -1, dtype=np.int64)
+        satellite_index[plane, slot] = column_offset + np.arange(number_of_satellites)
+        shell_sat1, shell_sat2, shell_inter_plane = grid_edges(satellite_index)
+        sat1.append(shell_sat1)
+        sat2.append(shell_sat2)
+        inter_plane.append(shell_inter_plane)
+        column_offset += number_of_satellites
+    return np.concatenate(sat1), np.concatenate(sat2), np.concatenate(inter_plane)
+
+
+def line_of_sight(xyz, sat1, sat2, grazing_altitude=GRAZING_ALTITUDE_KM):
+    """
+    Links whose straight line stays grazing_altitude above the Earth
+    :param xyz: (t, N, 3) satellite positions in km
+    :return: (t, num_links) bool
+    """
+    xyz = np.asarray(xyz, dtype=np.float64)
+    start = xyz[:, sat1]
+    direction = xyz[:, sat2] - start
+    # Point of each segment closest to the Earth's centre
+    along = np.clip(-np.sum(start * direction, axis=-1) / np.maximum(np.sum(direction ** 2, axis=-1), 1e-12), 0, 1)
+    closest = np.linalg.norm(start + along[..., None] * direction, axis=-1)
+    return closest >= propagation.EARTH_MEAN_RADIUS_KM + grazing_altitude
+
+
+def component_counts(sat1, sat2, num_satellites, active):
+    """
+    Number of connected components of the available links at each timestep, by minimum-label propagation
+    over all timesteps at once
+    :param active: (t, num_links) bool
+    :return: (t,) int64
+    """
+    num_steps = len(active)
+    offset = (np.arange(num_steps, dtype=np.int64) * num_satellites)[:, None]
+    node1 = (offset + np.asarray(sat1, dtype=np.int64))[active]
+    node2 = (offset + np.asarray(sat2, dtype=np.int64))[active]
+    label = np.arange(num_steps * num_satellites, dtype=np.int64)
+    while True:
+        lowest = np.minimum(label[node1], label[node2])
+        updated = label.copy()
+        np.minimum.at(updated, node1, lowest)
+        np.minimum.at(updated, node2, lowest)
+        # Pointer jumping: every node takes the label of its label
+        updated = updated[updated]
+        if np.array_equal(updated, label):
+            break
+        label = updated
+    roots = label == np.arange(len(label))
+    return roots.reshape(num_steps, num_satellites).sum(axis=1)
+
+
+def link_delays(lengths):
+    """One-way propagation delay in ms of links of the given lengths in km"""
+    return (np.asarray(lengths, dtype=np.float32) * np.float32(1000.0 / SPEED_OF_LIGHT_KM_S)).astype(np.float32)
+
+
+class ISLGraph:
+    """
+    Fixed ISL topology as CSR adjacency: the neighbors of satellite i are indices[indptr[i]:indptr[i + 1]],
+    and link_of_entry maps each adjacency entry to its undirected link, so the weights of any timestep
+    are a gather from one (number of links,) array
+    """
+
+    __slots__ = ("num_satellites", "sat1", "sat2", "inter_plane", "indptr", "indices", "link_of_entry")
+
+    def __init__(self, sat1, sat2, num_satellites, inter_plane=None):
+        self.num_satellites = num_satellites
+        self.sat1 = np.asarray(sat1, dtype=np.int32)
+        self.sat2 = np.asarray(sat2, dtype=np.int32)
+        if inter_plane is None:
+            inter_plane = np.zeros(len(self.sat1), dtype=bool)
+        self.inter_plane = np.asarray(inter_plane, dtype=bool)
+        # Both directions of every link, grouped by source satellite
+        source = np.concatenate([self.sat1, self.sat2])
+        target = np.concatenate([self.sat2, self.sat1])
+        link = np.tile(np.arange(len(self.sat1), dtype=np.int32), 2)
+        order = np.lexsort((target, source))
+        self.indptr = np.zeros(num_satellites + 1, dtype=np.int64)
+        np.cumsum(np.bincount(source, minlength=num_satellites), out=self.indptr[1:])
+        self.indices = target[order]
+        self.link_of_entry = link[order]
+
+    @classmethod
+    def from_constellation(cls, constellation_information):
+        """+Grid ISLs of every shell, over the columns of a position store of the same shells"""
+        sat1, sat2, inter_plane = constellation_ISL_edges(constellation_information)
+        num_satellites = sum(len(propagation.shell_sat_ids(shell)) for shell in constellation_information)
+        return cls(sat1, sat2, num_satellites, inter_plane)
+
+    @property
+    def num_links(self):
+        return len(self.sat1)
+
+    def link_lengths(self, satellites, begin=0, end=None):
+        """
+        :param satellites: position_arrays.SatellitePositions over the same columns
+        :return: (end - begin, num_links) float32 link lengths in km
+        """
+        return satellites.link_lengths(self.sat1, self.sat2, begin, end)
+
+    def active_links(self, latitude, max_latitude=None, xyz=None, grazing_altitude=GRAZING_ALTITUDE_KM):
+        """
+        Links available at each timestep: inter-plane links are switched off while either end is beyond
+        max_latitude (satellites over the poles cannot track their neighbors); intra-plane links are always on.
+        With xyz, inter-plane links are also switched off while the Earth blocks their line of sight.
+        :param latitude: (t, N) satellite latitudes in degrees
+        :param xyz: Optional (t, N, 3) satellite positions in km
+        :return: (t, num_links) bool
+        """
+        latitude = np.asarray(latitude)
+        active = np.ones((len(latitude), self.num_links), dtype=bool)
+        if max_latitude is not None:
+            polar = np.abs(latitude) > max_latitude
+            active &= ~(self.inter_plane & (polar[:, self.sat1] | polar[:, self.sat2]))
+        if xyz is not None:
+            inter_plane = np.nonzero(self.inter_plane)[0]
+            active[:, inter_plane] &= line_of_sight(xyz, self.sat1[inter_plane], self.sat2[inter_plane],
+                                                    grazing_altitude)
+        return active
+
+    def adjacency(self, weights, active=None):
+        """
+        CSR adjacency of one snapshot
+        :param weights: (num_links,) weight of every link, e.g. length or delay
+        :param active: Optional (num_links,) mask of available links
+        :return: (indptr, indices, data) arrays
+        """
+        data = np.asarray(weights)[self.link_of_entry]
+        if active is None:
+            return self.indptr, self.indices, data
+        keep = np.asarray(active)[self.link_of_entry]
+        source = np.repeat(np.arange(self.num_satellites), np.diff(self.indptr))
+        indptr = np.zeros_like(self.indptr)
+        np.cumsum(np.bincount(source[keep], minlength=self.num_satellites), out=indptr[1:])
+        return indptr, self.indices[keep], data[keep]
+
+    def sparse_adjacency(self, weights, active=None):
+        """adjacency as a scipy.sparse.csr_matrix, e.g. for scipy.sparse.csgraph"""
+        if not SCIPY_AVAILABLE:
+            raise ImportError("scipy is required for sparse_adjacency")
+        indptr, indices, data = self.adjacency(weights, active)
+        return scipy.sparse.csr_matrix((data, indices, indptr), shape=(self.num_satellites, self.num_satellites))
+
+
+class ISLSnapshots:
+    """Memory-mapped delta-encoded link lengths and availability of every timestep"""
+
+    def __init__(self, path, header):
+        self.path = path
+        self.header = header
+        self.num_time_steps = header["num_time_steps"]
+        self.num_satellites = header["num_satellites"]
+        self.length_unit_m = header["length_unit_m"]
+        self.max_latitude = header["max_latitude"]
+        self.start_time = datetime.datetime.fromisoformat(header["start_time"])
+        self.time_step = datetime.timedelta(seconds=header["time_step_seconds"])
+        for name, column in position_store.map_columns(path, header).items():
+            setattr(self, name, column)
+        self.graph = ISLGraph(self.sat1, self.sat2, self.num_satellites, self.inter_plane.astype(bool))
+
+    def lengths(self, begin=0, end=None):
+        """
+        Link lengths of timesteps begin:end, rebuilt exactly from the integer deltas
+        :return: (end - begin, num_links) float32 lengths in km
+        """
+        if end is None:
+            end = self.num_time_steps
+        quantized = self.base_length.astype(np.int64) + np.concatenate(
+            [np.zeros((1, self.graph.num_links), dtype=np.int64),
+             np.cumsum(self.length_delta[:end - 1], axis=0, dtype=np.int64)])[begin:end]
+        return (quantized * (self.length_unit_m / 1000.0)).astype(np.float32)
+
+    def active(self, begin=0, end=None):
+        """(end - begin, num_links) bool link availability of timesteps begin:end"""
+        if end is None:
+            end = self.num_time_steps
+        toggled = np.zeros((end, self.graph.num_links), dtype=bool)
+        counts = np.diff(self.toggle_indptr[:end + 1])
+        toggled[np.repeat(np.arange(end), counts), self.toggle_link[:self.toggle_indptr[end]]] = True
+        return (np.logical_xor.accumulate(toggled, axis=0) ^ self.active_0.astype(bool))[begin:end]
+
+    def snapshots(self, begin=0, end=None):
+        """
+        Walk the timesteps in order, applying one delta per step
+        :return: Generator of (timestep, (num_links,) bool active, (num_links,) float32 lengths in km);
+                 the yielded arrays are reused, copy them to keep them
+        """
+        if end is None:
+            end = self.num_time_steps
+        quantized = self.base_length.astype(np.int64)
+        active = self.active_0.astype(bool)
+        scale = self.length_unit_m / 1000.0
+        for time_step_index in range(end):
+            if time_step_index > 0:
+                quantized += self.length_delta[time_step_index - 1]
+                toggles = self.toggle_link[self.toggle_indptr[time_step_index]:self.toggle_indptr[time_step_index + 1]]
+                active[toggles] = ~active[toggles]
+            if time_step_index >= begin:
+                yield time_step_index, active, (quantized * scale).astype(np.float32)
+
+
+def write_isl_snapshots(path, graph, satellites, max_latitude=None, block_size=256, length_unit_m=LENGTH_UNIT_M):
+    """
+    Compute link lengths and availability of every timestep block by block and save them delta-encoded
+    :param graph: ISLGraph over the columns of satellites
+    :param satellites: position_arrays.SatellitePositions
+    :param max_latitude: Polar cut-off of inter-plane links in degrees, None to keep every link
+    :return: Read-only ISLSnapshots
+    :raises ValueError: When the available links split the constellation into more components than the full
+                        topology at some timestep (e.g. the Earth blocks every link between two kept planes)
+    """
+    num_time_steps = satellites.num_time_steps
+    num_links = graph.num_links
+    topology_components = component_counts(graph.sat1, graph.sat2, graph.num_satellites,
+                                           np.ones((1, num_links), dtype=bool))[0]
+
+    def quantized_blocks():
+        # One timestep of overlap, so the delta across block borders is available
+        for begin in range(0, num_time_steps, block_size):
+            first = max(begin - 1, 0)
+            end = min(begin + block_size, num_time_steps)
+            quantized = np.round(graph.link_lengths(satellites, first, end).astype(np.float64)
+                                 * (1000.0 / length_unit_m)).astype(np.int64)
+            active = graph.active_links(satellites.latitude[first:end], max_latitude, satellites.xyz(first, end))
+            yield begin, first, quantized, active
+
+    # First pass: delta range (picks the delta dtype) and the sparse topology changes
+    max_delta = 0
+    base_length = active_0 = None
+    toggle_counts = np.zeros(num_time_steps, dtype=np.int64)
+    toggle_links = []
+    for begin, first, quantized, active in quantized_blocks():
+        components = component_counts(graph.sat1, graph.sat2, graph.num_satellites, active)
+        if components.max() > topology_components:
+            time_step_index = first + int(np.argmax(components > topology_components))
+            raise ValueError(f"ISL graph is disconnected at timestep {time_step_index}: "
+                             f"{components.max()} components instead of {topology_components}")
+        if begin == 0:
+            base_length, active_0 = quantized[0], active[0]
+        if len(quantized) > 1:
+            max_delta = max(max_delta, int(np.abs(np.diff(quantized, axis=0)).max(initial=0)))
+        changed_step, changed_link = np.nonzero(active[1:] != active[:-1])
+        np.add.at(toggle_counts, first + 1 + changed_step, 1)
+        toggle_links.append(changed_link.astype(np.int32))
+    delta_dtype = np.int16 if max_delta <= np.iinfo(np.int16).max else np.int32
+    arrays = {
+        "sat1": graph.sat1,
+        "sat2": graph.sat2,
+        "inter_plane": graph.inter_plane.astype(np.uint8),
+        "base_length": base_length.astype(np.int32),
+        "active_0": active_0.astype(np.uint8),
+        "toggle_indptr": np.concatenate([[0], np.cumsum(toggle_counts)]).astype(np.int64),
+        "toggle_link": np.concatenate(toggle_links) if toggle_links else np.zeros(0, dtype=np.int32),
+    }
+    delta_shape = (max(num_time_steps - 1, 0), num_links)
+    header = {
+        "num_time_steps": num_time_steps,
+        "num_satellites": graph.num_satellites,
+        "num_links": num_links,
+        "length_unit_m": length_unit_m,
+        "max_latitude": max_latitude,
+        "grazing_altitude_km": GRAZING_ALTITUDE_KM,
+        "start_time": satellites.start_time.isoformat(),
+        "time_step_seconds": satellites.time_step.total_seconds(),
+    }
+    columns = [(name, array.dtype, array.shape) for name, array in arrays.items()]
+    header = position_store.create_columns(path, MAGIC, header, columns + [("length_delta", delta_dtype, delta_shape)])
+    mapped = position_store.map_columns(path, header, "r+")
+    for name, array in arrays.items():
+        mapped[name][:] = array
+
+    # Second pass: the deltas, written straight into the memory-mapped column
+    length_delta = mapped["length_delta"]
+    if delta_shape[0] > 0:
+        for begin, first, quantized, _ in quantized_blocks():
+            delta = np.diff(quantized, axis=0)
+            length_delta[first:first + len(delta)] = delta
+    position_store.flush_columns(mapped.values())
+    del mapped, length_delta
+    return ISLSnapshots(path, header)
+
+
+def open_isl_snapshots(path=ISL_SNAPSHOT_FILE):
+    """
+    Open existing snapshots read-only; every column is a zero-copy memory map
+    :param path: Snapshot file path
+    :return: ISLSnapshots
+    """
+    return ISLSnapshots(path, position_store.read_header(path, MAGIC, "an ISL snapshot file"))
@@ -0,0 +1,85 @@
+
+import numpy as np
+import coverage_grid
+import propagation
+
+
+# Number of set bits of every byte value
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def popcount(bits, axis=None):
+    return POPCOUNT[bits].sum(axis=axis, dtype=np.int64)
+
+
+def plane_coverage_bits(mean_motion, altitude, number_of_orbit, number_of_satellite_per_orbit, inclination,
+                        coverage_radius_km, start_time, time_step, num_time_steps, num_lat=90, num_lon=180,
+                        phase_shift=True):
+    """
+    Coverage bitset of every orbital plane of a shell over the ground grid and the time grid.
+    The shell is propagated once; candidate plane subsets are then evaluated with bitwise operations only.
+    :param coverage_radius_km: Footprint radius (ground distance) in km
+    :return: (plane_bits, num_bits): (number_of_orbit, bytes) uint8 rows where bit (t, cell) is set when a satellite
+             of the plane covers the cell at time step t, and the number of meaningful bits per row
+    """
+    longitude, latitude, _ = propagation.propagate_shell(mean_motion, altitude, number_of_orbit,
+                                                         number_of_satellite_per_orbit, inclination,
+                                                         start_time, time_step, num_time_steps, phase_shift)
+    plane_bits = []
+    for orbit in range(number_of_orbit):
+        columns = slice(orbit * number_of_satellite_per_orbit, (orbit + 1) * number_of_satellite_per_orbit)
+        covered = coverage_grid.coverage_multiplicity(longitude[:, columns], latitude[:, columns],
+                                                      coverage_radius_km, num_lat, num_lon) > 0
+        plane_bits.append(np.packbits(covered.ravel()))
+    return np.array(plane_bits), num_time_steps * num_lat * num_lon
+
+
+def subset_coverage(plane_bits, num_bits, orbits):
+    """
+    Fraction of (time step, cell) pairs covered by the given subset of planes
+    """
+    if len(orbits) == 0:
+        return 0.0
+    return popcount(np.bitwise_or.reduce(plane_bits[list(orbits)], axis=0)) / num_bits
+
+
+def select_orbits(plane_bits, keep_count):
+    """
+    Greedily keep the keep_count planes that add the most coverage to the planes already kept
+    :return: Sorted list of kept orbit indexes
+    """
+    union = np.zeros(plane_bits.shape[1], dtype=np.uint8)
+    remaining = list(range(len(plane_bits)))
+    kept = []
+    for _ in range(min(keep_count, len(remaining))):
+        gains = popcount(plane_bits[remaining] & ~union, axis=1)
+        best = remaining.pop(int(np.argmax(gains)))
+        kept.append(best)
+        union |= plane_bits[best]
+    return sorted(kept)
+
+
+def prune_orbits(plane_bits, num_bits, target_coverage, min_orbits=1):
+    """
+    Repeatedly drop the plane whose removal loses the least coverage, as long as coverage stays >= target_coverage.
+    Per-bit multiplicities are kept up to date, so the loss of a plane is the popcount of the bits it covers alone.
+    :param target_coverage: Minimum covered fraction of (time step, cell) pairs
+    :param min_orbits: Never keep fewer planes than this
+    :return: Sorted list of kept orbit indexes
+    """
+    kept = list(range(len(plane_bits)))
+    multiplicity = np.zeros(plane_bits.shape[1] * 8, dtype=np.uint16)
+    for bits in plane_bits:
+        multiplicity += np.unpackbits(bits)
+    covered_bits = int(np.count_nonzero(multiplicity))
+    target_bits = target_coverage * num_bits
+    while len(kept) > min_orbits:
+        single = np.packbits(multiplicity == 1)
+        losses = popcount(plane_bits[kept] & single, axis=1)
+        candidate = int(np.argmin(losses))
+        if covered_bits - losses[candidate] < target_bits:
+            break
+        orbit = kept.pop(candidate)
+        covered_bits -= int(losses[candidate])
+        multiplicity -= np.unpackbits(plane_bits[orbit])
+    return sorted(kept)
@@ -0,0 +1,158 @@
+
+import numpy as np
+import position_store
+import propagation
+
+
+class SatellitePositions:
+    """
+    Struct-of-arrays container of satellite positions over a time grid.
+    longitude/latitude/altitude are (T, N) float32 (memory maps when loaded from a position store),
+    sat_id/shell are (N,) int32. Cartesian positions are derived on demand as (t, N, 3) float32 blocks.
+    """
+
+    __slots__ = ("longitude", "latitude", "altitude", "sat_id", "shell", "start_time", "time_step", "_xyz")
+
+    def __init__(self, longitude, latitude, altitude, sat_id, shell, start_time=None, time_step=None):
+        self.longitude = longitude
+        self.latitude = latitude
+        self.altitude = altitude
+        self.sat_id = np.asarray(sat_id, dtype=np.int32)
+        self.shell = np.asarray(shell, dtype=np.int32)
+        self.start_time = start_time
+        self.time_step = time_step
+        self._xyz = None
+
+    @classmethod
+    def from_store(cls, store=position_store.POSITION_STORE_FILE):
+        """
+        Zero-copy view of a position store
+        :param store: PositionStore or store path
+        """
+        if isinstance(store, str):
+            store = position_store.open_position_store(store)
+        return cls(store.longitude, store.latitude, store.altitude, store.sat_id, store.shell,
+                   store.start_time, store.time_step)
+
+    @classmethod
+    def propagate(cls, constellation_information, start_time, time_step, num_time_steps, phase_shift=True):
+        """Propagate a constellation straight into the container (see propagation.propagate_constellation)"""
+        longitude, latitude, altitude, shell = propagation.propagate_constellation(
+            constellation_information, start_time, time_step, num_time_steps, phase_shift)
+        sat_id = np.concatenate([propagation.shell_sat_ids(shell_information)
+                                 for shell_information in constellation_information])
+        return cls(longitude.astype(np.float32), latitude.astype(np.float32), altitude.astype(np.float32),
+                   sat_id, shell, start_time, time_step)
+
+    @property
+    def num_time_steps(self):
+        return self.longitude.shape[0]
+
+    @property
+    def num_satellites(self):
+        return self.longitude.shape[1]
+
+    def time_step_positions(self, time_step_index):
+        """Views (no copy) of one time step: (longitude, latitude, altitude) of length num_satellites"""
+        return (self.longitude[time_step_index], self.latitude[time_step_index],
+                self.altitude[time_step_index])
+
+    def xyz(self, begin=0, end=None, chunk_size=256):
+        """
+        Cartesian positions in km (spherical Earth)
+        :param begin: First time step index
+        :param end: End time step index (exclusive), all time steps by default
+        :return: (end - begin, N, 3) float32; the full array is computed once and then served as views
+        """
+        if end is None:
+            end = self.num_time_steps
+        if self._xyz is None and (begin, end) == (0, self.num_time_steps):
+            xyz = np.empty((self.num_time_steps, self.num_satellites, 3), dtype=np.float32)
+            for chunk_begin in range(0, self.num_time_steps, chunk_size):
+                chunk_end = min(chunk_begin + chunk_size, self.num_time_steps)
+                xyz[chunk_begin:chunk_end] = propagation.lon_lat_alt_to_xyz(
+                    self.longitude[chunk_begin:chunk_end], self.latitude[chunk_begin:chunk_end],
+                    self.altitude[chunk_begin:chunk_end])
+            self._xyz = xyz
+        if self._xyz is not None:
+            return self._xyz[begin:end]
+        return propagation.lon_lat_alt_to_xyz(self.longitude[begin:end], self.latitude[begin:end],
+                                              self.altitude[begin:end]).astype(np.float32)
+
+    def shell_columns(self, shell):
+        """Column indexes of the satellites of one shell (constellation tag)"""
+        return np.flatnonzero(self.shell == shell)
+
+    def select(self, columns):
+        """New container with only the given satellite columns (copied)"""
+        return SatellitePositions(self.longitude[:, columns], self.latitude[:, columns], self.altitude[:, columns],
+                                  self.sat_id[columns], self.shell[columns], self.start_time, self.time_step)
+
+    def link_lengths(self, sat1, sat2, begin=0, end=None):
+        """
+        Length in km of the links sat1[k] - sat2[k] (column indexes) at every time step
+        :return: (end - begin, number of links) float32
+        """
+        xyz = self.xyz(begin, end)
+        return np.linalg.norm(xyz[:, sat2] - xyz[:, sat1], axis=-1)
+
+    def write_store(self, path):
+        """Write the container to a position store file"""
+        store = position_store.create_position_store(path, self.num_time_steps, self.sat_id, self.shell,
+                                                     self.start_time, self.time_step)
+        store.longitude[:] = self.longitude
+        store.latitude[:] = self.latitude
+        store.altitude[:] = self.altitude
+        store.flush()
+        return store
+
+
+class UserPositions:
+    """
+    Ground users as arrays: names, longitude/latitude in degrees, optional int16 region codes and
+    (U, 3) float64 Cartesian positions in km
+    """
+
+    __slots__ = ("_name", "longitude", "latitude", "region", "xyz")
+
+    def __init__(self, name, longitude, latitude, region=None):
+        """
+        :param name: User names, or None for synthetic populations (generated on first use)
+        :param region: Optional (U,) integer region code of every user
+        """
+        self._name = list(name) if name is not None else None
+        self.longitude = np.asarray(longitude, dtype=np.float64)
+        self.latitude = np.asarray(latitude, dtype=np.float64)
+        self.region = np.asarray(region, dtype=np.int16) if region is not None else None
+        self.xyz = propagation.lon_lat_alt_to_xyz(self.longitude, self.latitude, np.zeros(len(self.longitude)))
+
+    @classmethod
+    def from_file(cls, path):
+        """Read "name longitude latitude" lines (user_locations.txt)"""
+        names, longitudes, latitudes = [], [], []
+        with open(path, 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                names.append(fields[0])
+                longitudes.append(float(fields[1]))
+                latitudes.append(float(fields[2]))
+        return cls(names, longitudes, latitudes)
+
+    @property
+    def name(self):
+        if self._name is None:
+            self._name = [f"user_{index}" for index in range(len(self.longitude))]
+        return self._name
+
+    def select(self, index):
+        """New container with only the given users (a slice or index array)"""
+        name = None
+        if self._name is not None:
+            name = np.asarray(self._name, dtype=object)[index].tolist()
+        region = self.region[index] if self.region is not None else None
+        return UserPositions(name, self.longitude[index], self.latitude[index], region)
+
+    def __len__(self):
+        return len(self.longitude)
@@ -0,0 +1,186 @@
+
+import datetime
+import json
+import os
+import numpy as np
+
+
+# Single-file columnar format shared by every binary output of the project (satellite positions, visibility,
+# ISL snapshots, per-user results), each with its own MAGIC:
+# MAGIC | header length (uint64) | JSON header | columns, each aligned to ALIGNMENT bytes.
+# The header lists the dtype, shape and offset of every column, so any column is a zero-copy memory map.
+ALIGNMENT = 64
+# The header holds the column offsets, which depend on its size: it gets a slot of whole HEADER_BLOCKs
+HEADER_BLOCK = 4096
+
+# Satellite positions: per-time-step columns have shape (num_time_steps, num_satellites) so one time step
+# is one contiguous row
+MAGIC = b"SATPOS01"
+POSITION_STORE_FILE = os.path.join("SatellitePositions", "satellite_positions.bin")
+
+TIME_STEP_COLUMNS = [("longitude", "float32"), ("latitude", "float32"), ("altitude", "float32")]
+SATELLITE_COLUMNS = [("sat_id", "int32"), ("shell", "int32")]
+
+
+def _align(offset, alignment=ALIGNMENT):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def create_columns(path, magic, header, columns):
+    """
+    Write the header of a columnar file and size the file for its columns, which are left zero-filled
+    :param path: Output file path
+    :param magic: 8-byte file type tag
+    :param header: JSON-serializable dict describing the file; the column layout is added under "columns"
+    :param columns: List of (name, dtype, shape)
+    :return: The header as written
+    """
+    header_slot = HEADER_BLOCK
+    while True:
+        offset = _align(len(magic) + 8 + header_slot)
+        layout = {}
+        for name, dtype, shape in columns:
+            dtype = np.dtype(dtype)
+            layout[name] = {"dtype": dtype.str, "shape": [int(size) for size in shape], "offset": offset}
+            offset = _align(offset + int(np.prod(shape, dtype=np.int64)) * dtype.itemsize)
+        header = dict(header, columns=layout)
+        header_bytes = json.dumps(header).encode("utf-8")
+        if len(header_bytes) <= header_slot:
+            break
+        header_slot = _align(len(header_bytes), HEADER_BLOCK)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(magic)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        f.truncate(offset)
+    return header
+
+
+def write_columns(path, magic, header, arrays):
+    """
+    Write a complete columnar file from in-memory arrays. The file is written next to the target and renamed,
+    so a reader never sees a partial file.
+    :param arrays: Dict of column name -> numpy array
+    :return: The header as written
+    """
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    header = create_columns(temporary_path, magic, header,
+                            [(name, array.dtype, array.shape) for name, array in arrays.items()])
+    with open(temporary_path, 'r+b') as f:
+        for name, array in arrays.items():
+            f.seek(header["columns"][name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(temporary_path, path)
+    return header
+
+
+def read_header(path, magic, description):
+    """
+    :param description: What the file should be, for the error message, e.g. "a satellite position store"
+    :return: JSON header of an existing columnar file
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError(f"{path} is not {description}")
+        header_length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        return json.loads(f.read(header_length).decode("utf-8"))
+
+
+def map_columns(path, header, mode="r"):
+    """
+    Memory-map every column of a columnar file
+    :param mode: "r" for read-only, "r+" to write into the columns
+    :return: Dict of column name -> numpy.memmap (a plain empty array for empty columns, which cannot be mapped)
+    """
+    columns = {}
+    for name, column in header["columns"].items():
+        shape = tuple(column["shape"])
+        if 0 in shape:
+            columns[name] = np.zeros(shape, dtype=column["dtype"])
+        else:
+            columns[name] = np.memmap(path, dtype=column["dtype"], mode=mode, offset=column["offset"], shape=shape)
+    return columns
+
+
+def flush_columns(columns):
+    """Flush writable columns from map_columns (empty columns are not mapped and need no flush)"""
+    for column in columns:
+        if isinstance(column, np.memmap):
+            column.flush()
+
+
+class PositionStore:
+    """Memory-mapped satellite positions: float32 longitude/latitude/altitude per time step, int32 sat_id/shell per satellite"""
+
+    def __init__(self, path, header, mode):
+        self.path = path
+        self.header = header
+        self.num_time_steps = header["num_time_steps"]
+        self.num_satellites = header["num_satellites"]
+        self.start_time = datetime.datetime.fromisoformat(header["start_time"])
+        self.time_step = datetime.timedelta(seconds=header["time_step_seconds"])
+        self.metadata = header.get("metadata")
+        for name, column in map_columns(path, header, mode).items():
+            setattr(self, name, column)
+
+    def time_step_positions(self, time_step_index):
+        """
+        Views (no copy) of one time step
+        :param time_step_index: 0-based time step index
+        :return: (longitude, latitude, altitude) arrays of length num_satellites
+        """
+        return (self.longitude[time_step_index], self.latitude[time_step_index],
+                self.altitude[time_step_index])
+
+    def time_of(self, time_step_index):
+        return self.start_time + self.time_step * time_step_index
+
+    def flush(self):
+        flush_columns([getattr(self, name) for name, _ in TIME_STEP_COLUMNS + SATELLITE_COLUMNS])
+
+
+def create_position_store(path, num_time_steps, sat_id, shell, start_time, time_step, metadata=None):
+    """
+    Create an empty store sized for the whole simulation and open it for writing
+    :param path: Output file path
+    :param num_time_steps: Number of time steps
+    :param sat_id: Global satellite ID of each column
+    :param shell: 1-based shell (constellation tag) of each column
+    :param start_time: datetime of the first time step
+    :param time_step: datetime.timedelta between time steps
+    :param metadata: Optional JSON-serializable description of the run, e.g. the propagated shells
+    :return: Writable PositionStore; sat_id and shell are already filled
+    """
+    sat_id = np.asarray(sat_id, dtype=np.int32)
+    shell = np.asarray(shell, dtype=np.int32)
+    num_satellites = len(sat_id)
+
+    columns = [(name, dtype, (num_time_steps, num_satellites)) for name, dtype in TIME_STEP_COLUMNS]
+    columns += [(name, dtype, (num_satellites,)) for name, dtype in SATELLITE_COLUMNS]
+    header = {
+        "num_time_steps": num_time_steps,
+        "num_satellites": num_satellites,
+        "start_time": start_time.isoformat(),
+        "time_step_seconds": time_step.total_seconds(),
+    }
+    if metadata is not None:
+        header["metadata"] = metadata
+    header = create_columns(path, MAGIC, header, columns)
+
+    store = PositionStore(path, header, "r+")
+    store.sat_id[:] = sat_id
+    store.shell[:] = shell
+    return store
+
+
+def open_position_store(path=POSITION_STORE_FILE):
+    """
+    Open an existing store read-only; every column is a zero-copy memory map
+    :param path: Store file path
+    :return: PositionStore
+    """
+    return PositionStore(path, read_header(path, MAGIC, "a satellite position store"), "r")
@@ -0,0 +1,298 @@
+
+import datetime
+import numpy as np
+
+
+# SGP4 constants (WGS-72), identical to the ones ephem uses for EarthSatellite
+XKE = 0.0743669161  # sqrt(GM) in (earth radii)^1.5 / minute
+CK2 = 5.413080e-4  # 0.5 * J2
+CK4 = 0.62098875e-6  # -0.375 * J4
+XJ3 = -0.253881e-5  # J3
+A3OVK2 = -XJ3 / CK2
+EARTH_RADIUS_KM = 6378.135
+MINUTES_PER_DAY = 1440.0
+
+# Mean Earth radius used for Cartesian positions, as in the handoff analysis
+EARTH_MEAN_RADIUS_KM = 6371.0
+
+# Julian date of the Unix epoch, used to convert datetimes to sidereal time
+UNIX_EPOCH = datetime.datetime(1970, 1, 1)
+UNIX_EPOCH_JULIAN_DATE = 2440587.5
+
+
+def julian_date(time):
+    """
+    Convert a datetime (or an "YYYY-mm-dd HH:MM:SS" string) to a Julian date
+    :param time: datetime.datetime or string
+    :return: Julian date as float
+    """
+    if isinstance(time, str):
+        time = datetime.datetime.strptime(time, "%Y-%m-%d %H:%M:%S")
+    return UNIX_EPOCH_JULIAN_DATE + (time - UNIX_EPOCH).total_seconds() / 86400.0
+
+
+def greenwich_sidereal_angle(julian_dates):
+    """
+    Greenwich mean sidereal angle in degrees for an array of Julian dates
+    :param julian_dates: Julian dates (UT1)
+    :return: Sidereal angle in degrees, in [0, 360)
+    """
+    days = np.asarray(julian_dates, dtype=np.float64) - 2451545.0
+    centuries = days / 36525.0
+    gmst = (280.46061837 + 360.98564736629 * days
+            + 0.000387933 * centuries ** 2 - centuries ** 3 / 38710000.0)
+    return np.mod(gmst, 360.0)
+
+
+def lon_lat_alt_to_xyz(longitude, latitude, altitude):
+    """
+    Cartesian Earth-fixed coordinates on a spherical Earth
+    :param longitude: Longitudes in degrees
+    :param latitude: Latitudes in degrees
+    :param altitude: Altitudes in km
+    :return: Array of shape longitude.shape + (3,) in km
+    """
+    radius = EARTH_MEAN_RADIUS_KM + np.asarray(altitude, dtype=np.float64)
+    lon_rad = np.radians(longitude)
+    lat_rad = np.radians(latitude)
+    return np.stack([radius * np.cos(lat_rad) * np.cos(lon_rad),
+                     radius * np.cos(lat_rad) * np.sin(lon_rad),
+                     radius * np.sin(lat_rad)], axis=-1)
+
+
+def walker_elements(number_of_orbit, number_of_satellite_per_orbit, phase_shift=True):
+    """
+    RAAN and mean anomaly of every satellite of a Walker shell, in the same order as get_satellites_list
+    :param number_of_orbit: Number of orbital planes
+    :param number_of_satellite_per_orbit: Number of satellites per plane
+    :param phase_shift: Shift odd planes by half a slot
+    :return: (raan, mean_anomaly, orbit, orbit_satellite_id) arrays of length number_of_orbit * number_of_satellite_per_orbit
+    """
+    orbit = np.repeat(np.arange(number_of_orbit), number_of_satellite_per_orbit)
+    orbit_satellite_id = np.tile(np.arange(number_of_satellite_per_orbit), number_of_orbit)
+    raan = orbit * 360 / number_of_orbit
+    orbit_wise_shift = np.zeros(orbit.shape)
+    if phase_shift:
+        orbit_wise_shift[orbit % 2 == 1] = 360 / (number_of_satellite_per_orbit * 2)
+    mean_anomaly = orbit_wise_shift + orbit_satellite_id * 360 / number_of_satellite_per_orbit
+    return raan, mean_anomaly, orbit, orbit_satellite_id
+
+
+def sgp4_positions(mean_motion, inclination, raan, mean_anomaly, minutes_since_epoch,
+                   eccentricity=0.0000001, arg_perigee=0.0, pairwise=False):
+    """
+    Drag-free SGP4 for a batch of satellites sharing mean motion and inclination
+    :param mean_motion: Mean motion (revolutions per day)
+    :param inclination: Inclination in degrees
+    :param raan: RAAN of each satellite in degrees, shape (N,)
+    :param mean_anomaly: Mean anomaly of each satellite at epoch in degrees, shape (N,)
+    :param minutes_since_epoch: Propagation times in minutes, shape (T,)
+    :param eccentricity: Orbital eccentricity
+    :param arg_perigee: Argument of perigee in degrees
+    :param pairwise: Propagate satellite k to time k only; raan, mean_anomaly and minutes_since_epoch then share one shape
+    :return: (x, y, z) TEME coordinates in km, each of shape (T, N), or the common shape when pairwise
+    """
+    xno = mean_motion * 2 * np.pi / MINUTES_PER_DAY
+    xincl = np.radians(inclination)
+    cosio = np.cos(xincl)
+    sinio = np.sin(xincl)
+    theta2 = cosio * cosio
+    theta4 = theta2 * theta2
+    x3thm1 = 3 * theta2 - 1
+    x1mth2 = 1 - theta2
+    x7thm1 = 7 * theta2 - 1
+    betao2 = 1 - eccentricity * eccentricity
+    betao = np.sqrt(betao2)
+
+    # Recover the original (un-Kozai) mean motion and semi-major axis
+    a1 = (XKE / xno) ** (2.0 / 3.0)
+    del1 = 1.5 * CK2 * x3thm1 / (a1 * a1 * betao * betao2)
+    ao = a1 * (1 - del1 * (1.0 / 3.0 + del1 * (1 + 134.0 / 81.0 * del1)))
+    delo = 1.5 * CK2 * x3thm1 / (ao * ao * betao * betao2)
+    xnodp = xno / (1 + delo)
+    aodp = ao / (1 - delo)
+
+    # Secular rates due to J2 and J4
+    pinvsq = 1 / (aodp * aodp * betao2 * betao2)
+    temp1 = 3 * CK2 * pinvsq * xnodp
+    temp2 = temp1 * CK2 * pinvsq
+    temp3 = 1.25 * CK4 * pinvsq * pinvsq * xnodp
+    xmdot = xnodp + 0.5 * temp1 * betao * x3thm1 + 0.0625 * temp2 * betao * (13 - 78 * theta2 + 137 * theta4)
+    omgdot = (-0.5 * temp1 * (1 - 5 * theta2) + 0.0625 * temp2 * (7 - 114 * theta2 + 395 * theta4)
+              + temp3 * (3 - 36 * theta2 + 49 * theta4))
+    xnodot = -temp1 * cosio + (0.5 * temp2 * (4 - 19 * theta2) + 2 * temp3 * (3 - 7 * theta2)) * cosio
+    xlcof = 0.125 * A3OVK2 * sinio * (3 + 5 * cosio) / (1 + cosio)
+    aycof = 0.25 * A3OVK2 * sinio
+
+    tsince = np.asarray(minutes_since_epoch, dtype=np.float64)
+    mean_anomaly = np.radians(np.asarray(mean_anomaly, dtype=np.float64))
+    raan = np.radians(np.asarray(raan, dtype=np.float64))
+    if not pairwise:
+        tsince = tsince[:, None]
+        mean_anomaly = mean_anomaly[None, :]
+        raan = raan[None, :]
+    xmp = mean_anomaly + xmdot * tsince
+    omega = np.radians(arg_perigee) + omgdot * tsince
+    xnode = raan + xnodot * tsince
+
+    # Long period periodics (J3)
+    temp = 1 / (aodp * betao2)
+    axn = eccentricity * np.cos(omega)
+    ayn = eccentricity * np.sin(omega) + temp * aycof
+    xlt = xmp + omega + xnode + temp * xlcof * axn
+
+    # Solve Kepler's equation for the eccentric longitude
+    capu = np.fmod(xlt - xnode, 2 * np.pi)
+    epw = capu
+    for _ in range(10):
+        sinepw = np.sin(epw)
+        cosepw = np.cos(epw)
+        epw = (capu - ayn * cosepw + axn * sinepw - epw) / (1 - axn * cosepw - ayn * sinepw) + epw
+    sinepw = np.sin(epw)
+    cosepw = np.cos(epw)
+
+    # Short period preliminary quantities
+    ecose = axn * cosepw + ayn * sinepw
+    esine = axn * sinepw - ayn * cosepw
+    elsq = axn * axn + ayn * ayn
+    pl = aodp * (1 - elsq)
+    r = aodp * (1 - ecose)
+    betal = np.sqrt(1 - elsq)
+    temp3 = 1 / (1 + betal)
+    cosu = aodp / r * (cosepw - axn + ayn * esine * temp3)
+    sinu = aodp / r * (sinepw - ayn - axn * esine * temp3)
+    u = np.arctan2(sinu, cosu)
+    sin2u = 2 * sinu * cosu
+    cos2u = 2 * cosu * cosu - 1
+    temp1 = CK2 / pl
+    temp2 = temp1 / pl
+
+    # Short period periodics
+    rk = r * (1 - 1.5 * temp2 * betal * x3thm1) + 0.5 * temp1 * x1mth2 * cos2u
+    uk = u - 0.25 * temp2 * x7thm1 * sin2u
+    xnodek = xnode + 1.5 * temp2 * cosio * sin2u
+    xinck = xincl + 1.5 * temp2 * cosio * sinio * cos2u
+
+    sinuk = np.sin(uk)
+    cosuk = np.cos(uk)
+    sinik = np.sin(xinck)
+    cosik = np.cos(xinck)
+    sinnok = np.sin(xnodek)
+    cosnok = np.cos(xnodek)
+    rk = rk * EARTH_RADIUS_KM
+    x = rk * (cosnok * cosuk - sinnok * cosik * sinuk)
+    y = rk * (sinnok * cosuk + cosnok * cosik * sinuk)
+    z = rk * sinik * sinuk
+    return x, y, z
+
+
+def time_grid(start_time, time_step, num_time_steps):
+    """
+    Julian dates of a regular time grid
+    :param start_time: datetime of the first time step
+    :param time_step: datetime.timedelta between time steps
+    :param num_time_steps: Number of time steps
+    :return: Julian dates, shape (num_time_steps,)
+    """
+    return julian_date(start_time) + np.arange(num_time_steps) * (time_step.total_seconds() / 86400.0)
+
+
+def propagate_shell(mean_motion, altitude, number_of_orbit, number_of_satellite_per_orbit, inclination,
+                    start_time, time_step, num_time_steps,
+                    phase_shift=True, eccentricity=0.0000001, arg_perigee=0.0,
+                    epoch="1949-10-01 00:00:00", chunk_size=256, orbits=None):
+    """
+    Sub-satellite points of every satellite of a shell over a whole time grid in one call.
+    This is the batched equivalent of calling get_satellites_list and then compute() on every
+    satellite at every time step; ephem remains the reference implementation.
+    :param mean_motion: Mean motion (satellite orbits per day)
+    :param altitude: Shell altitude in km
+    :param number_of_orbit: Number of orbital planes
+    :param number_of_satellite_per_orbit: Number of satellites per plane
+    :param inclination: Inclination in degrees
+    :param start_time: datetime of the first time step
+    :param time_step: datetime.timedelta between time steps
+    :param num_time_steps: Number of time steps
+    :param chunk_size: Number of time steps propagated at once (bounds temporary memory)
+    :param orbits: Optional subset of orbit indexes to propagate (RAAN spacing still follows number_of_orbit)
+    :return: (longitude, latitude, altitude) arrays of shape (num_time_steps, number of satellites);
+             longitude and latitude in degrees, altitude is the nominal shell altitude in km as written by the generator
+    """
+    raan, mean_anomaly, orbit, _ = walker_elements(number_of_orbit, number_of_satellite_per_orbit, phase_shift)
+    if orbits is not None:
+        selected = np.isin(orbit, orbits)
+        raan = raan[selected]
+        mean_anomaly = mean_anomaly[selected]
+    julian_dates = time_grid(start_time, time_step, num_time_steps)
+    minutes_since_epoch = (julian_dates - julian_date(epoch)) * MINUTES_PER_DAY
+
+    number_of_satellites = len(raan)
+    longitude = np.empty((num_time_steps, number_of_satellites))
+    latitude = np.empty((num_time_steps, number_of_satellites))
+    for begin in range(0, num_time_steps, chunk_size):
+        end = min(begin + chunk_size, num_time_steps)
+        x, y, z = sgp4_positions(mean_motion, inclination, raan, mean_anomaly, minutes_since_epoch[begin:end],
+                                 eccentricity, arg_perigee)
+        sidereal_angle = greenwich_sidereal_angle(julian_dates[begin:end])[:, None]
+        longitude[begin:end] = np.mod(np.degrees(np.arctan2(y, x)) - sidereal_angle + 180.0, 360.0) - 180.0
+        latitude[begin:end] = np.degrees(np.arctan2(z, np.hypot(x, y)))
+    return longitude, latitude, np.full(longitude.shape, float(altitude))
+
+
+def propagate_at(mean_motion, number_of_orbit, number_of_satellite_per_orbit, inclination, satellite_index,
+                 julian_dates, phase_shift=True, eccentricity=0.0000001, arg_perigee=0.0,
+                 epoch="1949-10-01 00:00:00"):
+    """
+    Sub-satellite points of individual satellites at individual times (element-wise, no time grid)
+    :param satellite_index: Index of each satellite in the shell (orbit * number_of_satellite_per_orbit + slot)
+    :param julian_dates: Julian date of each evaluation, same shape as satellite_index
+    :return: (longitude, latitude) in degrees, same shape as satellite_index
+    """
+    raan, mean_anomaly, _, _ = walker_elements(number_of_orbit, number_of_satellite_per_orbit, phase_shift)
+    satellite_index = np.asarray(satellite_index)
+    julian_dates = np.asarray(julian_dates, dtype=np.float64)
+    minutes_since_epoch = (julian_dates - julian_date(epoch)) * MINUTES_PER_DAY
+    x, y, z = sgp4_positions(mean_motion, inclination, raan[satellite_index], mean_anomaly[satellite_index],
+                             minutes_since_epoch, eccentricity, arg_perigee, pairwise=True)
+    longitude = np.mod(np.degrees(np.arctan2(y, x)) - greenwich_sidereal_angle(julian_dates) + 180.0, 360.0) - 180.0
+    latitude = np.degrees(np.arctan2(z, np.hypot(x, y)))
+    return longitude, latitude
+
+
+def shell_phase_shift(phase_shift, shell_index):
+    """phase_shift is either one value for every shell or one value per shell"""
+    if isinstance(phase_shift, (list, tuple, np.ndarray)):
+        return bool(phase_shift[shell_index])
+    return bool(phase_shift)
+
+
+def shell_sat_ids(shell):
+    """
+    Global satellite IDs of a shell: base_id + orbit * number_of_satellite_per_orbit + slot
+    :param shell: [mean_motion, altitude, number_of_orbit, number_of_satellite_per_orbit, inclination, base_id(, remaining_orbits)]
+    :return: IDs in the column order of propagate_shell
+    """
+    orbits = shell[6] if len(shell) > 6 else range(shell[2])
+    return (shell[5] + np.asarray(orbits, dtype=np.int64)[:, None] * shell[3] + np.arange(shell[3])).ravel()
+
+
+def propagate_constellation(constellation_information, start_time, time_step, num_time_steps, phase_shift=True):
+    """
+    Propagate all shells of a constellation and concatenate them along the satellite axis
+    :param constellation_information: List of shells [mean_motion, altitude, number_of_orbit, number_of_satellite_per_orbit, inclination, base_id]
+                                      with an optional 7th entry listing the orbits kept by filter_orbits_to_ensure_coverage
+    :param phase_shift: One value for all shells or one per shell (ConstellationSpec.phase_shifts())
+    :return: (longitude, latitude, altitude, shell_index) where shell_index is the 1-based shell of each column
+    """
+    longitudes, latitudes, altitudes, shell_indexes = [], [], [], []
+    for shell_index, shell in enumerate(constellation_information):
+        longitude, latitude, altitude = propagate_shell(shell[0], shell[1], shell[2], shell[3], shell[4],
+                                                        start_time, time_step, num_time_steps,
+                                                        shell_phase_shift(phase_shift, shell_index),
+                                                        orbits=shell[6] if len(shell) > 6 else None)
+        longitudes.append(longitude)
+        latitudes.append(latitude)
+        altitudes.append(altitude)
+        shell_indexes.append(np.full(longitude.shape[1], shell_index + 1, dtype=np.int32))
+    return (np.concatenate(longitudes, axis=1), np.concatenate(latitudes, axis=1),
+            np.concatenate(altitudes, axis=1), np.concatenate(shell_indexes))
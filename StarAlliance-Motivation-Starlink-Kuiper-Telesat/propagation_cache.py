@@ -0,0 +1,95 @@
+
+import hashlib
+import json
+import os
+import position_store
+
+
+# Content-addressed cache of propagated constellations.
+# Every entry is a position store named after the hash of everything that determines the positions,
+# so runs whose shells and time grid did not change reuse the propagated arrays as zero-copy memory maps.
+CACHE_DIR = "PropagationCache"
+MAX_CACHE_BYTES = 4 * 1024 ** 3
+
+# Bump when the propagation model or the entry layout changes, so stale entries are never reused
+MODEL_VERSION = "sgp4-2"
+
+
+def cache_key(constellation_spec, start_time, time_step, num_time_steps):
+    """
+    Stable hash of the parsed shells plus the epoch and the time grid
+    :param constellation_spec: constellation_config.ConstellationSpec, pruned shells keep their remaining orbits
+    :return: Hexadecimal SHA-256 digest
+    """
+    content = {
+        "model": MODEL_VERSION,
+        "constellation": constellation_spec.stable_hash(),
+        "start_time": start_time.isoformat(),
+        "time_step_seconds": time_step.total_seconds(),
+        "num_time_steps": int(num_time_steps),
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def constellation_metadata(constellation_spec):
+    """Store metadata describing the propagated shells, so analysis scripts can re-propagate individual satellites"""
+    return {"constellation_information": constellation_spec.constellation_information(),
+            "phase_shift": constellation_spec.phase_shifts()}
+
+
+def cached_propagate_constellation(constellation_spec, start_time, time_step, num_time_steps,
+                                   cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    ConstellationSpec.propagate backed by the on-disk cache
+    :param constellation_spec: constellation_config.ConstellationSpec
+    :param cache_dir: Cache directory
+    :param max_bytes: Least recently used entries are evicted once the cache grows past this size
+    :return: Read-only PositionStore with longitude/latitude/altitude (T, N), sat_id and shell (N,)
+    """
+    path = os.path.join(cache_dir, cache_key(constellation_spec, start_time, time_step, num_time_steps) + ".bin")
+    if os.path.exists(path):
+        # Mark as recently used
+        os.utime(path)
+        return position_store.open_position_store(path)
+
+    longitude, latitude, altitude, shell = constellation_spec.propagate(start_time, time_step, num_time_steps)
+
+    # Write under a temporary name so an interrupted run never leaves a truncated entry behind
+    temporary_path = path + ".tmp" + str(os.getpid())
+    store = position_store.create_position_store(temporary_path, num_time_steps, constellation_spec.sat_ids(), shell,
+                                                 start_time, time_step, constellation_metadata(constellation_spec))
+    store.longitude[:] = longitude
+    store.latitude[:] = latitude
+    store.altitude[:] = altitude
+    store.flush()
+    del store
+    os.replace(temporary_path, path)
+
+    evict(cache_dir, max_bytes, keep=path)
+    return position_store.open_position_store(path)
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, keep=None):
+    """
+    Delete least recently used entries until the cache holds at most max_bytes
+    :param keep: Entry that is never deleted (the one just written)
+    :return: Number of deleted entries
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".bin"):
+            path = os.path.join(cache_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    deleted = 0
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        os.remove(path)
+        total -= size
+        deleted += 1
+    return deleted
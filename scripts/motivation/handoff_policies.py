@@ -0,0 +1,133 @@
+import numpy as np
+import visibility
+
+
+class VisibilityTensor:
+    """
+    Geometry shared by all handoff policies, computed once:
+    the visible satellites of every (user, timeslot) with their elevation and remaining visibility
+    """
+
+    __slots__ = ("columns", "elevation", "remaining")
+
+    def __init__(self, columns, elevation):
+        """
+        :param columns: (N_users, T, K) int32 visible satellite columns in increasing order, padded with -1
+        :param elevation: (N_users, T, K) float32 elevations in degrees, padded with NaN
+        """
+        self.columns = columns
+        self.elevation = elevation
+        self.remaining = remaining_visibility(columns)
+
+    @classmethod
+    def compute(cls, users_xyz, satellites_xyz, min_elevation_angle, satellite_altitude=None):
+        return cls(*visibility.visible_satellites(users_xyz, satellites_xyz, min_elevation_angle,
+                                                  satellite_altitude=satellite_altitude))
+
+    @property
+    def shape(self):
+        return self.columns.shape[:2]
+
+
+def remaining_visibility(columns):
+    """
+    Number of consecutive timeslots, starting at the current one, during which each visible satellite stays visible
+    :param columns: (N_users, T, K) visible satellite columns, padded with -1
+    :return: (N_users, T, K) int32, 0 on padding
+    """
+    num_users, num_time_steps, _ = columns.shape
+    num_satellites = int(columns.max()) + 1 if columns.size else 0
+    remaining = np.zeros(columns.shape, dtype=np.int32)
+    # run[u, s]: remaining visibility of satellite s from the next timeslot on (0 if not visible then)
+    run = np.zeros((num_users, num_satellites + 1), dtype=np.int32)
+    users = np.arange(num_users)[:, None]
+    next_columns = None
+    for time_step_index in range(num_time_steps - 1, -1, -1):
+        current_columns = columns[:, time_step_index]
+        # Padding maps to the extra last column, which always stays 0
+        lookup = np.where(current_columns >= 0, current_columns, num_satellites)
+        current = np.where(current_columns >= 0, run[users, lookup] + 1, 0)
+        if next_columns is not None:
+            run[users, next_columns] = 0
+        run[users, lookup] = current
+        run[:, num_satellites] = 0
+        remaining[:, time_step_index] = current
+        next_columns = lookup
+    return remaining
+
+
+def chosen_column(tensor, time_step_index, score):
+    """
+    Column with the highest score among the visible satellites of every user at one timeslot, -1 if none is visible
+    """
+    columns = tensor.columns[:, time_step_index]
+    score = np.where(columns >= 0, score, -np.inf)
+    slot = np.argmax(score, axis=1)
+    chosen = columns[np.arange(len(columns)), slot] if columns.shape[1] else np.full(len(columns), -1)
+    return chosen.astype(np.int32)
+
+
+def max_elevation(tensor):
+    """Greedy: the highest satellite at every timeslot (the policy of process_user)"""
+    elevation = np.where(tensor.columns >= 0, tensor.elevation, -np.inf)
+    if tensor.columns.shape[2] == 0:
+        return np.full(tensor.shape, -1, dtype=np.int32)
+    slot = np.argmax(elevation, axis=2)
+    return np.take_along_axis(tensor.columns, slot[:, :, None], axis=2)[:, :, 0].astype(np.int32)
+
+
+def sticky(tensor, score_name="elevation"):
+    """
+    Keep the serving satellite while it stays visible; when it is lost, take the best visible satellite by score
+    :param score_name: "elevation" (highest) or "remaining" (longest remaining visibility)
+    """
+    num_users, num_time_steps = tensor.shape
+    serving = np.empty((num_users, num_time_steps), dtype=np.int32)
+    current = np.full(num_users, -1, dtype=np.int32)
+    for time_step_index in range(num_time_steps):
+        columns = tensor.columns[:, time_step_index]
+        still_visible = (current >= 0) & (columns == current[:, None]).any(axis=1)
+        if score_name == "remaining":
+            # Ties on remaining time go to the higher satellite (elevations are below 100 degrees)
+            score = (tensor.remaining[:, time_step_index] * 100.0
+                     + np.nan_to_num(tensor.elevation[:, time_step_index], nan=0.0))
+        else:
+            score = tensor.elevation[:, time_step_index]
+        current = np.where(still_visible, current, chosen_column(tensor, time_step_index, score))
+        serving[:, time_step_index] = current
+    return serving
+
+
+def sticky_until_lost(tensor):
+    """Stay on the serving satellite until it drops below the minimum elevation, then take the highest one"""
+    return sticky(tensor, "elevation")
+
+
+def longest_remaining_visibility(tensor):
+    """Stay on the serving satellite until it is lost, then take the one that stays visible the longest"""
+    return sticky(tensor, "remaining")
+
+
+# Policy name -> function(VisibilityTensor) returning (N_users, T) int32 serving columns (-1 when none is visible)
+HANDOFF_POLICIES = {
+    "max_elevation": max_elevation,
+    "sticky_until_lost": sticky_until_lost,
+    "longest_remaining_visibility": longest_remaining_visibility,
+}
+
+
+def run_policies(tensor, policies=None):
+    """
+    Serving satellite of every user at every timeslot under several policies, all from the same tensor
+    :param policies: Policy names (keys of HANDOFF_POLICIES) or functions, all registered policies by default
+    :return: {name: (N_users, T) int32 serving columns}
+    """
+    if policies is None:
+        policies = list(HANDOFF_POLICIES)
+    results = {}
+    for policy in policies:
+        if callable(policy):
+            results[policy.__name__] = policy(tensor)
+        else:
+            results[policy] = HANDOFF_POLICIES[policy](tensor)
+    return results
@@ -0,0 +1,143 @@
+from multiprocessing import Pool, cpu_count, shared_memory
+import numpy as np
+import streaming
+import visibility
+
+# Worker-side view of the satellite positions published by the parent
+_shared_memory = None
+_satellites_xyz = None
+
+
+def init_worker(shared_memory_name, shape, dtype):
+    # Attach once per worker; the positions are never pickled or copied
+    global _shared_memory, _satellites_xyz
+    _shared_memory = shared_memory.SharedMemory(name=shared_memory_name)
+    _satellites_xyz = np.ndarray(shape, dtype=dtype, buffer=_shared_memory.buf)
+
+
+def best_satellite_chunk(args):
+    begin, end, users_xyz, min_elevation_angle, satellite_altitude = args
+    best, elevation = visibility.best_satellite_by_timeslot(users_xyz, _satellites_xyz[begin:end],
+                                                            min_elevation_angle, satellite_altitude=satellite_altitude)
+    return begin, best, elevation
+
+
+def population_chunk(args):
+    begin, end, users_xyz, min_elevation_angle, satellite_altitude, users_per_query = args
+    return streaming.population_statistics(users_xyz, [(begin, _satellites_xyz[begin:end])], min_elevation_angle,
+                                           satellite_altitude, users_per_query)
+
+
+class SharedPositions:
+    """
+    Satellite positions published once in shared memory, with a process pool attached to them, for a whole run.
+    Every call only sends users to the workers; neither the positions nor the workers are set up again.
+    Work is split into blocks of timeslots, each covering all users of the call, so the per-timeslot KD-tree
+    of the candidate search is built once per timeslot and shared by every user.
+
+        with SharedPositions(satellites.xyz(), processes) as pool:
+            best, elevation = pool.best_satellite_by_timeslot(users_xyz, min_elevation_angle)
+    """
+
+    def __init__(self, satellites_xyz, processes=None):
+        """
+        :param satellites_xyz: (T, N_sats, 3) satellite positions
+        :param processes: Pool size, defaults to the number of CPU cores
+        """
+        self.satellites_xyz = np.asarray(satellites_xyz)
+        self.processes = processes or cpu_count()
+        self._shared_memory = None
+        self._pool = None
+
+    def __enter__(self):
+        self._shared_memory = shared_memory.SharedMemory(create=True, size=max(self.satellites_xyz.nbytes, 1))
+        try:
+            shared = np.ndarray(self.satellites_xyz.shape, dtype=self.satellites_xyz.dtype,
+                                buffer=self._shared_memory.buf)
+            shared[:] = self.satellites_xyz
+            del shared
+            self._pool = Pool(self.processes, initializer=init_worker,
+                              initargs=(self._shared_memory.name, self.satellites_xyz.shape,
+                                        self.satellites_xyz.dtype.str))
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        if self._shared_memory is not None:
+            self._shared_memory.close()
+            self._shared_memory.unlink()
+            self._shared_memory = None
+
+    def best_satellite_by_timeslot(self, users_xyz, min_elevation_angle, satellite_altitude=None,
+                                   time_steps_per_chunk=None):
+        """
+        visibility.best_satellite_by_timeslot over the published positions, one task per block of timeslots
+        :param users_xyz: (N_users, 3) user positions
+        :param min_elevation_angle: Minimum elevation angle in degrees
+        :param satellite_altitude: Optional (N_sats,) altitudes in km, enables the KD-tree candidate search
+        :param time_steps_per_chunk: Number of timeslots per task, defaults to four tasks per worker
+        :return: Same as visibility.best_satellite_by_timeslot
+        """
+        if self._pool is None:
+            raise RuntimeError("SharedPositions is used outside of its with block")
+        users_xyz = np.asarray(users_xyz, dtype=np.float64)
+        num_users = len(users_xyz)
+        num_time_steps = len(self.satellites_xyz)
+        best = np.empty((num_users, num_time_steps), dtype=np.int32)
+        elevation = np.empty((num_users, num_time_steps), dtype=np.float32)
+        if time_steps_per_chunk is None:
+            time_steps_per_chunk = max(1, -(-num_time_steps // (4 * self.processes)))
+        tasks = [(begin, min(begin + time_steps_per_chunk, num_time_steps), users_xyz, min_elevation_angle,
+                  satellite_altitude) for begin in range(0, num_time_steps, time_steps_per_chunk)]
+        for begin, chunk_best, chunk_elevation in self._pool.imap_unordered(best_satellite_chunk, tasks):
+            best[:, begin:begin + chunk_best.shape[1]] = chunk_best
+            elevation[:, begin:begin + chunk_elevation.shape[1]] = chunk_elevation
+        return best, elevation
+
+    def population_statistics(self, users_xyz, min_elevation_angle, satellite_altitude, users_per_query=65536,
+                              time_steps_per_chunk=None):
+        """
+        streaming.population_statistics over the published positions: every worker reduces a block of timeslots
+        for all users, the blocks are appended in timeslot order
+        :param time_steps_per_chunk: Number of timeslots per task, defaults to one task per worker
+        :return: streaming.PopulationStatistics
+        """
+        if self._pool is None:
+            raise RuntimeError("SharedPositions is used outside of its with block")
+        users_xyz = np.asarray(users_xyz, dtype=np.float64)
+        num_time_steps = len(self.satellites_xyz)
+        if time_steps_per_chunk is None:
+            time_steps_per_chunk = max(1, -(-num_time_steps // self.processes))
+        tasks = [(begin, min(begin + time_steps_per_chunk, num_time_steps), users_xyz, min_elevation_angle,
+                  satellite_altitude, users_per_query) for begin in range(0, num_time_steps, time_steps_per_chunk)]
+        statistics = None
+        for block in self._pool.imap(population_chunk, tasks):
+            statistics = block if statistics is None else statistics.append(block)
+        return statistics
+
+
+def best_satellite_by_timeslot_parallel(users_xyz, satellites_xyz, min_elevation_angle,
+                                        processes=None, time_steps_per_chunk=None, satellite_altitude=None):
+    """
+    One-off visibility.best_satellite_by_timeslot on a process pool; use SharedPositions directly to keep
+    the pool and the shared positions for several calls
+    :param users_xyz: (N_users, 3) user positions
+    :param satellites_xyz: (T, N_sats, 3) satellite positions
+    :param min_elevation_angle: Minimum elevation angle in degrees
+    :param processes: Pool size, defaults to the number of CPU cores
+    :param time_steps_per_chunk: Number of timeslots per task
+    :param satellite_altitude: Optional (N_sats,) altitudes in km, enables the KD-tree candidate search
+    :return: Same as visibility.best_satellite_by_timeslot
+    """
+    with SharedPositions(satellites_xyz, processes) as pool:
+        return pool.best_satellite_by_timeslot(users_xyz, min_elevation_angle, satellite_altitude,
+                                               time_steps_per_chunk)
@@ -0,0 +1,245 @@
+import numpy as np
+import position_store
+import propagation
+import visibility
+
+# Shortest pass the default screening step of pass_windows is guaranteed to find, in seconds
+MIN_PASS_DURATION = 60.0
+
+# Handoff policies of simulate_handoffs; both stay on the serving satellite until it sets and differ only in
+# the next choice, as the policies of the same name in handoff_policies
+EVENT_POLICIES = ("sticky_until_lost", "longest_remaining_visibility")
+
+
+class PassPredictor:
+    """
+    Elevation of individual satellite columns at arbitrary times, evaluated with the same propagator
+    (and the same nominal altitude) that generated the position store
+    """
+
+    __slots__ = ("constellation_information", "start_julian_date", "phase_shift", "column_shell", "column_index")
+
+    def __init__(self, constellation_information, start_time, phase_shift=True):
+        """
+        :param constellation_information: Shells in the column order of the position store (with kept orbits, if pruned)
+        :param start_time: datetime of timeslot 0; times are given in seconds since start_time
+        """
+        self.constellation_information = constellation_information
+        self.start_julian_date = propagation.julian_date(start_time)
+        self.phase_shift = phase_shift
+        # Shell and index within the shell of every column
+        column_shell, column_index = [], []
+        for shell_index, shell in enumerate(constellation_information):
+            index = propagation.shell_sat_ids(shell) - shell[5]
+            column_shell.append(np.full(len(index), shell_index, dtype=np.int32))
+            column_index.append(index)
+        self.column_shell = np.concatenate(column_shell)
+        self.column_index = np.concatenate(column_index)
+
+    @classmethod
+    def from_store(cls, store_path=position_store.POSITION_STORE_FILE):
+        """Predictor for the shells recorded in the metadata of a position store"""
+        store = position_store.open_position_store(store_path)
+        if not store.metadata or "constellation_information" not in store.metadata:
+            raise ValueError(f"{store_path} does not record its shells, regenerate it to use pass windows")
+        return cls(store.metadata["constellation_information"], store.start_time, store.metadata["phase_shift"])
+
+    def sin_elevation(self, user_xyz, columns, seconds):
+        """
+        :param user_xyz: (3,) user position in km, or one position per evaluation (columns.shape + (3,))
+        :param columns: Satellite columns
+        :param seconds: Time of each evaluation in seconds since start_time, same shape as columns
+        :return: Sine of the elevation of columns[k] at seconds[k]
+        """
+        columns = np.asarray(columns)
+        seconds = np.broadcast_to(np.asarray(seconds, dtype=np.float64), columns.shape)
+        user_xyz = np.broadcast_to(np.asarray(user_xyz, dtype=np.float64), columns.shape + (3,))
+        result = np.empty(columns.shape)
+        shells = self.column_shell[columns]
+        for shell_index, shell in enumerate(self.constellation_information):
+            selected = shells == shell_index
+            if not selected.any():
+                continue
+            longitude, latitude = propagation.propagate_at(
+                shell[0], shell[2], shell[3], shell[4], self.column_index[columns[selected]],
+                self.start_julian_date + seconds[selected] / 86400.0,
+                propagation.shell_phase_shift(self.phase_shift, shell_index))
+            satellite_xyz = propagation.lon_lat_alt_to_xyz(longitude, latitude, float(shell[1]))
+            selected_user = user_xyz[selected]
+            relative = satellite_xyz - selected_user
+            result[selected] = (np.einsum('kj,kj->k', relative, selected_user)
+                                / (np.linalg.norm(selected_user, axis=-1) * np.linalg.norm(relative, axis=-1)))
+        return result
+
+
+def coarse_step(time_step_seconds, min_pass_duration=MIN_PASS_DURATION):
+    """
+    Screening step (in timeslots) that cannot step over a pass lasting at least min_pass_duration:
+    such a pass always contains one screened timeslot
+    """
+    return max(1, int(min_pass_duration // time_step_seconds))
+
+
+def pass_windows_batch(users_xyz, satellites, predictor, min_elevation_angle, coarse_every=None,
+                       min_pass_duration=MIN_PASS_DURATION, chunk_size=None, iterations=20):
+    """
+    Rise and set times of every pass of every satellite above min_elevation_angle for a batch of users.
+    Visibility of all users is screened together on every coarse_every-th timeslot of the position store,
+    then only the bracketed rises/sets are refined by bisection on the propagated orbit.
+    :param users_xyz: (N_users, 3) user positions in km
+    :param satellites: position_arrays.SatellitePositions (coarse grid)
+    :param predictor: PassPredictor for the same columns
+    :param coarse_every: Screen every coarse_every-th timeslot only; defaults to coarse_step(min_pass_duration)
+    :param min_pass_duration: Shortest pass, in seconds, that the default screening step is sure to find
+    :param chunk_size: Number of screened timeslots evaluated at once, defaults to about 16M elevations
+    :param iterations: Bisection steps; the final bracket is coarse step / 2 ** iterations
+    :return: List with one (column, rise, set) per user, arrays sorted by rise, times in seconds since the first
+             timeslot; passes in progress at the ends of the run are clipped to the run
+    """
+    users_xyz = np.asarray(users_xyz, dtype=np.float64).reshape(-1, 3)
+    num_users = len(users_xyz)
+    time_step = satellites.time_step.total_seconds()
+    if coarse_every is None:
+        coarse_every = coarse_step(time_step, min_pass_duration)
+    if chunk_size is None:
+        chunk_size = max(2, (1 << 24) // max(satellites.num_satellites * num_users, 1))
+    samples = np.arange(0, satellites.num_time_steps, coarse_every)
+    if samples[-1] != satellites.num_time_steps - 1:
+        samples = np.append(samples, satellites.num_time_steps - 1)
+    end_time = samples[-1] * time_step
+    threshold = np.sin(np.radians(min_elevation_angle))
+
+    # Coarse screening: sign changes of (sin elevation - threshold) between consecutive samples
+    transition_sample, transition_column, transition_user, transition_rising = [], [], [], []
+    first_visible = last_visible = None
+    for begin in range(0, len(samples), chunk_size):
+        # One sample of overlap so transitions across chunk borders are seen
+        chunk = samples[max(begin - 1, 0):begin + chunk_size]
+        chunk_xyz = propagation.lon_lat_alt_to_xyz(satellites.longitude[chunk], satellites.latitude[chunk],
+                                                   satellites.altitude[chunk])
+        above = visibility.sin_elevation(users_xyz, chunk_xyz) >= threshold  # (t, N_sats, N_users)
+        if first_visible is None:
+            first_visible = above[0]
+        last_visible = above[-1]
+        changed_sample, changed_column, changed_user = np.nonzero(above[1:] != above[:-1])
+        transition_sample.append(max(begin - 1, 0) + changed_sample)
+        transition_column.append(changed_column)
+        transition_user.append(changed_user)
+        transition_rising.append(above[changed_sample + 1, changed_column, changed_user])
+    transition_sample = np.concatenate(transition_sample)
+    transition_column = np.concatenate(transition_column)
+    transition_user = np.concatenate(transition_user)
+    transition_rising = np.concatenate(transition_rising)
+
+    # Root refinement, all transitions of all users at once
+    low = samples[transition_sample] * time_step
+    high = samples[transition_sample + 1] * time_step
+    transition_user_xyz = users_xyz[transition_user]
+    for _ in range(iterations):
+        middle = (low + high) / 2
+        above = predictor.sin_elevation(transition_user_xyz, transition_column, middle) >= threshold
+        # Rising: the root is after middle while still below; setting: after middle while still above
+        after = above != transition_rising
+        low = np.where(after, middle, low)
+        high = np.where(after, high, middle)
+    transition_time = (low + high) / 2
+
+    # Passes already in progress at the start or still in progress at the end
+    start_columns, start_users = np.nonzero(first_visible)
+    end_columns, end_users = np.nonzero(last_visible)
+    user = np.concatenate([start_users, transition_user, end_users])
+    column = np.concatenate([start_columns, transition_column, end_columns])
+    time = np.concatenate([np.zeros(len(start_columns)), transition_time, np.full(len(end_columns), end_time)])
+    # Per user and column, events now alternate rise, set, rise, set...
+    order = np.lexsort((time, column, user))
+    user = user[order].reshape(-1, 2)[:, 0]
+    column = column[order].reshape(-1, 2)[:, 0]
+    rise_set = time[order].reshape(-1, 2)
+    keep = rise_set[:, 1] > rise_set[:, 0]
+    user, column, rise, set_ = user[keep], column[keep], rise_set[keep, 0], rise_set[keep, 1]
+    # Per user, sorted by rise
+    order = np.lexsort((rise, user))
+    user, column, rise, set_ = user[order], column[order].astype(np.int32), rise[order], set_[order]
+    bounds = np.searchsorted(user, np.arange(num_users + 1))
+    return [(column[bounds[index]:bounds[index + 1]], rise[bounds[index]:bounds[index + 1]],
+             set_[bounds[index]:bounds[index + 1]]) for index in range(num_users)]
+
+
+def pass_windows(user_xyz, satellites, predictor, min_elevation_angle, coarse_every=None,
+                 min_pass_duration=MIN_PASS_DURATION, chunk_size=None, iterations=20):
+    """
+    pass_windows_batch for one user
+    :param user_xyz: (3,) user position in km
+    :return: (column, rise, set) arrays sorted by rise
+    """
+    return pass_windows_batch(np.asarray(user_xyz)[None], satellites, predictor, min_elevation_angle, coarse_every,
+                              min_pass_duration, chunk_size, iterations)[0]
+
+
+def simulate_handoffs(windows, end_time, policy="sticky_until_lost", predictor=None, user_xyz=None):
+    """
+    Event-driven handoff: the user stays on its satellite until that satellite sets, then picks a new one among
+    the satellites visible at that instant; when none is visible, it waits for the next rise.
+    Cost is proportional to the number of passes, not to timeslots x satellites.
+    :param windows: (column, rise, set) from pass_windows
+    :param end_time: End of the run in seconds
+    :param policy: One of EVENT_POLICIES, named after the handoff_policies policy it reproduces:
+                   "sticky_until_lost" (highest elevation at handoff time, needs predictor and user_xyz) or
+                   "longest_remaining_visibility" (latest set time)
+    :return: (event_time, event_column): each change of serving satellite, -1 when none is visible.
+             The first event is at time 0, so len(event_time) is the switch count as counted in start.py
+    """
+    if policy not in EVENT_POLICIES:
+        raise ValueError(f"unknown handoff policy {policy}, expected one of {', '.join(EVENT_POLICIES)}")
+    column, rise, set_ = windows
+    num_windows = len(column)
+    event_time, event_column = [], []
+    started = []
+    next_window = 0
+    time = 0.0
+    while time < end_time or not event_time:
+        while next_window < num_windows and rise[next_window] <= time:
+            started.append(next_window)
+            next_window += 1
+        started = [window for window in started if set_[window] > time]
+        if started:
+            if policy == "longest_remaining_visibility" or len(started) == 1:
+                chosen = max(started, key=lambda window: set_[window])
+            else:
+                sin_elevation = predictor.sin_elevation(user_xyz, column[started], time)
+                chosen = started[int(np.argmax(sin_elevation))]
+            event_time.append(time)
+            event_column.append(int(column[chosen]))
+            time = set_[chosen]
+        else:
+            event_time.append(time)
+            event_column.append(-1)
+            if next_window >= num_windows:
+                break
+            time = rise[next_window]
+    return np.array(event_time), np.array(event_column, dtype=np.int32)
+
+
+def event_handoff_counts(users, satellites, predictor, min_elevation_angle, policy="sticky_until_lost",
+                         coarse_every=None, min_pass_duration=MIN_PASS_DURATION, users_per_batch=64):
+    """
+    Handoff count of every user from pass windows and handoff events. Every event policy keeps the serving
+    satellite until it sets, so the counts compare with handoff_policies.sticky_until_lost and
+    longest_remaining_visibility, not with the per-timeslot max_elevation of process_users
+    :param users: position_arrays.UserPositions
+    :param satellites: position_arrays.SatellitePositions
+    :param predictor: PassPredictor for the same columns
+    :param policy: One of EVENT_POLICIES, see simulate_handoffs
+    :param users_per_batch: Users whose pass windows are screened and refined together
+    :return: (N_users,) int64 switch counts
+    """
+    end_time = (satellites.num_time_steps - 1) * satellites.time_step.total_seconds()
+    counts = np.empty(len(users), dtype=np.int64)
+    for begin in range(0, len(users), users_per_batch):
+        batch_xyz = users.xyz[begin:begin + users_per_batch]
+        batch_windows = pass_windows_batch(batch_xyz, satellites, predictor, min_elevation_angle, coarse_every,
+                                           min_pass_duration)
+        for offset, (user_xyz, windows) in enumerate(zip(batch_xyz, batch_windows)):
+            event_time, _ = simulate_handoffs(windows, end_time, policy, predictor, user_xyz)
+            counts[begin + offset] = len(event_time)
+    return counts
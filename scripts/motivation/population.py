@@ -0,0 +1,179 @@
+import os
+import numpy as np
+import position_arrays
+import position_store
+
+# Region (continent) codes: index into a list of region names starting with REGION_NAMES, UNKNOWN_REGION for
+# oceans. User names of user_locations.txt start with the region name, e.g. "EU_Paris"; other name prefixes get
+# their own codes after REGION_NAMES (region_names_of).
+REGION_NAMES = ("AF", "AS", "AU", "EU", "NA", "SA")
+UNKNOWN_REGION = -1
+UNKNOWN_REGION_NAME = "Other"
+
+# Approximate continent bounding boxes (region, lon_min, lon_max, lat_min, lat_max) for synthetic users;
+# the first matching box wins, so the more specific boxes come first
+REGION_BOXES = [
+    ("EU", -25.0, 45.0, 35.0, 72.0),
+    ("AF", -20.0, 52.0, -35.0, 35.0),
+    ("AS", 45.0, 180.0, -10.0, 78.0),
+    ("AS", 25.0, 45.0, 12.0, 42.0),
+    ("AU", 110.0, 180.0, -50.0, -10.0),
+    ("NA", -170.0, -50.0, 15.0, 75.0),
+    ("NA", -120.0, -60.0, 7.0, 15.0),
+    ("SA", -82.0, -34.0, -56.0, 12.0),
+]
+
+# Per-user results, one row per user, in the columnar format of position_store
+MAGIC = b"SATUSR01"
+USER_RESULT_FILE = os.path.join("output", "user_results.bin")
+USER_RESULT_COLUMNS = [("longitude", "float32"), ("latitude", "float32"), ("region", "int16"),
+                       ("switch_count", "int32"), ("visible_fraction", "float32"), ("mean_delay_ms", "float32")]
+
+
+def region_names_of(names):
+    """REGION_NAMES followed by the other name prefixes (first two characters) present in names, sorted"""
+    return REGION_NAMES + tuple(np.unique([name[:2] for name in names if name[:2] not in REGION_NAMES]).tolist())
+
+
+def region_of_names(names, region_names=None):
+    """(U,) int16 region codes from the first two characters of user names, indexes into region_names
+    (region_names_of(names) by default); prefixes missing from region_names get UNKNOWN_REGION"""
+    if region_names is None:
+        region_names = region_names_of(names)
+    lookup = {name: code for code, name in enumerate(region_names)}
+    return np.array([lookup.get(name[:2], UNKNOWN_REGION) for name in names], dtype=np.int16)
+
+
+def user_regions(users):
+    """
+    Region codes of position_arrays.UserPositions
+    :return: (region, region_names): users.region with REGION_NAMES, or the codes of the user names
+    """
+    if users.region is not None:
+        return users.region, REGION_NAMES
+    region_names = region_names_of(users.name)
+    return region_of_names(users.name, region_names), region_names
+
+
+def region_name(code, region_names=REGION_NAMES):
+    """Name of a region code, UNKNOWN_REGION_NAME for UNKNOWN_REGION"""
+    return region_names[code] if code != UNKNOWN_REGION else UNKNOWN_REGION_NAME
+
+
+def region_of_location(longitude, latitude):
+    """(U,) int16 region codes from REGION_BOXES, UNKNOWN_REGION outside every box"""
+    longitude = np.asarray(longitude)
+    latitude = np.asarray(latitude)
+    region = np.full(longitude.shape, UNKNOWN_REGION, dtype=np.int16)
+    for name, lon_min, lon_max, lat_min, lat_max in REGION_BOXES:
+        inside = ((region == UNKNOWN_REGION) & (longitude >= lon_min) & (longitude < lon_max)
+                  & (latitude >= lat_min) & (latitude < lat_max))
+        region[inside] = REGION_NAMES.index(name)
+    return region
+
+
+def grid_users(spacing=1.0, max_latitude=70.0, inside_region_boxes=True):
+    """
+    Synthetic users at the centers of a regular longitude/latitude grid
+    :param spacing: Grid spacing in degrees (0.1 gives about 5 million users within +-70 degrees)
+    :param inside_region_boxes: Keep only users inside a REGION_BOXES box; the boxes are coarse and include
+                                large areas of ocean, this is not a land mask
+    :return: position_arrays.UserPositions without names, with region codes
+    """
+    longitude = np.arange(-180.0 + spacing / 2, 180.0, spacing)
+    latitude = np.arange(-max_latitude + spacing / 2, max_latitude, spacing)
+    longitude, latitude = (grid.ravel() for grid in np.meshgrid(longitude, latitude))
+    region = region_of_location(longitude, latitude)
+    if inside_region_boxes:
+        keep = region != UNKNOWN_REGION
+        longitude, latitude, region = longitude[keep], latitude[keep], region[keep]
+    return position_arrays.UserPositions(None, longitude, latitude, region)
+
+
+def population_users(population, num_users, lon_range=(-180.0, 180.0), lat_range=(-90.0, 90.0), seed=0):
+    """
+    Synthetic users sampled from a population raster: cells drawn in proportion to their population,
+    positions uniform within the cell
+    :param population: (n_lat, n_lon) population counts, row 0 at the northern edge (lat_range[1])
+    :param num_users: Number of users to draw
+    :return: position_arrays.UserPositions without names, with region codes
+    """
+    population = np.nan_to_num(np.asarray(population, dtype=np.float64), nan=0.0)
+    num_lat, num_lon = population.shape
+    rng = np.random.default_rng(seed)
+    cell = rng.choice(population.size, size=num_users, p=population.ravel() / population.sum())
+    row, column = np.divmod(cell, num_lon)
+    cell_width = (lon_range[1] - lon_range[0]) / num_lon
+    cell_height = (lat_range[1] - lat_range[0]) / num_lat
+    longitude = lon_range[0] + (column + rng.random(num_users)) * cell_width
+    latitude = lat_range[1] - (row + rng.random(num_users)) * cell_height
+    return position_arrays.UserPositions(None, longitude, latitude, region_of_location(longitude, latitude))
+
+
+def group_by_region(values, region, include_unknown=True):
+    """
+    Values split by region with one sort instead of per-user dict appends
+    :param values: (U,) per-user values
+    :param region: (U,) region codes
+    :param include_unknown: Keep users of UNKNOWN_REGION as a last group instead of dropping them
+    :return: (codes, groups): region codes present, in increasing order with UNKNOWN_REGION last, and the values
+             of each
+    """
+    values = np.asarray(values)
+    region = np.asarray(region)
+    if not include_unknown:
+        values, region = values[region != UNKNOWN_REGION], region[region != UNKNOWN_REGION]
+    # UNKNOWN_REGION sorts after every named region
+    key = np.where(region == UNKNOWN_REGION, np.iinfo(np.int64).max, region.astype(np.int64))
+    order = np.argsort(key, kind="stable")
+    _, first = np.unique(key[order], return_index=True)
+    return region[order][first], np.split(values[order], first[1:])
+
+
+def region_percentiles(values, region, percentiles=(5, 25, 50, 75, 95), region_names=REGION_NAMES):
+    """
+    {region name: percentiles of the values of its users}, NaN ignored; unknown regions under UNKNOWN_REGION_NAME
+    :param values: (U,) or (U, T) per-user values, all values of the users of a region are pooled
+    :param region_names: Names of the region codes, e.g. from user_regions
+    """
+    codes, groups = group_by_region(values, region)
+    return {region_name(code, region_names): np.nanpercentile(group, percentiles)
+            for code, group in zip(codes.tolist(), groups)}
+
+
+class UserResults:
+    """Memory-mapped per-user result columns"""
+
+    def __init__(self, path, header, mode):
+        self.path = path
+        self.header = header
+        self.num_users = header["num_users"]
+        self.metadata = header.get("metadata")
+        for name, column in position_store.map_columns(path, header, mode).items():
+            setattr(self, name, column)
+
+    def flush(self):
+        position_store.flush_columns([getattr(self, name) for name in self.header["columns"]])
+
+
+def create_user_results(path, num_users, metadata=None):
+    """
+    Create an empty result file sized for num_users and open it for writing, so users can be
+    processed in chunks straight into it
+    :param metadata: Optional JSON-serializable description of the run
+    :return: Writable UserResults
+    """
+    header = {"num_users": num_users}
+    if metadata is not None:
+        header["metadata"] = metadata
+    header = position_store.create_columns(path, MAGIC, header,
+                                           [(name, dtype, (num_users,)) for name, dtype in USER_RESULT_COLUMNS])
+    return UserResults(path, header, "r+")
+
+
+def open_user_results(path=USER_RESULT_FILE):
+    """
+    Open an existing result file read-only; every column is a zero-copy memory map
+    :return: UserResults
+    """
+    return UserResults(path, position_store.read_header(path, MAGIC, "a user result file"), "r")
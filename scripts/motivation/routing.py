@@ -0,0 +1,121 @@
+import itertools
+import numpy as np
+import isl_graph
+import visibility
+
+# Shortest paths need scipy.sparse.csgraph; the rest of the analysis does not
+try:
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+# Predecessor of nodes without one in scipy.sparse.csgraph
+NO_PREDECESSOR = -9999
+
+
+def all_user_pairs(num_users):
+    """(P, 2) every unordered pair of users, e.g. of user_locations.txt"""
+    return np.array(list(itertools.combinations(range(num_users), 2)), dtype=np.int64).reshape(-1, 2)
+
+
+def access_links(users_xyz, satellites_xyz, min_elevation_angle):
+    """
+    User-satellite links of one timestep
+    :param users_xyz: (N_users, 3) user positions in km
+    :param satellites_xyz: (N_sats, 3) satellite positions in km
+    :return: (user_index, column, delay): every satellite above min_elevation_angle for every user,
+             with the one-way propagation delay in ms
+    """
+    users_xyz = np.asarray(users_xyz, dtype=np.float64)
+    satellites_xyz = np.asarray(satellites_xyz, dtype=np.float64)
+    sin_elev = visibility.sin_elevation(users_xyz, satellites_xyz[None])[0]  # (N_sats, N_users)
+    column, user_index = np.nonzero(sin_elev >= np.sin(np.radians(min_elevation_angle)))
+    slant_range = np.linalg.norm(satellites_xyz[column] - users_xyz[user_index], axis=1)
+    return user_index, column, isl_graph.link_delays(slant_range)
+
+
+def routing_graph(graph, isl_delay, active, user_index, column, access_delay, num_users):
+    """
+    Directed delay graph of one timestep. Nodes: satellites, then one uplink node per user, then one downlink
+    node per user, so a route enters the constellation once and leaves it once (users never relay traffic)
+    :param graph: isl_graph.ISLGraph
+    :param isl_delay: (num_links,) ISL delays in ms
+    :param active: (num_links,) available ISLs
+    :param user_index, column, access_delay: Access links from access_links
+    :return: scipy.sparse.csr_matrix of shape (N_sats + 2 N_users,) * 2
+    """
+    num_satellites = graph.num_satellites
+    num_nodes = num_satellites + 2 * num_users
+    indptr, indices, data = graph.adjacency(isl_delay, active)
+    isl_source = np.repeat(np.arange(num_satellites), np.diff(indptr))
+    row = np.concatenate([isl_source, num_satellites + user_index, column])
+    col = np.concatenate([indices, column, num_satellites + num_users + user_index])
+    weight = np.concatenate([data, access_delay, access_delay]).astype(np.float64)
+    return csr_matrix((weight, (row, col)), shape=(num_nodes, num_nodes))
+
+
+def trace_paths(predecessors, rows, sources, destinations, max_hops):
+    """
+    Nodes of shortest paths, all pairs walked back at once
+    :param predecessors: (num_searches, num_nodes) predecessor arrays of a multi-source search
+    :param rows: (P,) search row of every pair
+    :param sources: (P,) source node of every pair
+    :param destinations: (P,) destination node of every pair
+    :return: (P, H) node sequences from source to destination, padded with -1; all -1 for unreachable pairs
+    """
+    current = np.asarray(destinations, dtype=np.int64)
+    # Walk back from every destination; walks that reached their source (or a dead end) stay put
+    walk = [current]
+    for _ in range(max_hops):
+        previous = np.where(current >= 0, predecessors[rows, np.maximum(current, 0)], NO_PREDECESSOR)
+        moving = previous != NO_PREDECESSOR
+        if not moving.any():
+            break
+        current = np.where(moving, previous, current)
+        walk.append(current)
+    walk = np.stack(walk, axis=1)
+    reached = walk[:, -1] == sources
+    length = np.argmax(walk == walk[:, -1:], axis=1) + 1
+    # Reverse the first length nodes of every walk into source-to-destination order
+    index = length[:, None] - 1 - np.arange(walk.shape[1])
+    valid = reached[:, None] & (index >= 0)
+    return np.where(valid, np.take_along_axis(walk, np.maximum(index, 0), axis=1), -1).astype(np.int32)
+
+
+def route_latencies(users, pairs, satellites, snapshots, min_elevation_angle, max_hops=256):
+    """
+    End-to-end one-way latency (uplink + ISL hops + downlink) of user pairs at every timestep.
+    :param users: position_arrays.UserPositions
+    :param pairs: (P, 2) user index pairs (source, destination), e.g. all_user_pairs(len(users))
+    :param satellites: position_arrays.SatellitePositions, same columns as snapshots
+    :param snapshots: isl_graph.ISLSnapshots of the same run
+    :param min_elevation_angle: Minimum elevation angle of access links in degrees
+    :return: (latency, isl_hops): (T, P) float32 latencies in ms (inf when not connected) and
+             (T, P) int16 number of ISL hops (-1 when not connected)
+    """
+    if not SCIPY_AVAILABLE:
+        raise ImportError("scipy is required for routing")
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    num_users = len(users)
+    num_satellites = snapshots.num_satellites
+    num_time_steps = snapshots.num_time_steps
+    graph = snapshots.graph
+    latency = np.full((num_time_steps, len(pairs)), np.inf, dtype=np.float32)
+    isl_hops = np.full((num_time_steps, len(pairs)), -1, dtype=np.int16)
+    # One multi-source search per timestep, one search row per distinct source user
+    sources, source_row = np.unique(pairs[:, 0], return_inverse=True)
+    source_nodes = num_satellites + sources
+    destination_nodes = num_satellites + num_users + pairs[:, 1]
+    for time_step_index, active, lengths in snapshots.snapshots():
+        satellites_xyz = satellites.xyz(time_step_index, time_step_index + 1)[0]
+        weights = routing_graph(graph, isl_graph.link_delays(lengths), active,
+                                *access_links(users.xyz, satellites_xyz, min_elevation_angle), num_users)
+        distance, predecessors = dijkstra(weights, directed=True, indices=source_nodes, return_predecessors=True)
+        latency[time_step_index] = distance[source_row, destination_nodes]
+        paths = trace_paths(predecessors, source_row, source_nodes[source_row], destination_nodes, max_hops)
+        # Nodes: uplink, satellites..., downlink
+        hops = (paths >= 0).sum(axis=1) - 3
+        isl_hops[time_step_index] = np.where(np.isfinite(latency[time_step_index]), hops, -1)
+    return latency, isl_hops
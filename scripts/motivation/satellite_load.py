@@ -0,0 +1,91 @@
+import numpy as np
+
+# Constellation of each shell tag, as in classify_satellites.py
+CONSTELLATION_NAMES = {1: "Starlink", 2: "Kuiper", 3: "Telesat"}
+
+
+def satellite_load(serving, num_satellites, load=None, time_steps_per_block=256):
+    """
+    Number of users served by every satellite at every timeslot, one bincount over (timeslot, column) keys
+    per block of timeslots, so the int64 counts never exceed (time_steps_per_block, num_satellites).
+    Users can be fed in chunks: pass the load of the previous chunks to accumulate into it.
+    :param serving: (N_users, T) serving satellite columns, -1 when nothing is visible
+    :param num_satellites: Number of satellite columns
+    :param load: Optional (T, num_satellites) int32 load to add to
+    :return: (T, num_satellites) int32 load
+    """
+    serving = np.asarray(serving)
+    num_time_steps = serving.shape[1]
+    if load is None:
+        load = np.zeros((num_time_steps, num_satellites), dtype=np.int32)
+    for begin in range(0, num_time_steps, time_steps_per_block):
+        end = min(begin + time_steps_per_block, num_time_steps)
+        block = serving[:, begin:end]
+        served = block >= 0
+        key = np.broadcast_to(np.arange(end - begin, dtype=np.int64) * num_satellites, block.shape)[served]
+        key = key + block[served]
+        load[begin:end] += np.bincount(key, minlength=(end - begin) * num_satellites).reshape(
+            end - begin, num_satellites).astype(np.int32)
+    return load
+
+
+def group_load(load, group):
+    """
+    Load summed over groups of satellites, e.g. shells or constellations
+    :param load: (T, N_sats) load from satellite_load
+    :param group: (N_sats,) group label of every column
+    :return: (labels, (T, len(labels)) int64 load of each group)
+    """
+    labels, column_group = np.unique(np.asarray(group), return_inverse=True)
+    totals = np.zeros((load.shape[0], len(labels)), dtype=np.int64)
+    for index in range(len(labels)):
+        totals[:, index] = load[:, column_group == index].sum(axis=1)
+    return labels, totals
+
+
+def constellation_of_shell(shell, constellation_names=CONSTELLATION_NAMES):
+    """(N_sats,) constellation name of every column from its shell tag"""
+    return np.array([constellation_names.get(tag, f"shell_{tag}") for tag in np.asarray(shell).tolist()])
+
+
+def hot_spots(load, capacity):
+    """
+    Satellites serving more users than capacity
+    :param load: (T, N_sats) load from satellite_load
+    :param capacity: Users one satellite can serve, one value or (N_sats,) per column
+    :return: (time_step_index, column, load) of every overloaded (timeslot, satellite), ordered by timeslot
+    """
+    overloaded = load > np.asarray(capacity)
+    time_step_index, column = np.nonzero(overloaded)
+    return time_step_index, column, load[time_step_index, column]
+
+
+def load_histograms(load, bin_edges):
+    """
+    Number of satellites in every load bin at every timeslot
+    :param load: (T, N_sats) load from satellite_load
+    :param bin_edges: Increasing bin edges; loads beyond the last edge fall in the last bin
+    :return: (T, len(bin_edges) - 1) int32 counts
+    """
+    num_bins = len(bin_edges) - 1
+    bin_index = np.clip(np.searchsorted(bin_edges, load, side="right") - 1, 0, num_bins - 1)
+    key = np.arange(load.shape[0], dtype=np.int64)[:, None] * num_bins + bin_index
+    return np.bincount(key.ravel(), minlength=load.shape[0] * num_bins).reshape(load.shape[0], num_bins).astype(
+        np.int32)
+
+
+def write_load_summary(output_path, load, shell, capacity, constellation_names=CONSTELLATION_NAMES):
+    """
+    One row per shell and per constellation: mean and peak users per timeslot, busiest satellite,
+    number of (timeslot, satellite) hot spots above capacity
+    """
+    _, hot_column, _ = hot_spots(load, capacity)
+    hot_count = np.bincount(hot_column, minlength=load.shape[1])
+    with open(output_path, 'w') as f:
+        f.write("group mean_users peak_users peak_satellite_users hot_spots\n")
+        for prefix, group in (("shell_", np.asarray(shell)), ("", constellation_of_shell(shell, constellation_names))):
+            labels, totals = group_load(load, group)
+            for index, label in enumerate(labels.tolist()):
+                columns = np.asarray(group) == label
+                f.write(f"{prefix}{label} {totals[:, index].mean():.2f} {int(totals[:, index].max())} "
+                        f"{int(load[:, columns].max(initial=0))} {int(hot_count[columns].sum())}\n")
@@ -1,44 +1,184 @@
 import math
 import os
+import sys
+import numpy as np
+import handoff_policies
+import visibility
 
-def LongitudeAndLatitudeToDescartesPoints(satellites):
-    result = []
-    for sat in satellites:
-        R = 6371.0 + sat[2]
-        lon_rad = math.radians(sat[0])
-        lat_rad = math.radians(sat[1])
-        x = R * math.cos(lat_rad) * math.cos(lon_rad)
-        y = R * math.cos(lat_rad) * math.sin(lon_rad)
-        z = R * math.sin(lat_rad)
-        result.append([x, y, z])
-    return result
-
-class Sat:
-    def __init__(self, x, y, z, SNO):
-        self.x = x
-        self.y = y
-        self.z = z
-        self.SNO = SNO
-
-class User:
-    def __init__(self, name, x, y, z):
-        self.name = name
-        self.x = x
-        self.y = y
-        self.z = z
-
-def process_user(user, satellites_position_by_timeslot, min_elevation_angle, output_dir):
-    user_x = user.x
-    user_y = user.y
-    user_z = user.z
+# Shared modules (position store, propagator) live next to the constellation generator
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                             'StarAlliance-Motivation-Starlink-Kuiper-Telesat'))
+import isl_graph
+import position_arrays
+import population
+import streaming
+import visibility_store
+
+def load_satellites(store_path):
+    # Struct-of-arrays view of the position store: float32 (T, N) columns and int32 IDs, no per-satellite objects
+    return position_arrays.SatellitePositions.from_store(store_path)
+
+def best_satellites(users, satellites, min_elevation_angle, pool=None):
+    # Every user and timeslot in one vectorized pass, or on pool (parallel.SharedPositions over satellites.xyz(),
+    # opened once for the whole run) so the positions are shared instead of copied per call
+    # Only satellites within the visibility radius of their shell altitude are tested (KD-tree per timeslot)
+    satellite_altitude = np.asarray(satellites.altitude[0])
+    if pool is not None:
+        return pool.best_satellite_by_timeslot(users.xyz, min_elevation_angle, satellite_altitude)
+    return visibility.best_satellite_by_timeslot(users.xyz, satellites.xyz(), min_elevation_angle,
+                                                 satellite_altitude=satellite_altitude)
+
+def above_threshold(best, elevation, min_elevation_angle):
+    # Highest satellite of a pass at a lower threshold -> the same pass at min_elevation_angle: the highest
+    # satellite does not depend on the threshold, only whether it is visible does (-1 and NaN below it)
+    visible = elevation >= min_elevation_angle
+    return np.where(visible, best, -1).astype(np.int32), np.where(visible, elevation, np.nan).astype(np.float32)
+
+def switch_counts(SNO_by_timeslot):
+    # (N_users, T) int32 SNO (global satellite ID, -1 when none is visible) per timeslot -> switches per user
+    # (the first timeslot counts as one switch)
+    return 1 + np.count_nonzero(SNO_by_timeslot[:, 1:] != SNO_by_timeslot[:, :-1], axis=1)
+
+def process_users_sweep(users, satellites, min_elevation_angles, pool=None, geometry=None):
+    # Elevations are computed once at the lowest threshold and every threshold is derived from them;
+    # geometry = (best, elevation) of a pass at or below min(min_elevation_angles) skips that pass too
+    if geometry is None:
+        geometry = best_satellites(users, satellites, min(min_elevation_angles), pool)
+    best, elevation = geometry
+    SNO = np.append(satellites.sat_id, -1)[best]
+    switch_count = np.empty((len(min_elevation_angles), len(users)), dtype=np.int64)
+    for index, min_elevation_angle in enumerate(min_elevation_angles):
+        switch_count[index] = switch_counts(np.where(elevation >= min_elevation_angle, SNO, -1))
+    return switch_count
+
+def write_sweep_table(output_path, users, min_elevation_angles, switch_count):
+    # One row per user, one switch-count column per threshold
+    with open(output_path, 'w') as f:
+        f.write("user " + " ".join(f"elevation_{angle:g}" for angle in min_elevation_angles) + "\n")
+        for user_name, counts in zip(users.name, switch_count.T.tolist()):
+            f.write(user_name + " " + " ".join(str(count) for count in counts) + "\n")
+
+def read_sweep_table(input_path, min_elevation_angle):
+    # {user name: switch count} for one threshold of the sweep table
+    with open(input_path, 'r') as f:
+        header = f.readline().split()
+        column = header.index(f"elevation_{min_elevation_angle:g}")
+        return {fields[0]: int(fields[column]) for fields in (line.split() for line in f) if fields}
+
+def visibility_tensor(users, satellites, min_elevation_angle, store_path=None):
+    # Visible satellites of every user and timeslot; with store_path, reloaded from the visibility store
+    # when it covers min_elevation_angle and was computed from the same users and satellite positions
+    # (source digest: satellite columns, time grid, sampled positions), otherwise computed once and saved there
+    source = visibility_store.source_digest(users.xyz, satellites) if store_path is not None else None
+    if store_path is not None and os.path.exists(store_path):
+        store = visibility_store.open_visibility_store(store_path)
+        if (store.min_elevation_angle <= min_elevation_angle and store.source == source
+                and store.user_names == list(users.name)):
+            return store.tensor(min_elevation_angle)
+    tensor = handoff_policies.VisibilityTensor.compute(users.xyz, satellites.xyz(), min_elevation_angle,
+                                                       np.asarray(satellites.altitude[0]))
+    if store_path is not None:
+        visibility_store.write_visibility_store(store_path, users.name, tensor, min_elevation_angle,
+                                                satellites.sat_id, satellites.shell,
+                                                satellites.start_time, satellites.time_step, source=source)
+    return tensor
+
+def compare_handoff_policies(users, satellites, min_elevation_angle, policies=None, store_path=None):
+    # Geometry is computed once into a visibility tensor (or reloaded from store_path); every policy only replays it
+    tensor = visibility_tensor(users, satellites, min_elevation_angle, store_path)
+    # Handoffs are counted between individual satellites (columns)
+    return {name: switch_counts(serving)
+            for name, serving in handoff_policies.run_policies(tensor, policies).items()}
+
+def serving_access(satellites, best, elevation):
+    # Slant range and one-way delay of the serving satellites of a best_satellites pass (best, elevation).
+    # The range follows from the elevation and the satellite altitude, so it costs no extra geometry pass.
+    visible = best >= 0
+    altitude = np.full(best.shape, np.nan)
+    time_step_index = np.broadcast_to(np.arange(best.shape[1]), best.shape)
+    altitude[visible] = satellites.altitude[time_step_index[visible], best[visible]]
+    slant_range = visibility.slant_range(altitude, elevation).astype(np.float32)  # NaN when nothing is visible
+    delay = isl_graph.link_delays(slant_range)
+    return slant_range, delay
+
+def write_access_series(output_dir, elevation, slant_range, delay):
+    # (N_users, T) float32 arrays, rows in user_locations.txt order; np.load(..., mmap_mode='r') reads them back
+    for name, values in (("access_elevation_deg", elevation), ("access_slant_range_km", slant_range),
+                         ("access_delay_ms", delay)):
+        np.save(os.path.join(output_dir, f"{name}.npy"), np.asarray(values, dtype=np.float32))
+
+def write_access_summary(output_path, users, slant_range, delay, percentiles=(5, 25, 50, 75, 95)):
+    # One row per continent and quantity, one column per percentile over all users of the continent and all
+    # timeslots; continents as in process_population and the plots below
+    region, region_names = population.user_regions(users)
+    with open(output_path, 'w') as f:
+        f.write("continent quantity " + " ".join(f"p{percentile:g}" for percentile in percentiles) + "\n")
+        for quantity, values in (("slant_range_km", slant_range), ("delay_ms", delay)):
+            continent_summary = population.region_percentiles(values, region, percentiles, region_names)
+            for continent, summary in continent_summary.items():
+                f.write(f"{continent} {quantity} " + " ".join(f"{value:.3f}" for value in summary.tolist()) + "\n")
+
+def process_population(users, satellites, min_elevation_angle, output_path, pool=None, users_per_query=65536,
+                       block_size=256):
+    # Millions of users: the serving satellite of every user is found one timeslot at a time, with one KD-tree per
+    # timeslot queried by all users (users_per_query at a time), and reduced right away to per-user statistics and
+    # the per-satellite load (streaming.population_statistics), so memory grows with the users, not with
+    # users x timeslots. With pool, every worker reduces a block of timeslots. Results are written column-wise to
+    # one file (population.USER_RESULT_COLUMNS) instead of one text file per user; returns the per-satellite load.
+    region, region_names = population.user_regions(users)
+    results = population.create_user_results(output_path, len(users),
+                                             {"min_elevation_angle": min_elevation_angle,
+                                              "region_names": list(region_names)})
+    satellite_altitude = np.asarray(satellites.altitude[0])
+    if pool is not None:
+        statistics = pool.population_statistics(users.xyz, min_elevation_angle, satellite_altitude, users_per_query)
+    else:
+        statistics = streaming.population_statistics(
+            users.xyz, streaming.prefetch(streaming.timeslot_blocks(satellites, block_size)), min_elevation_angle,
+            satellite_altitude, users_per_query)
+    visible_count = statistics.visible_count
+    results.longitude[:] = users.longitude
+    results.latitude[:] = users.latitude
+    results.region[:] = region
+    results.switch_count[:] = statistics.switch_count
+    results.visible_fraction[:] = visible_count / satellites.num_time_steps
+    results.mean_delay_ms[:] = np.where(visible_count > 0, statistics.delay_sum / np.maximum(visible_count, 1), np.nan)
+    results.flush()
+    return statistics.load
+
+def process_users(users, satellites, min_elevation_angle, output_dir, pool=None, best=None):
+    # Batched process_user; the SNO is the global satellite ID, so handoffs within a shell are counted too.
+    # best: serving satellite indexes of a pass at min_elevation_angle, e.g. from above_threshold, skips the pass
+    if best is None:
+        best, _ = best_satellites(users, satellites, min_elevation_angle, pool)
+    # Index -1 (no visible satellite) picks the trailing -1
+    SNO = np.append(satellites.sat_id, -1).astype(np.int32)[best]
+    # Index -1 picks the trailing "None", as written by process_user
+    SNO_names = np.array([str(sno) for sno in satellites.sat_id.tolist()] + ["None"])
+    for user_name, user_best in zip(users.name, best):
+        output_path = os.path.join(output_dir, f"{user_name}_connected_SNO.txt")
+        with open(output_path, 'w') as f:
+            f.write("\n".join(SNO_names[user_best].tolist()) + "\n")
+    return switch_counts(SNO)
+
+def read_SNO_file(input_path):
+    # One <user>_connected_SNO.txt file -> (T,) int32 SNO, -1 for "None"
+    with open(input_path, 'r') as f:
+        return np.array([int(sno) if sno != "None" else -1 for sno in f.read().split()], dtype=np.int32)
+
+def process_user(user_index, users, satellites, min_elevation_angle, output_dir):
+    # Scalar reference implementation of process_users for one user
+    user_x, user_y, user_z = users.xyz[user_index].tolist()
+    satellite_SNO = satellites.sat_id.tolist()
     user_connected_SNO_by_timeslot = []
 
-    for satellites_position in satellites_position_by_timeslot:
+    for time_step_index in range(satellites.num_time_steps):
+        satellites_position = satellites.xyz(time_step_index, time_step_index + 1)[0].tolist()
         now_connected_SNO = None
         now_connected_satellite_satellite = 1000  # Initialize a large value
-        for sat in satellites_position:
+        for (sat_x, sat_y, sat_z), sat_SNO in zip(satellites_position, satellite_SNO):
             vector1 = [-user_x, -user_y, -user_z]
-            vector2 = [sat.x - user_x, sat.y - user_y, sat.z - user_z]
+            vector2 = [sat_x - user_x, sat_y - user_y, sat_z - user_z]
             dot_product = (vector1[0] * vector2[0] +
                            vector1[1] * vector2[1] +
                            vector1[2] * vector2[2])
@@ -48,43 +188,31 @@ def process_user(user, satellites_position_by_timeslot, min_elevation_angle, out
             angle = math.acos(cos_angle) * (180 / math.pi)
 
             if angle >= 90 + min_elevation_angle and 180 - angle < now_connected_satellite_satellite:
-                now_connected_SNO = sat.SNO
+                now_connected_SNO = sat_SNO
                 now_connected_satellite_satellite = 180 - angle
         user_connected_SNO_by_timeslot.append(now_connected_SNO)
 
     # Write results to a file
-    output_path = os.path.join(output_dir, f"{user.name}_connected_SNO.txt")
+    output_path = os.path.join(output_dir, f"{users.name[user_index]}_connected_SNO.txt")
     with open(output_path, 'w') as f:
         for sno in user_connected_SNO_by_timeslot:
             f.write(f"{sno}\n")
 
 if __name__ == "__main__":
     """
+    # Modules only used by the passes below
+    from multiprocessing import cpu_count
+    import parallel
+    import passes
+    import position_store
+    import routing
+    import satellite_load
+
     # Load satellite positions
-    satellites_position_by_timeslot = []
-    satellite_files = [f for f in os.listdir('SatellitePositions') if f.endswith('.txt')]
-    for file in satellite_files:
-        file_path = os.path.join('SatellitePositions', file)
-        with open(file_path, 'r') as f:
-            lines = f.readlines()
-            satellites = []
-            for line in lines:
-                parts = line.strip().split(' ')
-                satellite_xyz = LongitudeAndLatitudeToDescartesPoints([[float(parts[0]), float(parts[1]), float(parts[2])]])[0]
-                satellites.append(Sat(satellite_xyz[0], satellite_xyz[1], satellite_xyz[2], int(parts[3])))
-            satellites_position_by_timeslot.append(satellites)
+    satellites = load_satellites(position_store.POSITION_STORE_FILE)
 
     # Load user locations
-    users = []
-    with open('user_locations.txt', 'r') as f:
-        for line in f:
-            user_location_data = line.strip()
-            user_coordinates = user_location_data.split(' ')
-            user_name = user_coordinates[0]
-            user_longitude = float(user_coordinates[1])
-            user_latitude = float(user_coordinates[2])
-            user_xyz = LongitudeAndLatitudeToDescartesPoints([[user_longitude, user_latitude, 0]])[0]
-            users.append(User(user_name, user_xyz[0], user_xyz[1], user_xyz[2]))
+    users = position_arrays.UserPositions.from_file('user_locations.txt')
 
     # Minimum elevation angle
     min_elevation_angle = 25  # degrees
@@ -93,49 +221,103 @@ if __name__ == "__main__":
     output_dir = "output"
     os.makedirs(output_dir, exist_ok=True)
 
-    # Create processes for each user
-    processes = []
-    cpu_cores = cpu_count()  # Get the number of CPU cores
-    for i in range(cpu_cores):
-        for user in users:
-            p = Process(target=process_user, args=(user, satellites_position_by_timeslot, min_elevation_angle, output_dir))
-            processes.append(p)
-            p.start()
-
-    # Wait for all processes to finish
-    for p in processes:
-        p.join()
+    # Thresholds of the elevation sweep below
+    min_elevation_angles = [10, 15, 20, 25, 30, 40]
+
+    # One geometry pass at the lowest threshold; every result below is derived from it.
+    # Satellite positions are published once in shared memory for one worker per CPU core
+    with parallel.SharedPositions(satellites.xyz(), cpu_count()) as pool:
+        geometry = best_satellites(users, satellites, min(min_elevation_angles), pool)
+    serving, access_elevation = above_threshold(*geometry, min_elevation_angle)
+
+    # Connected SNO files of all users
+    process_users(users, satellites, min_elevation_angle, output_dir, best=serving)
+
+    # Slant range, one-way delay and elevation of the serving satellite, with per-continent percentiles
+    access_range, access_delay = serving_access(satellites, serving, access_elevation)
+    write_access_series(output_dir, access_elevation, access_range, access_delay)
+    write_access_summary(os.path.join(output_dir, "access_latency_summary.txt"), users, access_range, access_delay)
+
+    # Users served by every satellite at every timeslot, hot spots above the per-satellite capacity
+    satellite_capacity = 20  # users per satellite
+    load = satellite_load.satellite_load(serving, len(satellites.sat_id))
+    satellite_load.write_load_summary(os.path.join(output_dir, "satellite_load_summary.txt"), load,
+                                      satellites.shell, satellite_capacity)
+    np.save(os.path.join(output_dir, "satellite_load_histogram.npy"),
+            satellite_load.load_histograms(load, np.arange(0, 2 * satellite_capacity + 1, 5)))
+
+    # All thresholds from the same pass, one table for the violin plot
+    switch_count = process_users_sweep(users, satellites, min_elevation_angles, geometry=geometry)
+    write_sweep_table(os.path.join(output_dir, "elevation_sweep.txt"), users, min_elevation_angles, switch_count)
+
+    # Population scale: synthetic users on a grid (or population_users from a population raster),
+    # all results in one columnar file read back below; one KD-tree per timeslot for all users, blocks of
+    # timeslots spread over the shared pool
+    # users = population.grid_users(spacing=0.1)
+    # with parallel.SharedPositions(satellites.xyz(), cpu_count()) as pool:
+    #     load = process_population(users, satellites, min_elevation_angle, population.USER_RESULT_FILE, pool=pool)
+
+    # Long or high-resolution runs: stream blocks of timeslots instead, memory stays bounded by block_size
+    # streaming.process_users_streaming(users, satellites, min_elevation_angle, output_dir, block_size=256)
+
+    # Visibility geometry computed once at the lowest threshold of interest and kept on disk (reused as long as
+    # the users and satellite positions match); every policy and threshold is replayed from the store, and later
+    # runs reload it in seconds without the satellite positions
+    store_path = os.path.join(output_dir, "visibility.bin")
+    visibility_tensor(users, satellites, min(min_elevation_angles), store_path)
+    store = visibility_store.open_visibility_store(store_path)
+
+    # Switch counts of every handoff policy (greedy, sticky, longest remaining visibility) at min_elevation_angle
+    policy_switch_count = {name: switch_counts(serving) for name, serving in
+                           handoff_policies.run_policies(store.tensor(min_elevation_angle)).items()}
+    # visible_count = store.visible_counts(30)
+
+    # End-to-end latency of every user pair over uplink, ISL hops and downlink, at every timeslot
+    # snapshots = isl_graph.open_isl_snapshots(isl_graph.ISL_SNAPSHOT_FILE)
+    # pair_latency, pair_isl_hops = routing.route_latencies(users, routing.all_user_pairs(len(users)), satellites,
+    #                                                       snapshots, min_elevation_angle)
+
+    # Event-driven handoffs from refined pass windows: stay on a satellite until it sets
+    # predictor = passes.PassPredictor.from_store(position_store.POSITION_STORE_FILE)
+    # event_switch_count = passes.event_handoff_counts(users, satellites, predictor, min_elevation_angle)
     """
 
 
     # Calculate SNO for each user at each time slot above, now count switches for each user
-    user_switch_count = {}
     output_dir = "output"
-    user_files = [f for f in os.listdir(output_dir) if f.endswith('_connected_SNO.txt')]
-    for user_file in user_files:
-        user_name = user_file.split('_')[0] + "_" + user_file.split('_')[1]
-        with open(os.path.join(output_dir, user_file), 'r') as f:
-            sno_list = f.readlines()
-            sno_list = [sno.strip() for sno in sno_list]
-            switch_count = 0
-            last_sno = None
-            for sno in sno_list:
-                if sno != last_sno:
-                    switch_count += 1
-                    last_sno = sno
-            user_switch_count[user_name] = switch_count
-
-    # Classify by first two characters of username, as they represent continent. Key is continent name, value is list of switch counts for all users in that continent
-    continent_switch_count = {}
-    for user_name, switch_count in user_switch_count.items():
-        continent = user_name[:2]  # First two characters represent continent
-        if continent not in continent_switch_count:
-            continent_switch_count[continent] = []
-        continent_switch_count[continent].append(switch_count/24)
+    results_path = os.path.join(output_dir, "user_results.bin")
+    if os.path.exists(results_path):
+        # Columnar results of process_population: region code and switch count of every user
+        results = population.open_user_results(results_path)
+        user_region = np.asarray(results.region)
+        region_names = results.metadata["region_names"]
+        user_switch_count = np.asarray(results.switch_count)
+    else:
+        user_names = []
+        user_switch_count = []
+        user_files = [f for f in os.listdir(output_dir) if f.endswith('_connected_SNO.txt')]
+        for user_file in user_files:
+            user_names.append(user_file.split('_')[0] + "_" + user_file.split('_')[1])
+            # Integer satellite IDs, switches counted with one vectorized comparison
+            sno_array = read_SNO_file(os.path.join(output_dir, user_file))
+            user_switch_count.append(int(switch_counts(sno_array[None, :])[0]))
+        # With a sweep table, any threshold can be plotted instead:
+        # sweep = read_sweep_table(os.path.join(output_dir, "elevation_sweep.txt"), 25)
+        # user_names, user_switch_count = list(sweep), list(sweep.values())
+        # The first two characters of the user name are the continent; unlisted prefixes keep their own group
+        region_names = population.region_names_of(user_names)
+        user_region = population.region_of_names(user_names, region_names)
+        user_switch_count = np.array(user_switch_count)
+
+    # Group switch counts per hour by continent code with one sort; users outside every region box are kept as
+    # a last "Other" group
+    continent_codes, continent_groups = population.group_by_region(user_switch_count / 24, user_region)
+    continent_names = [population.region_name(code, region_names) for code in continent_codes.tolist()]
+    continent_data = [group.tolist() for group in continent_groups]
 
     # Output list for each continent
-    for continent, switch_counts in continent_switch_count.items():
-        print(f"Continent: {continent}, Switch Counts: {switch_counts}")
+    for continent, continent_counts in zip(continent_names, continent_data):
+        print(f"Continent: {continent}, Switch Counts: {continent_counts}")
 
     # Plot: create violin plot for switch counts by continent, x-axis shows continent names, y-axis shows switch counts
     import matplotlib.pyplot as plt
@@ -145,10 +327,6 @@ if __name__ == "__main__":
     matplotlib.rcParams["font.family"] = "serif"
     plt.rcParams["pdf.fonttype"] = 42
     
-    # Prepare data
-    continent_names = list(continent_switch_count.keys())
-    continent_data = list(continent_switch_count.values())
-    
     # Create figure - adjust to match reference script proportions (12, 8->7)
     plt.figure(figsize=(12, 7))
     ax1 = plt.gca()
@@ -0,0 +1,224 @@
+import os
+import queue
+import threading
+import numpy as np
+import isl_graph
+import propagation
+import visibility
+
+# Sentinel "previous satellite" before the first timeslot: differs from every index and from -1 (None),
+# so the first timeslot counts as one switch like the file-based count in start.py
+NO_PREVIOUS = -2
+
+
+def timeslot_blocks(satellites, block_size=256, begin=0, end=None):
+    """
+    Satellite positions of consecutive timeslots, one block at a time; only the current block is in memory
+    :param satellites: position_arrays.SatellitePositions (memory-mapped columns when loaded from a store)
+    :param block_size: Number of timeslots per block
+    :return: Generator of (first timeslot index, (t, N_sats, 3) float32 Cartesian positions)
+    """
+    if end is None:
+        end = satellites.num_time_steps
+    for block_begin in range(begin, end, block_size):
+        block_end = min(block_begin + block_size, end)
+        yield block_begin, satellites.xyz(block_begin, block_end)
+
+
+def propagated_timeslot_blocks(constellation_information, start_time, time_step, num_time_steps, block_size=256,
+                               phase_shift=True):
+    """
+    Like timeslot_blocks, but propagates each block on the fly, so no position store of the whole run is needed
+    :return: Generator of (first timeslot index, (t, N_sats, 3) float32 Cartesian positions)
+    """
+    for block_begin in range(0, num_time_steps, block_size):
+        block_length = min(block_size, num_time_steps - block_begin)
+        longitude, latitude, altitude, _ = propagation.propagate_constellation(
+            constellation_information, start_time + time_step * block_begin, time_step, block_length, phase_shift)
+        yield block_begin, propagation.lon_lat_alt_to_xyz(longitude, latitude, altitude).astype(np.float32)
+
+
+def prefetch(blocks, depth=1):
+    """
+    Produce the next items of a generator on a background thread while the caller works on the current one
+    :param blocks: Any iterable
+    :param depth: Number of items produced ahead (bounds memory to depth + 1 items)
+    """
+    items = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in blocks:
+                if stop.is_set():
+                    return
+                items.put(item)
+            items.put(done)
+        except BaseException as error:
+            items.put(error)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Unblock the producer if it is waiting on a full queue
+        while thread.is_alive():
+            try:
+                items.get_nowait()
+            except queue.Empty:
+                thread.join(0.01)
+
+
+class HandoffState:
+    """Per-user handoff state carried from one timeslot block to the next"""
+
+    __slots__ = ("current", "switch_count")
+
+    def __init__(self, num_users):
+        self.current = np.full(num_users, NO_PREVIOUS, dtype=np.int32)
+        self.switch_count = np.zeros(num_users, dtype=np.int64)
+
+    def update(self, block_SNO):
+        """
+        :param block_SNO: (N_users, t) int32 serving satellite of every user in the block, -1 when none is visible
+        """
+        if block_SNO.shape[1] == 0:
+            return
+        self.switch_count += block_SNO[:, 0] != self.current
+        self.switch_count += np.count_nonzero(block_SNO[:, 1:] != block_SNO[:, :-1], axis=1)
+        self.current = block_SNO[:, -1].copy()
+
+
+class PopulationStatistics:
+    """
+    Per-user switch count, visible timeslots and summed access delay, and per-satellite load, of consecutive
+    timeslots. Blocks of timeslots reduced separately (e.g. by pool workers) are appended in timeslot order.
+    """
+
+    __slots__ = ("first", "last", "switch_count", "visible_count", "delay_sum", "load")
+
+    def __init__(self, num_users, num_satellites, num_time_steps):
+        # first/last: serving columns of the first and last timeslot, NO_PREVIOUS before any timeslot
+        self.first = np.full(num_users, NO_PREVIOUS, dtype=np.int32)
+        self.last = np.full(num_users, NO_PREVIOUS, dtype=np.int32)
+        self.switch_count = np.zeros(num_users, dtype=np.int64)
+        self.visible_count = np.zeros(num_users, dtype=np.int64)
+        self.delay_sum = np.zeros(num_users, dtype=np.float64)
+        self.load = np.zeros((num_time_steps, num_satellites), dtype=np.int32)
+
+    def update(self, time_step_index, best, delay):
+        """
+        :param time_step_index: Timeslot within these statistics, updated in order
+        :param best: (N_users,) serving satellite columns, -1 when none is visible
+        :param delay: (N_users,) one-way access delays in ms, NaN when none is visible
+        """
+        if time_step_index == 0:
+            self.first = best.copy()
+        # The first timeslot counts as one switch, as in start.switch_counts
+        self.switch_count += best != self.last
+        self.last = best.copy()
+        visible = best >= 0
+        self.visible_count += visible
+        self.delay_sum += np.where(visible, delay, 0)
+        self.load[time_step_index] = np.bincount(best[visible], minlength=self.load.shape[1])
+
+    def append(self, other):
+        """Statistics of the timeslots right after these; returns the statistics of both"""
+        combined = PopulationStatistics(len(self.first), self.load.shape[1], 0)
+        combined.first = self.first if len(self.load) else other.first
+        combined.last = other.last if len(other.load) else self.last
+        # The first timeslot of other was counted as a switch; it is one only if the satellite changed
+        continued = (self.last == other.first) & (self.last != NO_PREVIOUS)
+        combined.switch_count = self.switch_count + other.switch_count - continued
+        combined.visible_count = self.visible_count + other.visible_count
+        combined.delay_sum = self.delay_sum + other.delay_sum
+        combined.load = np.concatenate([self.load, other.load])
+        return combined
+
+
+def population_statistics(users_xyz, blocks, min_elevation_angle, satellite_altitude, users_per_query=65536):
+    """
+    PopulationStatistics of a stream of timeslot blocks: the serving satellite of every user is found one timeslot
+    at a time (visibility.best_satellite_per_timeslot) and reduced right away, so memory grows with the users,
+    not with users x timeslots
+    :param users_xyz: (N_users, 3) user positions
+    :param blocks: Iterable of (first timeslot index, (t, N_sats, 3) positions), e.g. prefetch(timeslot_blocks(...))
+    :param satellite_altitude: (N_sats,) altitude of every satellite column in km
+    :param users_per_query: Users per KD-tree query
+    :return: PopulationStatistics of all timeslots of the blocks
+    """
+    satellite_altitude = np.asarray(satellite_altitude, dtype=np.float64)
+    statistics = None
+    for _, block_xyz in blocks:
+        block = PopulationStatistics(len(users_xyz), block_xyz.shape[1], len(block_xyz))
+        for time_step_index, best, elevation in visibility.best_satellite_per_timeslot(
+                users_xyz, block_xyz, min_elevation_angle, satellite_altitude, users_per_query):
+            # The range follows from the elevation and the shell altitude, as in start.serving_access
+            altitude = np.where(best >= 0, satellite_altitude[best], np.nan)
+            block.update(time_step_index, best,
+                         isl_graph.link_delays(visibility.slant_range(altitude, elevation).astype(np.float32)))
+        statistics = block if statistics is None else statistics.append(block)
+    return statistics
+
+
+def stream_handoffs(users_xyz, blocks, min_elevation_angle, satellite_SNO, output_paths=None,
+                    satellite_altitude=None):
+    """
+    Serving satellite and handoff counts of every user over a stream of timeslot blocks
+    :param users_xyz: (N_users, 3) user positions
+    :param blocks: Iterable of (first timeslot index, (t, N_sats, 3) positions), e.g. prefetch(timeslot_blocks(...))
+    :param min_elevation_angle: Minimum elevation angle in degrees
+    :param satellite_SNO: (N_sats,) int32 SNO reported for each satellite column
+    :param output_paths: Optional list of text file paths, one per user, receiving one SNO line per timeslot.
+                         The lines of a block are appended to one file after the other, so only one file is
+                         open at a time whatever the number of users
+    :param satellite_altitude: Optional (N_sats,) altitudes in km, enables the KD-tree candidate search
+    :return: HandoffState after the last block
+    """
+    satellite_SNO = np.asarray(satellite_SNO, dtype=np.int32)
+    # Column -1 (no visible satellite) maps to SNO -1
+    SNO_lookup = np.append(satellite_SNO, -1)
+    state = HandoffState(len(users_xyz))
+    mode = 'w'
+    for _, block_xyz in blocks:
+        best, _ = visibility.best_satellite_by_timeslot(users_xyz, block_xyz, min_elevation_angle,
+                                                        satellite_altitude=satellite_altitude)
+        block_SNO = SNO_lookup[best]
+        state.update(block_SNO)
+        if output_paths is not None:
+            for output_path, user_SNO in zip(output_paths, block_SNO):
+                with open(output_path, mode) as f:
+                    f.write("".join(f"{sno}\n" if sno >= 0 else "None\n" for sno in user_SNO.tolist()))
+            mode = 'a'
+    return state
+
+
+def process_users_streaming(users, satellites, min_elevation_angle, output_dir=None, block_size=256,
+                            satellite_SNO=None):
+    """
+    Bounded-memory process_users: timeslot blocks are converted and prefetched on a background thread,
+    the handoff state is carried across blocks
+    :param users: position_arrays.UserPositions
+    :param satellites: position_arrays.SatellitePositions
+    :param output_dir: If given, write <user>_connected_SNO.txt files like process_users
+    :param satellite_SNO: SNO of each satellite column, defaults to the global satellite ID
+    :return: (N_users,) switch counts
+    """
+    if satellite_SNO is None:
+        satellite_SNO = satellites.sat_id
+    blocks = prefetch(timeslot_blocks(satellites, block_size))
+    output_paths = None
+    if output_dir is not None:
+        output_paths = [os.path.join(output_dir, f"{name}_connected_SNO.txt") for name in users.name]
+    state = stream_handoffs(users.xyz, blocks, min_elevation_angle, satellite_SNO, output_paths,
+                            np.asarray(satellites.altitude[0]))
+    return state.switch_count
@@ -0,0 +1,227 @@
+import numpy as np
+
+# The KD-tree candidate search is optional; without scipy every satellite is tested
+try:
+    from scipy.spatial import cKDTree
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def sin_elevation(users_xyz, satellites_xyz):
+    """
+    Sine of the elevation of every satellite seen from every user
+    :param users_xyz: (N_users, 3) user positions
+    :param satellites_xyz: (T, N_sats, 3) satellite positions
+    :return: (T, N_sats, N_users) array; the sine is monotone in the elevation, so no acos is needed
+    """
+    users_xyz = np.asarray(users_xyz, dtype=np.float64)
+    satellites_xyz = np.asarray(satellites_xyz, dtype=np.float64)
+    # Per-user terms are computed once instead of once per satellite
+    user_norm_sq = np.einsum('ij,ij->i', users_xyz, users_xyz)
+    user_norm = np.sqrt(user_norm_sq)
+    sat_norm_sq = np.einsum('tnk,tnk->tn', satellites_xyz, satellites_xyz)
+    # u.(s - u) and |s - u| expanded so the only (T, N_sats, N_users) product is one matmul
+    user_dot_sat = satellites_xyz @ users_xyz.T
+    range_sq = sat_norm_sq[:, :, None] - 2 * user_dot_sat + user_norm_sq
+    return (user_dot_sat - user_norm_sq) / (user_norm * np.sqrt(range_sq))
+
+
+def slant_range(altitude, elevation_angle):
+    """
+    Distance between a ground user and a satellite at the given altitude seen at the given elevation
+    (spherical Earth, the geometry of propagation.lon_lat_alt_to_xyz), so the range of a chosen satellite
+    follows from its elevation without another pass over the positions; at the minimum elevation angle it is the
+    largest distance at which the satellite is visible
+    :param altitude: Satellite altitude(s) in km
+    :param elevation_angle: Elevation(s) in degrees
+    :return: Distance(s) in km
+    """
+    elevation = np.radians(elevation_angle)
+    orbit_radius = EARTH_RADIUS_KM + np.asarray(altitude, dtype=np.float64)
+    return (np.sqrt(orbit_radius ** 2 - (EARTH_RADIUS_KM * np.cos(elevation)) ** 2)
+            - EARTH_RADIUS_KM * np.sin(elevation))
+
+
+def nearest_candidates(tree, users_xyz, radius, num_satellites, candidates=16):
+    """
+    All satellites of a KD-tree within radius of every user
+    :param candidates: Initial number of nearest satellites fetched per user, doubled while it is too small
+    :return: (index, found): (N_users, k) satellite indexes in increasing order, padded with num_satellites,
+             and the mask of real entries
+    """
+    k = min(candidates, num_satellites)
+    while True:
+        _, index = tree.query(users_xyz, k=k, distance_upper_bound=radius)
+        index = index.reshape(len(users_xyz), k)
+        # Missing neighbours are reported as index num_satellites; all k found means some may be missing
+        if k == num_satellites or not (index[:, -1] < num_satellites).any():
+            break
+        k = min(2 * k, num_satellites)
+    # Candidates in column order, so the first satellite wins ties as in the exhaustive search
+    index = np.sort(index, axis=1)
+    return index, index < num_satellites
+
+
+def best_satellite_per_timeslot(users_xyz, satellites_xyz, min_elevation_angle, satellite_altitude,
+                                users_per_query=None, candidates=16):
+    """
+    Highest-elevation visible satellite of every user, one timeslot at a time: the KD-tree of a timeslot is built
+    once and queried by all users, users_per_query at a time, so temporary memory does not grow with the users.
+    Without scipy every satellite is tested, users_per_query users at a time
+    :param satellite_altitude: (N_sats,) altitude of every satellite column in km
+    :param users_per_query: Users per KD-tree query, all users at once by default
+    :param candidates: Initial number of nearest satellites fetched per user, doubled while it is too small
+    :return: Generator of (time_step_index, (N_users,) int32 best, (N_users,) float32 elevation), as one column
+             of best_satellite_by_timeslot
+    """
+    users_xyz = np.asarray(users_xyz, dtype=np.float64)
+    num_time_steps, num_satellites = satellites_xyz.shape[:2]
+    num_users = len(users_xyz)
+    users_per_query = users_per_query or max(num_users, 1)
+    threshold = np.sin(np.radians(min_elevation_angle))
+    # One search radius for all shells: the highest shell sees the farthest; the exact test below removes the rest
+    radius = float(np.max(slant_range(satellite_altitude, min_elevation_angle)))
+    user_norm = np.linalg.norm(users_xyz, axis=1)
+    for time_step_index in range(num_time_steps):
+        positions = np.asarray(satellites_xyz[time_step_index], dtype=np.float64)
+        tree = cKDTree(positions) if SCIPY_AVAILABLE else None
+        best = np.full(num_users, -1, dtype=np.int32)
+        elevation = np.full(num_users, np.nan, dtype=np.float32)
+        for begin in range(0, num_users, users_per_query):
+            end = min(begin + users_per_query, num_users)
+            query_xyz = users_xyz[begin:end]
+            if tree is None:
+                query_best, query_elevation = best_satellite_by_timeslot(query_xyz, positions[None],
+                                                                         min_elevation_angle)
+                best[begin:end], elevation[begin:end] = query_best[:, 0], query_elevation[:, 0]
+                continue
+            index, found = nearest_candidates(tree, query_xyz, radius, num_satellites, candidates)
+            relative = positions[np.minimum(index, num_satellites - 1)] - query_xyz[:, None, :]
+            sin_elev = (np.einsum('ukj,uj->uk', relative, query_xyz)
+                        / (user_norm[begin:end, None] * np.linalg.norm(relative, axis=-1)))
+            sin_elev = np.where(found, sin_elev, -np.inf)
+            chosen = np.argmax(sin_elev, axis=1)
+            chosen_sin = sin_elev[np.arange(end - begin), chosen]
+            visible = chosen_sin >= threshold
+            best[begin:end] = np.where(visible, index[np.arange(end - begin), chosen], -1)
+            elevation[begin:end] = np.where(visible, np.degrees(np.arcsin(np.clip(chosen_sin, -1, 1))), np.nan)
+        yield time_step_index, best, elevation
+
+
+def best_satellite_indexed(users_xyz, satellites_xyz, min_elevation_angle, satellite_altitude, candidates=16):
+    """
+    best_satellite_by_timeslot with a KD-tree over the satellite positions of every timeslot:
+    only satellites within the maximum slant range of their shell altitude are tested, O(users x k) per timeslot
+    :param satellite_altitude: (N_sats,) altitude of every satellite column in km
+    :param candidates: Initial number of nearest satellites fetched per user, doubled while it is too small
+    :return: Same as best_satellite_by_timeslot
+    """
+    num_users = len(users_xyz)
+    num_time_steps = len(satellites_xyz)
+    best = np.full((num_users, num_time_steps), -1, dtype=np.int32)
+    elevation = np.full((num_users, num_time_steps), np.nan, dtype=np.float32)
+    for time_step_index, step_best, step_elevation in best_satellite_per_timeslot(
+            users_xyz, satellites_xyz, min_elevation_angle, satellite_altitude, candidates=candidates):
+        best[:, time_step_index] = step_best
+        elevation[:, time_step_index] = step_elevation
+    return best, elevation
+
+
+def best_satellite_by_timeslot(users_xyz, satellites_xyz, min_elevation_angle, chunk_size=64,
+                               satellite_altitude=None):
+    """
+    Highest-elevation visible satellite of every user at every timeslot (batched process_user)
+    :param users_xyz: (N_users, 3) user positions
+    :param satellites_xyz: (T, N_sats, 3) satellite positions
+    :param min_elevation_angle: Minimum elevation angle in degrees
+    :param chunk_size: Number of timeslots evaluated at once (bounds temporary memory)
+    :param satellite_altitude: Optional (N_sats,) altitudes in km; when given (and scipy is installed) only the
+                               satellites found by best_satellite_indexed are tested
+    :return: (best, elevation): (N_users, T) int32 satellite indexes (-1 if nothing is visible) and
+             float32 elevations in degrees of the chosen satellite (NaN if nothing is visible)
+    """
+    if satellite_altitude is not None and SCIPY_AVAILABLE:
+        return best_satellite_indexed(users_xyz, satellites_xyz, min_elevation_angle, satellite_altitude)
+    num_time_steps = len(satellites_xyz)
+    num_users = len(users_xyz)
+    threshold = np.sin(np.radians(min_elevation_angle))
+    best = np.full((num_users, num_time_steps), -1, dtype=np.int32)
+    elevation = np.full((num_users, num_time_steps), np.nan, dtype=np.float32)
+    for begin in range(0, num_time_steps, chunk_size):
+        end = min(begin + chunk_size, num_time_steps)
+        sin_elev = sin_elevation(users_xyz, satellites_xyz[begin:end])
+        chosen = np.argmax(sin_elev, axis=1)  # (t, N_users), first satellite wins ties as in process_user
+        chosen_sin = np.take_along_axis(sin_elev, chosen[:, None, :], axis=1)[:, 0, :]
+        visible = chosen_sin >= threshold
+        best[:, begin:end] = np.where(visible, chosen, -1).T
+        elevation[:, begin:end] = np.where(visible, np.degrees(np.arcsin(np.clip(chosen_sin, -1, 1))), np.nan).T
+    return best, elevation
+
+
+def visible_satellites(users_xyz, satellites_xyz, min_elevation_angle, chunk_size=16, satellite_altitude=None):
+    """
+    Every satellite visible to every user at every timeslot, with its elevation
+    :param users_xyz: (N_users, 3) user positions
+    :param satellites_xyz: (T, N_sats, 3) satellite positions
+    :param min_elevation_angle: Minimum elevation angle in degrees
+    :param chunk_size: Number of timeslots evaluated at once by the exhaustive search
+    :param satellite_altitude: Optional (N_sats,) altitudes in km, enables the KD-tree candidate search
+    :return: (columns, elevation): (N_users, T, K) int32 satellite indexes in increasing order, padded with -1, and
+             float32 elevations in degrees, padded with NaN; K is the largest number of satellites visible at once
+    """
+    users_xyz = np.asarray(users_xyz, dtype=np.float64)
+    num_time_steps, num_satellites = satellites_xyz.shape[:2]
+    num_users = len(users_xyz)
+    threshold = np.sin(np.radians(min_elevation_angle))
+    # Visible (user, timeslot, column, sin elevation) entries, ordered by user, timeslot and column
+    user_parts, time_parts, column_parts, sin_parts = [], [], [], []
+    if satellite_altitude is not None and SCIPY_AVAILABLE:
+        radius = float(np.max(slant_range(satellite_altitude, min_elevation_angle)))
+        user_norm = np.linalg.norm(users_xyz, axis=1)
+        for time_step_index in range(num_time_steps):
+            positions = np.asarray(satellites_xyz[time_step_index], dtype=np.float64)
+            index, found = nearest_candidates(cKDTree(positions), users_xyz, radius, num_satellites)
+            relative = positions[np.minimum(index, num_satellites - 1)] - users_xyz[:, None, :]
+            sin_elev = (np.einsum('ukj,uj->uk', relative, users_xyz)
+                        / (user_norm[:, None] * np.linalg.norm(relative, axis=-1)))
+            user_index, slot = np.nonzero(found & (sin_elev >= threshold))
+            user_parts.append(user_index)
+            time_parts.append(np.full(len(user_index), time_step_index))
+            column_parts.append(index[user_index, slot])
+            sin_parts.append(sin_elev[user_index, slot])
+    else:
+        for begin in range(0, num_time_steps, chunk_size):
+            end = min(begin + chunk_size, num_time_steps)
+            sin_elev = sin_elevation(users_xyz, satellites_xyz[begin:end]).transpose(2, 0, 1)  # (N_users, t, N_sats)
+            user_index, time_index, column = np.nonzero(sin_elev >= threshold)
+            user_parts.append(user_index)
+            time_parts.append(begin + time_index)
+            column_parts.append(column)
+            sin_parts.append(sin_elev[user_index, time_index, column])
+    user_index = np.concatenate(user_parts).astype(np.int64)
+    time_index = np.concatenate(time_parts).astype(np.int64)
+    column = np.concatenate(column_parts)
+    sin_elev = np.concatenate(sin_parts)
+    order = np.lexsort((column, time_index, user_index))
+    return pad_visible(num_users, num_time_steps, user_index[order], time_index[order], column[order],
+                       np.degrees(np.arcsin(np.clip(sin_elev[order], -1, 1))))
+
+
+def pad_visible(num_users, num_time_steps, user_index, time_index, column, elevation):
+    """
+    Scatter visible (user, timeslot, column, elevation) entries, sorted by user, timeslot and column,
+    into the padded (N_users, T, K) arrays returned by visible_satellites
+    """
+    # Position of every entry within its (user, timeslot) group
+    group = user_index.astype(np.int64) * num_time_steps + time_index
+    group_start = np.searchsorted(group, group, side="left")
+    slot = np.arange(len(group)) - group_start
+    max_visible = int(slot.max()) + 1 if len(slot) else 0
+    columns = np.full((num_users, num_time_steps, max_visible), -1, dtype=np.int32)
+    padded_elevation = np.full((num_users, num_time_steps, max_visible), np.nan, dtype=np.float32)
+    columns[user_index, time_index, slot] = column
+    padded_elevation[user_index, time_index, slot] = elevation
+    return columns, padded_elevation
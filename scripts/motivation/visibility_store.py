@@ -0,0 +1,186 @@
+import datetime
+import hashlib
+import os
+import numpy as np
+import handoff_policies
+import position_store
+import visibility
+
+
+# Single-file store of the satellites visible to every user, so policies, thresholds and statistics can be
+# recomputed without touching satellite positions again. Columnar format of position_store.
+# Visibility is a CSR matrix with one row per (user, timeslot), row = user * num_time_steps + timeslot:
+# indptr (rows + 1,) int64, then per visible satellite its column (int32, increasing within a row) and its
+# elevation quantized to ELEVATION_SCALE degrees (uint16, rounded down, so thresholds on the grid stay exact).
+MAGIC = b"SATVIS01"
+ELEVATION_SCALE = 0.01
+VISIBILITY_STORE_FILE = os.path.join("output", "visibility.bin")
+
+
+def quantize_elevation(elevation, scale=ELEVATION_SCALE):
+    """Elevations in degrees -> uint16 codes (rounded down)"""
+    return np.floor(np.asarray(elevation, dtype=np.float64) / scale + 1e-6).astype(np.uint16)
+
+
+def threshold_code(min_elevation_angle, scale=ELEVATION_SCALE):
+    """Smallest code of an elevation at or above min_elevation_angle"""
+    return int(np.ceil(min_elevation_angle / scale - 1e-6))
+
+
+def source_digest(users_xyz, satellites):
+    """
+    Identity of the inputs a store was computed from, compared before it is reused: SHA-256 of the user
+    positions, the satellite columns (sat_id, shell), the time grid and the satellite positions of the first,
+    middle and last timeslots (any other propagation or position store differs there)
+    :param users_xyz: (N_users, 3) user positions
+    :param satellites: position_arrays.SatellitePositions
+    :return: Hexadecimal digest
+    """
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(users_xyz, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(satellites.sat_id, dtype=np.int32).tobytes())
+    digest.update(np.ascontiguousarray(satellites.shell, dtype=np.int32).tobytes())
+    digest.update(f"{satellites.start_time.isoformat()} {satellites.time_step.total_seconds()} "
+                  f"{satellites.num_time_steps}".encode("utf-8"))
+    num_time_steps = satellites.num_time_steps
+    for time_step_index in sorted({0, num_time_steps // 2, num_time_steps - 1}):
+        for column in satellites.time_step_positions(time_step_index):
+            digest.update(np.ascontiguousarray(column, dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+
+class VisibilityStore:
+    """Memory-mapped visibility of every user at every timeslot"""
+
+    def __init__(self, path, header):
+        self.path = path
+        self.header = header
+        self.num_users = header["num_users"]
+        self.num_time_steps = header["num_time_steps"]
+        self.num_satellites = header["num_satellites"]
+        self.min_elevation_angle = header["min_elevation_angle"]
+        self.elevation_scale = header["elevation_scale"]
+        self.start_time = datetime.datetime.fromisoformat(header["start_time"])
+        self.time_step = datetime.timedelta(seconds=header["time_step_seconds"])
+        self.metadata = header.get("metadata")
+        self.source = header.get("source")
+        for name, column in position_store.map_columns(path, header).items():
+            setattr(self, name, column)
+        self.user_names = [name.decode("utf-8") for name in self.user_name.tolist()]
+
+    @property
+    def num_entries(self):
+        return len(self.column)
+
+    def user_entries(self, user_index):
+        """Entry range of one user: all its timeslots are consecutive rows"""
+        return (int(self.indptr[user_index * self.num_time_steps]),
+                int(self.indptr[(user_index + 1) * self.num_time_steps]))
+
+    def elevation_degrees(self, begin=0, end=None):
+        """Decoded elevations of entries begin:end (lower edge of their quantization step)"""
+        return self.elevation[begin:end].astype(np.float32) * np.float32(self.elevation_scale)
+
+    def visible_counts(self, min_elevation_angle=None):
+        """
+        Number of satellites visible to every user at every timeslot
+        :param min_elevation_angle: Threshold in degrees, at least the one of the store; defaults to the store's
+        :return: (N_users, T) int32
+        """
+        num_rows = self.num_users * self.num_time_steps
+        if min_elevation_angle is None or min_elevation_angle <= self.min_elevation_angle:
+            return np.diff(self.indptr).astype(np.int32).reshape(self.num_users, self.num_time_steps)
+        row = np.repeat(np.arange(num_rows), np.diff(self.indptr))
+        keep = self.elevation >= threshold_code(min_elevation_angle, self.elevation_scale)
+        return np.bincount(row[keep], minlength=num_rows).astype(np.int32).reshape(
+            self.num_users, self.num_time_steps)
+
+    def tensor(self, min_elevation_angle=None, user_indexes=None):
+        """
+        Padded visibility tensor for handoff_policies, rebuilt from the stored entries
+        :param min_elevation_angle: Threshold in degrees, at least the one the store was built with
+        :param user_indexes: Optional subset of users (in the given order), all users by default
+        :return: handoff_policies.VisibilityTensor with quantized elevations; satellites less than one quantization
+                 step apart tie, and ties go to the lower column
+        """
+        if min_elevation_angle is None:
+            min_elevation_angle = self.min_elevation_angle
+        if min_elevation_angle < self.min_elevation_angle:
+            raise ValueError(f"{self.path} only holds satellites above {self.min_elevation_angle} degrees")
+        if user_indexes is None:
+            user_indexes = range(self.num_users)
+        user_parts, time_parts, column_parts, code_parts = [], [], [], []
+        for position, user_index in enumerate(user_indexes):
+            first_row = user_index * self.num_time_steps
+            counts = np.diff(self.indptr[first_row:first_row + self.num_time_steps + 1])
+            begin, end = self.user_entries(user_index)
+            time_index = np.repeat(np.arange(self.num_time_steps), counts)
+            user_parts.append(np.full(end - begin, position))
+            time_parts.append(time_index)
+            column_parts.append(self.column[begin:end])
+            code_parts.append(self.elevation[begin:end])
+        num_users = len(user_parts)
+        user_index = np.concatenate(user_parts).astype(np.int64) if user_parts else np.zeros(0, np.int64)
+        time_index = np.concatenate(time_parts).astype(np.int64) if time_parts else np.zeros(0, np.int64)
+        column = np.concatenate(column_parts) if column_parts else np.zeros(0, np.int32)
+        code = np.concatenate(code_parts) if code_parts else np.zeros(0, np.uint16)
+        keep = code >= threshold_code(min_elevation_angle, self.elevation_scale)
+        elevation = code[keep].astype(np.float32) * np.float32(self.elevation_scale)
+        return handoff_policies.VisibilityTensor(*visibility.pad_visible(
+            num_users, self.num_time_steps, user_index[keep], time_index[keep], column[keep], elevation))
+
+
+def write_visibility_store(path, user_names, tensor, min_elevation_angle, sat_id, shell, start_time, time_step,
+                           metadata=None, elevation_scale=ELEVATION_SCALE, source=None):
+    """
+    Save a visibility tensor
+    :param path: Output file path
+    :param user_names: Name of every user, in tensor order
+    :param tensor: handoff_policies.VisibilityTensor (or any object with padded columns and elevation arrays)
+    :param min_elevation_angle: Threshold the tensor was computed with, in degrees
+    :param sat_id: Global satellite ID of each column
+    :param shell: Shell of each column
+    :param start_time: datetime of timeslot 0
+    :param time_step: datetime.timedelta between timeslots
+    :param metadata: Optional JSON-serializable description of the run
+    :param source: Optional source_digest of the users and satellite positions the tensor was computed from
+    :return: Read-only VisibilityStore
+    """
+    num_users, num_time_steps = tensor.columns.shape[:2]
+    visible = tensor.columns >= 0
+    # Row-major order of the padded tensor is user, timeslot, increasing column: exactly the CSR order
+    indptr = np.zeros(num_users * num_time_steps + 1, dtype=np.int64)
+    np.cumsum(visible.sum(axis=2).ravel(), out=indptr[1:])
+    encoded_names = [name.encode("utf-8") for name in user_names]
+    arrays = {
+        "indptr": indptr,
+        "column": tensor.columns[visible].astype(np.int32),
+        "elevation": quantize_elevation(tensor.elevation[visible], elevation_scale),
+        "sat_id": np.asarray(sat_id, dtype=np.int32),
+        "shell": np.asarray(shell, dtype=np.int32),
+        "user_name": np.array(encoded_names, dtype=f"S{max([len(name) for name in encoded_names] + [1])}"),
+    }
+
+    header = {
+        "num_users": num_users,
+        "num_time_steps": num_time_steps,
+        "num_satellites": len(arrays["sat_id"]),
+        "min_elevation_angle": min_elevation_angle,
+        "elevation_scale": elevation_scale,
+        "start_time": start_time.isoformat(),
+        "time_step_seconds": time_step.total_seconds(),
+    }
+    if metadata is not None:
+        header["metadata"] = metadata
+    if source is not None:
+        header["source"] = source
+    return VisibilityStore(path, position_store.write_columns(path, MAGIC, header, arrays))
+
+
+def open_visibility_store(path=VISIBILITY_STORE_FILE):
+    """
+    Open an existing store read-only; every column is a zero-copy memory map
+    :param path: Store file path
+    :return: VisibilityStore
+    """
+    return VisibilityStore(path, position_store.read_header(path, MAGIC, "a visibility store"))